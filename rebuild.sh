@@ -2,6 +2,8 @@ pip3 install --upgrade pip
 pip3 install -r web/requirements.txt
 python3 web/manage.py makemigrations survey
 python3 web/manage.py migrate
+python3 web/manage.py move_question_answers
+python3 web/manage.py move_sensor_values
 sudo docker-compose down
 sudo docker-compose build --no-cache
 sudo docker-compose up -d
@@ -0,0 +1,9 @@
+# run the test suite against PostgreSQL in a throwaway docker container
+sudo docker run -d --name mind_rate_test_db -e POSTGRES_USER=mind_rate -e POSTGRES_PASSWORD=mind_rate \
+    -p 127.0.0.1:54320:5432 postgres:9.6
+until sudo docker exec mind_rate_test_db pg_isready -U mind_rate; do sleep 1; done
+DATABASE_ENGINE=postgresql POSTGRES_HOST=127.0.0.1 POSTGRES_PORT=54320 POSTGRES_PASSWORD=mind_rate \
+    python3 web/manage.py test mind_rate_server.survey
+status=$?
+sudo docker rm -f mind_rate_test_db
+exit $status
@@ -0,0 +1,234 @@
+"""
+Synthetic studies, probands and answers in the database, for the benchmarks.
+
+Everything is written with bulk inserts, so that a study with millions of question answers can be generated
+in minutes. The data is shaped like what the admin and the app produce: every questionnaire has questions of
+all four types, choice options, follow-up chains of single choice questions leading to hidden questions,
+and answers with sensor values.
+
+Django must be set up before this module is imported, as manage.py test and the benchmark scripts do.
+"""
+import datetime
+import random
+
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+from mind_rate_server.survey.counters import increment_answer_counter
+from mind_rate_server.survey.ingest import QUESTION_MODELS
+from mind_rate_server.survey.models import Study, ProbandInfoQuestionnaire, Questionnaire, TriggerEvent, \
+    TextQuestion, DragScaleQuestion, SingleChoiceQuestion, MultiChoiceQuestion, ChoiceOption, Proband, \
+    ProbandInfoCell, QuestionnaireAnswer, QuestionAnswer
+
+QUESTION_TYPE_NAMES = {model: name for name, model in QUESTION_MODELS.items()}
+
+# the order of the question types in a questionnaire; the follow-up chains come first
+QUESTION_MODEL_ORDER = (SingleChoiceQuestion, TextQuestion, DragScaleQuestion, MultiChoiceQuestion)
+
+TEXT_ANSWERS = ("I feel fine, thanks for asking", "A bit tired", "Stressed, too much work today",
+                "Great, just went for a run", "Nothing special")
+
+ANSWER_BATCH_SIZE = 1000  # questionnaire answers inserted at once
+
+
+class StudySpec(object):
+    """
+    The shape of a generated study.
+
+    questions_per_type questions of every type per questionnaire, option_count options per choice question,
+    and the first chain_length single choice questions of every questionnaire linked to a follow-up chain:
+    the first option of each leads to the next one, which is hidden by default.
+    """
+    def __init__(self, questionnaire_count=20, questions_per_type=4, option_count=4, chain_length=3):
+        self.questionnaire_count = questionnaire_count
+        self.questions_per_type = questions_per_type
+        self.option_count = option_count
+        self.chain_length = min(chain_length, questions_per_type)
+
+    def to_dict(self):
+        return dict(vars(self))
+
+
+def _create_questions(questionnaire, spec):
+    # returns the questions of the questionnaire in the order of their positions
+    position = 0
+    for model in QUESTION_MODEL_ORDER:
+        question_list = []
+        for i in range(spec.questions_per_type):
+            position += 1
+            # the questions a chain leads to are only shown when the previous one was answered with its first option
+            hidden = model is SingleChoiceQuestion and 0 < i < spec.chain_length
+            question_list.append(model(questionnaire=questionnaire, position=position, show_by_default=not hidden,
+                                       question_text="How do you feel right now? (question %d)" % position))
+        model.objects.bulk_create(question_list)
+
+    question_list = []
+    for model in QUESTION_MODEL_ORDER:
+        question_list.extend(model.objects.filter(questionnaire=questionnaire))
+    question_list.sort(key=lambda question: question.position)
+
+    option_list = []
+    for question in question_list:
+        if isinstance(question, SingleChoiceQuestion):
+            in_chain = question.position < spec.chain_length
+            for j in range(spec.option_count):
+                option_list.append(ChoiceOption(single_choice_question=question, choice_text="Option %d" % j,
+                                                next_question_position=question.position + 1
+                                                if j == 0 and in_chain else None))
+        elif isinstance(question, MultiChoiceQuestion):
+            for j in range(spec.option_count):
+                option_list.append(ChoiceOption(multi_choice_question=question, choice_text="Option %d" % j))
+    ChoiceOption.objects.bulk_create(option_list)
+
+    return question_list
+
+
+def create_study(spec, owner=None, name="Benchmark study"):
+    """
+    Returns a new study shaped by spec, with a proband info questionnaire asking all questions.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        study = Study.objects.create(owner=owner, name=name, start_date_time=now,
+                                     end_date_time=now + datetime.timedelta(days=30))
+        proband_info_questionnaire = ProbandInfoQuestionnaire.objects.create(
+            study=study, ask_for_birthday=True, ask_for_occupation=True, ask_for_gender=True)
+        TextQuestion.objects.create(proband_info_questionnaire=proband_info_questionnaire, position=1,
+                                    question_text="Where do you live?")
+
+        for i in range(spec.questionnaire_count):
+            questionnaire = Questionnaire.objects.create(study=study, name="Questionnaire %d" % i,
+                                                         due_after=datetime.timedelta(hours=24))
+            TriggerEvent.objects.create(questionnaire=questionnaire, time=datetime.time(9 + i % 12, 30),
+                                        min_time_space=datetime.timedelta(minutes=10), light="M", proximity="VH")
+            _create_questions(questionnaire, spec)
+
+    return Study.objects.get(id=study.id)
+
+
+def create_probands(study, count, info=True):
+    """
+    Returns the IDs of count new probands of the study; with info, every proband has answered
+    the proband info questionnaire.
+    """
+    with transaction.atomic():
+        Proband.objects.bulk_create([Proband(study=study) for i in range(count)])
+        proband_id_list = sorted(Proband.objects.filter(study=study).order_by('-id')
+                                 .values_list('id', flat=True)[:count])
+        if info:
+            cell_list = []
+            for proband_id in proband_id_list:
+                cell_list.extend([
+                    ProbandInfoCell(proband_id=proband_id, key='birthday',
+                                    value='1990-%02d-15' % (proband_id % 12 + 1)),
+                    ProbandInfoCell(proband_id=proband_id, key='gender', value=('female', 'male')[proband_id % 2]),
+                    ProbandInfoCell(proband_id=proband_id, key='occupation', value='Student'),
+                    ProbandInfoCell(proband_id=proband_id, key='Where do you live?', value='Munich'),
+                ])
+            ProbandInfoCell.objects.bulk_create(cell_list)
+    return proband_id_list
+
+
+def generate_sensor_values(rng):
+    return {
+        "light": "%.1f" % rng.uniform(0, 2000),
+        "temperature": "%.1f" % rng.uniform(10, 35),
+        "relativeHumidity": "%.1f" % rng.uniform(20, 80),
+        "airPressure": "%.1f" % rng.uniform(980, 1040),
+        "proximity": "%.1f" % rng.choice((0.0, 5.0)),
+        "activity": rng.choice(("STILL", "WALKING", "RUNNING", "IN_VEHICLE")),
+    }
+
+
+def generate_answer(question, rng):
+    # an answer to question as the app sends it
+    if isinstance(question, TextQuestion):
+        return rng.choice(TEXT_ANSWERS)
+    if isinstance(question, DragScaleQuestion):
+        return "%.1f" % rng.uniform(question.min_value, question.max_value)
+    option_list = ["Option %d" % j for j in range(max(question.choiceoption_count, 1))]
+    if isinstance(question, SingleChoiceQuestion):
+        return rng.choice(option_list)
+    return ",".join(rng.sample(option_list, rng.randint(1, len(option_list))))
+
+
+def get_questions(study):
+    # the questions of every questionnaire of the study in the order of their positions, with their option count
+    question_dict = {}
+    for model in QUESTION_MODEL_ORDER:
+        queryset = model.objects.filter(questionnaire__study=study)
+        if model in (SingleChoiceQuestion, MultiChoiceQuestion):
+            option_field = 'single_choice_question' if model is SingleChoiceQuestion else 'multi_choice_question'
+            option_count_dict = dict(
+                ChoiceOption.objects.filter(**{option_field + '__questionnaire__study': study})
+                .values_list(option_field).annotate(count=Count('id')))
+        else:
+            option_count_dict = {}
+        for question in queryset:
+            question.choiceoption_count = option_count_dict.get(question.id, 0)
+            question_dict.setdefault(question.questionnaire_id, []).append(question)
+    for question_list in question_dict.values():
+        question_list.sort(key=lambda question: question.position)
+    return question_dict
+
+
+def generate_submission(proband_id, questionnaire_id, question_list, rng, submit_time=None):
+    """
+    A submission of the app answering a questionnaire, as sent to /receive_answer/.
+    """
+    submit_time = submit_time or datetime.datetime(2017, 6, 1, 12, 30)
+    return {
+        "probandID": str(proband_id),
+        "questionnaireID": str(questionnaire_id),
+        "submitTime": {"year": submit_time.year, "month": submit_time.month, "day": submit_time.day,
+                       "hour": submit_time.hour, "minute": submit_time.minute, "second": submit_time.second},
+        "sensorValues": generate_sensor_values(rng),
+        "questionAnswer": [{"questionType": QUESTION_TYPE_NAMES[type(question)], "questionID": str(question.id),
+                            "answer": generate_answer(question, rng)} for question in question_list],
+    }
+
+
+def create_answers(study, proband_id_list, count, seed=0, progress=None):
+    """
+    Insert count questionnaire answers of the probands to random questionnaires of the study, each answering
+    all questions and with sensor values, and count them in the answer counter of the study.
+
+    progress is called with the number of questionnaire answers inserted so far after every batch.
+    """
+    rng = random.Random(seed)
+    question_dict = get_questions(study)
+    questionnaire_id_list = sorted(question_dict)
+    start_time = datetime.datetime(2017, 6, 1, tzinfo=timezone.utc)
+    order_dict = {questionnaire_id: QuestionnaireAnswer.objects.filter(questionnaire_id=questionnaire_id).count()
+                  for questionnaire_id in questionnaire_id_list}
+
+    created_count = 0
+    while created_count < count:
+        batch_size = min(ANSWER_BATCH_SIZE, count - created_count)
+        with transaction.atomic():
+            questionnaire_answer_list = []
+            for i in range(batch_size):
+                questionnaire_id = rng.choice(questionnaire_id_list)
+                questionnaire_answer = QuestionnaireAnswer(
+                    questionnaire_id=questionnaire_id, submitter_id=rng.choice(proband_id_list),
+                    submit_time=start_time + datetime.timedelta(minutes=created_count + i),
+                    _order=order_dict[questionnaire_id])
+                questionnaire_answer.set_sensor_values(generate_sensor_values(rng))
+                order_dict[questionnaire_id] += 1
+                questionnaire_answer_list.append(questionnaire_answer)
+            QuestionnaireAnswer.objects.bulk_create(questionnaire_answer_list)
+
+            # SQLite doesn't return the IDs of inserted rows; no other answer can be inserted in the meantime
+            id_list = sorted(QuestionnaireAnswer.objects.order_by('-id').values_list('id', flat=True)[:batch_size])
+            question_answer_list = []
+            for questionnaire_answer_id, questionnaire_answer in zip(id_list, questionnaire_answer_list):
+                for question in question_dict[questionnaire_answer.questionnaire_id]:
+                    question_answer_list.append(QuestionAnswer(questionnaire_answer_id=questionnaire_answer_id,
+                                                               question=question,
+                                                               value=generate_answer(question, rng)))
+            QuestionAnswer.objects.bulk_create(question_answer_list)
+            increment_answer_counter(study.id, batch_size)
+
+        created_count += batch_size
+        if progress is not None:
+            progress(created_count)
@@ -0,0 +1,200 @@
+"""
+The downloaded study as the download view built it before the serializers module: one string extended piece by
+piece with +=. The queries of the old view are replaced by the lists load_study_graph attaches, so that only the
+encoding is compared. It doesn't escape text, fails for choice questions without options and isn't used by
+the server.
+"""
+from mind_rate_server.survey.models import TextQuestion, MultiChoiceQuestion
+
+
+def _get_question_list_json(question_list):
+    if len(question_list) == 0:
+        return "\"questions\": []"
+
+    json_data = "\"questions\": ["
+
+    for question in question_list:
+        option_list = list(question.option_list)
+
+        if len(option_list) != 0:  # the question must be a choice question
+            if isinstance(question, MultiChoiceQuestion):
+                question_type = "MultipleChoice"
+            else:
+                question_type = "SingleChoice"
+        else:  # the question is not a choice question
+            if isinstance(question, TextQuestion):
+                question_type = "TextAnswer"
+            else:
+                question_type = "DragScale"
+
+        if question.show_by_default:
+            show_by_default = "true"
+        else:
+            show_by_default = "false"
+
+        json_data += "{" \
+                     "\"questionID\": \"%d\"," \
+                     "\"questionContent\": \"%s\"," \
+                     "\"showByDefault\": %s," \
+                     % (question.id, question.question_text, show_by_default)
+
+        # display question type specific data
+        json_data += "\"questionType\": {" \
+                     "\"typeName\": \"%s\"" % question_type
+
+        # display options for choice question
+        if question_type == "MultipleChoice" or question_type == "SingleChoice":
+            json_data += ", \"options\": ["
+            for option in option_list:
+
+                # get next question id from next question position
+                next_question_id = ""
+                for q in question_list:
+                    if q.position == option.next_question_position:
+                        next_question_id = q.id
+                        break
+
+                json_data += "{\"optionContent\": \"%s\", \"nextQuestionID\": \"%s\"}," \
+                             % (option.choice_text, next_question_id)
+
+            json_data = json_data[:-1]  # remove the trailing comma
+            json_data += "]"  # end of all options
+
+        # display drag interval for drag scale question
+        elif question_type == "DragScale":
+            json_data += ", \"maxValue\""": %d" % question.max_value
+
+        json_data += "}"  # end of question type
+        json_data += "},"  # end of a question
+
+    json_data = json_data[:-1]  # remove the trailing comma
+    json_data += "]"   # end of all questions
+    return json_data
+
+
+def _get_sensor_json(key, level, ranges, last=False):
+    # the if/elif ladders of the old view, one per sensor
+    if level is not None:
+        if level == "VL":
+            min_value, max_value = ranges[0]
+        elif level == "L":
+            min_value, max_value = ranges[1]
+        elif level == "M":
+            min_value, max_value = ranges[2]
+        elif level == "H":
+            min_value, max_value = ranges[3]
+        elif level == "VH":
+            min_value, max_value = ranges[4]
+        else:
+            min_value, max_value = ranges[5]
+        json_data = "\"%s\": true," \
+                    "\"%sMinValue\": %d," \
+                    "\"%sMaxValue\": %d" % (key, key, min_value, key, max_value)
+    else:
+        json_data = "\"%s\": false" % key
+    return json_data if last else json_data + ","
+
+
+def encode_study(study, proband_id):
+    """
+    Returns the downloaded study of the proband; study must be loaded by load_study_graph.
+    """
+    start_time = study.start_date_time
+    end_time = study.end_date_time
+
+    # study basic info
+    json_data = "{" \
+                "\"study\": {" \
+                "\"probandID\": \"%d\"," \
+                "\"studyId\": \"%d\"," \
+                "\"studyName\": \"%s\"," \
+                "\"beginningDate\": {" \
+                "\"year\": %d," \
+                "\"month\": %d," \
+                "\"day\": %d," \
+                "\"hour\": %d," \
+                "\"minute\": %d," \
+                "\"second\": %d" \
+                "}," \
+                "\"endDate\": {" \
+                "\"year\": %d," \
+                "\"month\": %d," \
+                "\"day\": %d," \
+                "\"hour\": %d," \
+                "\"minute\": %d," \
+                "\"second\": %d" \
+                "}," \
+                % (proband_id, study.id, study.name, start_time.year, start_time.month, start_time.day,
+                   start_time.hour, start_time.minute, start_time.second, end_time.year, end_time.month,
+                   end_time.day, end_time.hour, end_time.minute, end_time.second)
+
+    # proband info questionnaire
+    json_data += "\"probandInfoQuestionnaire\": {"
+    json_data += _get_question_list_json(study.proband_info_question_list)
+    json_data += "},"
+
+    # normal questionnaires
+    json_data += "\"questionnaires\": ["
+    for questionnaire in study.questionnaire_list:
+        trigger_event = questionnaire.triggerevent
+        if questionnaire.due_after is None:
+            duration = 999999999  # default unlimited duration time
+        else:
+            duration = questionnaire.due_after.total_seconds()
+
+        # basic info of a questionnaire
+        json_data += "{" \
+                     "\"questionnaireID\": \"%d\"," \
+                     "\"questionnaireName\": \"%s\"," \
+                     "\"maxShowUpTimesPerDay\": %d," \
+                     "\"duration\": {" \
+                     "\"second\": %d" \
+                     "}," \
+                     % (questionnaire.id, questionnaire.name, questionnaire.max_trigger_times_per_day, duration)
+
+        if trigger_event.datetime is None:
+            date_time = "null"
+        else:
+            date_time = "{" \
+                        "\"year\": %d," \
+                        "\"month\": %d," \
+                        "\"day\": %d," \
+                        "\"hour\": %d," \
+                        "\"minute\": %d," \
+                        "\"second\": %d" \
+                        "}" \
+                        % (trigger_event.datetime.year, trigger_event.datetime.month, trigger_event.datetime.day,
+                           trigger_event.datetime.hour, trigger_event.datetime.minute, trigger_event.datetime.second)
+        if trigger_event.time is None:
+            time = "null"
+        else:
+            time = "\"%d-%d-%d\"" % (trigger_event.time.hour, trigger_event.time.minute, trigger_event.time.second)
+
+        # trigger event of questionnaire
+        json_data += "\"triggerEvent\": {" \
+                     "\"minTimeSpace\": %d," \
+                     "\"datetime\": %s," \
+                     "\"time\": %s," % (trigger_event.min_time_space.total_seconds(), date_time, time)
+
+        json_data += _get_sensor_json("light", trigger_event.light,
+                                      ((0, 4), (0, 50), (50, 400), (400, 40000), (1000, 40000), (0, 40000)))
+        json_data += _get_sensor_json("relativeHumidity", trigger_event.relative_humidity,
+                                      ((0, 20), (0, 40), (30, 70), (60, 100), (80, 100), (0, 100)))
+        json_data += _get_sensor_json("ambientTemperature", trigger_event.temperature,
+                                      ((-50, -10), (-50, 10), (10, 25), (25, 50), (35, 50), (-50, 50)))
+        json_data += _get_sensor_json("pressure", trigger_event.air_pressure,
+                                      ((300, 600), (300, 900), (900, 1100), (1100, 1300), (1200, 1300), (300, 1100)))
+        json_data += _get_sensor_json("proximity", trigger_event.proximity,
+                                      ((0, 1), (0, 3), (3, 6), (6, 10), (8, 10), (0, 10)), last=True)
+        json_data += "},"
+
+        # questions of the questionnaire
+        json_data += _get_question_list_json(questionnaire.question_list)
+
+        json_data += "},"  # end of a questionnaire
+
+    json_data = json_data[:-1]  # remove the trailing comma
+    json_data += "]"  # end of all questionnaires
+    json_data += "}"  # end of study
+    json_data += "}"  # end of json
+    return json_data
@@ -0,0 +1,278 @@
+"""
+Replay a fleet of phones against a running server: every phone downloads the study, then the phones answer
+the questionnaires in bursts at their trigger times.
+
+Usage (from the web directory):
+    python -m benchmarks.load_test --study 1 [--url http://localhost] [--probands 1000] [--download-seconds 10]
+                                   [--gap 10] [--shape exponential] [--spread 2] [--answer-rate 1.0]
+                                   [--concurrency 200] [--timeout 30] [--output load.json]
+    python -m benchmarks.load_test --create-study [--questionnaires 20]
+
+The server is the docker-compose stack (http://localhost) or the Django development server
+(python manage.py runserver, http://localhost:8000). --create-study generates a study with
+benchmarks/generators.py in the database of the settings, so it only helps if the server uses the same database.
+
+All questionnaires with the same TriggerEvent.time fire together. The trigger times are replayed in their order
+of the day, --gap seconds apart. After a trigger, each phone answers with probability --answer-rate, after a delay
+of --shape: 'instant', 'uniform' over --spread seconds, or 'exponential' with a mean of --spread seconds.
+Questionnaires without a time trigger are answered at random times during the whole run.
+
+Latencies are measured from the time a request was scheduled, so they include the time a request waited for
+one of the --concurrency connections; "client wait" shows how long that was at most. If it is large, the load
+generator was the bottleneck and --concurrency should be raised.
+"""
+import argparse
+import collections
+import concurrent.futures
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+SHAPES = ('instant', 'uniform', 'exponential')
+
+TEXT_ANSWERS = ("I feel fine, thanks for asking", "A bit tired", "Stressed, too much work today")
+
+
+class Recorder(object):
+    """
+    Latencies and errors of the requests of the phases of a run.
+    """
+    def __init__(self):
+        self.latency_dict = collections.defaultdict(list)
+        self.error_dict = collections.defaultdict(collections.Counter)
+        self.client_wait_dict = collections.defaultdict(float)
+        self.time_range_dict = {}
+        self._lock = threading.Lock()
+
+    def record(self, phase, scheduled_time, start_time, end_time, error=None):
+        with self._lock:
+            self.latency_dict[phase].append(end_time - scheduled_time)
+            self.client_wait_dict[phase] = max(self.client_wait_dict[phase], start_time - scheduled_time)
+            first_time, last_time = self.time_range_dict.get(phase, (scheduled_time, end_time))
+            self.time_range_dict[phase] = (min(first_time, scheduled_time), max(last_time, end_time))
+            if error is not None:
+                self.error_dict[phase][error] += 1
+
+    def summarize(self):
+        summary = collections.OrderedDict()
+        for phase, latency_list in self.latency_dict.items():
+            latency_list = sorted(latency_list)
+            first_time, last_time = self.time_range_dict[phase]
+            error_count = sum(self.error_dict[phase].values())
+            summary[phase] = {
+                'requests': len(latency_list),
+                'errors': error_count,
+                'error_rate': error_count / len(latency_list),
+                'error_kinds': dict(self.error_dict[phase]),
+                'throughput': len(latency_list) / max(last_time - first_time, 1e-9),  # requests per second
+                'latency_p50': percentile(latency_list, 50),
+                'latency_p95': percentile(latency_list, 95),
+                'latency_p99': percentile(latency_list, 99),
+                'latency_max': latency_list[-1],
+                'client_wait_max': self.client_wait_dict[phase],
+            }
+        return summary
+
+
+def percentile(sorted_list, p):
+    # nearest-rank percentile of a sorted list
+    index = max(math.ceil(p / 100.0 * len(sorted_list)) - 1, 0)
+    return sorted_list[min(index, len(sorted_list) - 1)]
+
+
+def request(url, data=None, timeout=30):
+    """
+    Returns (body, error): the body of a successful response, else None and the HTTP status or exception name.
+    """
+    headers = {'Content-Type': 'application/json'} if data is not None else {}
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, data=data, headers=headers),
+                                    timeout=timeout) as response:
+            return response.read(), None
+    except urllib.error.HTTPError as e:
+        return None, str(e.code)
+    except Exception as e:  # refused or reset connections, timeouts
+        reason = getattr(e, 'reason', e)
+        return None, type(reason).__name__
+
+
+def generate_answer(question, rng):
+    question_type = question['questionType']
+    if question_type['typeName'] == 'DragScale':
+        return "%.1f" % rng.uniform(0, question_type.get('maxValue', 10))
+    option_list = [option['optionContent'] for option in question_type.get('options', [])] or ["Option"]
+    if question_type['typeName'] == 'SingleChoice':
+        return rng.choice(option_list)
+    if question_type['typeName'] == 'MultipleChoice':
+        return ",".join(rng.sample(option_list, rng.randint(1, len(option_list))))
+    return rng.choice(TEXT_ANSWERS)
+
+
+def generate_submission(proband_id, questionnaire, rng):
+    # an answer of all questions of a questionnaire of the downloaded study, as the app sends it
+    now = time.localtime()
+    return {
+        "probandID": proband_id,
+        "questionnaireID": questionnaire['questionnaireID'],
+        "submitTime": {"year": now.tm_year, "month": now.tm_mon, "day": now.tm_mday,
+                       "hour": now.tm_hour, "minute": now.tm_min, "second": now.tm_sec},
+        "sensorValues": {"light": "%.1f" % rng.uniform(0, 2000), "temperature": "%.1f" % rng.uniform(10, 35),
+                         "relativeHumidity": "%.1f" % rng.uniform(20, 80),
+                         "airPressure": "%.1f" % rng.uniform(980, 1040), "proximity": "5.0",
+                         "activity": rng.choice(("STILL", "WALKING", "IN_VEHICLE"))},
+        "questionAnswer": [{"questionType": question['questionType']['typeName'],
+                            "questionID": question['questionID'], "answer": generate_answer(question, rng)}
+                           for question in questionnaire['questions']],
+    }
+
+
+def get_response_delay(shape, spread, rng):
+    if shape == 'instant':
+        return 0.0
+    if shape == 'uniform':
+        return rng.uniform(0, spread)
+    return rng.expovariate(1.0 / spread) if spread > 0 else 0.0
+
+
+def _parse_trigger_time(questionnaire):
+    # "9-30-0" -> seconds after midnight, or None if the questionnaire isn't triggered at a time of day
+    trigger_time = (questionnaire.get('triggerEvent') or {}).get('time')
+    if not trigger_time:
+        return None
+    hour, minute, second = (int(value) for value in trigger_time.split('-'))
+    return hour * 3600 + minute * 60 + second
+
+
+def plan_submissions(proband_id_list, questionnaire_list, args, rng):
+    """
+    Returns (start offset in seconds, submission) of every submission, in start order.
+    """
+    trigger_time_list = sorted({_parse_trigger_time(questionnaire) for questionnaire in questionnaire_list} - {None})
+    burst_offset_dict = {trigger_time: i * args.gap for i, trigger_time in enumerate(trigger_time_list)}
+    duration = max(len(trigger_time_list) - 1, 0) * args.gap + args.spread
+
+    submission_list = []
+    for questionnaire in questionnaire_list:
+        trigger_time = _parse_trigger_time(questionnaire)
+        for proband_id in proband_id_list:
+            if rng.random() >= args.answer_rate:
+                continue
+            if trigger_time is None:
+                offset = rng.uniform(0, duration)
+            else:
+                offset = burst_offset_dict[trigger_time] + get_response_delay(args.shape, args.spread, rng)
+            submission_list.append((offset, generate_submission(proband_id, questionnaire, rng)))
+    submission_list.sort(key=lambda item: item[0])
+    return submission_list
+
+
+def run_schedule(executor, item_list, function):
+    """
+    Call function(scheduled time, *item) for every (start offset, *item) of item_list at its offset from now.
+    """
+    start_time = time.time()
+    future_list = []
+    for offset, *item in item_list:
+        scheduled_time = start_time + offset
+        delay = scheduled_time - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        future_list.append(executor.submit(function, scheduled_time, *item))
+    return [future.result() for future in future_list]
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    recorder = Recorder()
+    base_url = args.url.rstrip('/')
+
+    def download(scheduled_time):
+        start_time = time.time()
+        body, error = request('%s/download/%d/' % (base_url, args.study), timeout=args.timeout)
+        recorder.record('download', scheduled_time, start_time, time.time(), error)
+        return None if body is None else json.loads(body.decode('utf-8'))['study']
+
+    def submit(scheduled_time, submission):
+        data = json.dumps(submission).encode('utf-8')
+        start_time = time.time()
+        body, error = request(base_url + '/receive_answer/', data=data, timeout=args.timeout)
+        recorder.record('receive_answer', scheduled_time, start_time, time.time(), error)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        print("%d phones download the study in %.0f s" % (args.probands, args.download_seconds), file=sys.stderr)
+        study_list = run_schedule(executor, [(rng.uniform(0, args.download_seconds),)
+                                             for i in range(args.probands)], download)
+        study_list = [study for study in study_list if study is not None]
+        if not study_list:
+            raise SystemExit("no download succeeded")
+
+        proband_id_list = [study['probandID'] for study in study_list]
+        submission_list = plan_submissions(proband_id_list, study_list[0]['questionnaires'], args, rng)
+        print("%d phones send %d answers in %.0f s"
+              % (len(proband_id_list), len(submission_list), submission_list[-1][0] if submission_list else 0),
+              file=sys.stderr)
+        run_schedule(executor, submission_list, submit)
+
+    return recorder.summarize()
+
+
+def create_study(args):
+    # set up here, since the load test itself doesn't need Django
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mind_rate_server.settings")
+    import django
+    django.setup()
+    from benchmarks.generators import StudySpec, create_study as create_generated_study
+
+    study = create_generated_study(StudySpec(args.questionnaires, args.questions_per_type, args.options))
+    print(study.id)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--url', default='http://localhost')
+    parser.add_argument('--study', type=int)
+    parser.add_argument('--probands', type=int, default=1000)
+    parser.add_argument('--download-seconds', type=float, default=10)
+    parser.add_argument('--gap', type=float, default=10, help="seconds between two trigger times")
+    parser.add_argument('--shape', choices=SHAPES, default='exponential')
+    parser.add_argument('--spread', type=float, default=2, help="seconds")
+    parser.add_argument('--answer-rate', type=float, default=1.0)
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output')
+    parser.add_argument('--create-study', action='store_true')
+    parser.add_argument('--questionnaires', type=int, default=20)
+    parser.add_argument('--questions-per-type', type=int, default=4)
+    parser.add_argument('--options', type=int, default=4)
+    args = parser.parse_args(argv)
+
+    if args.create_study:
+        create_study(args)
+        return 0
+    if args.study is None:
+        parser.error("--study is required")
+
+    summary = run(args)
+    for phase, result in summary.items():
+        print("%-15s %6d requests %6.1f/s  errors %5.2f%% %s  latency p50 %7.1f ms  p95 %7.1f ms  p99 %7.1f ms"
+              "  max %7.1f ms  client wait %6.1f ms"
+              % (phase, result['requests'], result['throughput'], result['error_rate'] * 100,
+                 ' '.join('%s:%d' % item for item in sorted(result['error_kinds'].items())) or '-',
+                 result['latency_p50'] * 1000, result['latency_p95'] * 1000, result['latency_p99'] * 1000,
+                 result['latency_max'] * 1000, result['client_wait_max'] * 1000))
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump({'arguments': vars(args), 'results': summary}, output_file, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,59 @@
+"""
+Bytes on the wire and CPU time of the available response encodings for downloaded studies of several sizes,
+and of gzip compressed answer submissions.
+
+Usage (from the web directory):
+    python -m benchmarks.response_compression [--repeat 20]
+"""
+import argparse
+import json
+import sys
+import timeit
+
+from benchmarks.study_encoding import build_study
+from mind_rate_server.survey import compression, serializers
+
+# (questionnaires, questions per questionnaire, options per choice question)
+STUDY_SIZES = ((5, 10, 4), (20, 15, 4), (80, 25, 6))
+
+
+def build_submission(question_count):
+    return {
+        "probandID": "12",
+        "questionnaireID": "3",
+        "submitTime": {"year": 2017, "month": 6, "day": 1, "hour": 12, "minute": 30, "second": 0},
+        "sensorValues": {"light": "120.5", "temperature": "21.0", "relativeHumidity": "45.2",
+                         "airPressure": "1013.2", "proximity": "5.0", "activity": "STILL"},
+        "questionAnswer": [{"questionType": "TextAnswer", "questionID": str(i),
+                            "answer": "I feel fine, thanks for asking"} for i in range(question_count)],
+    }
+
+
+def measure(name, data, compress, repeat):
+    seconds = min(timeit.repeat(lambda: compress(data), number=1, repeat=repeat))
+    size = len(compress(data))
+    print("  %-6s %9d bytes (%5.1f%%) %8.3f ms" % (name, size, 100.0 * size / len(data), seconds * 1000))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args(argv)
+
+    for questionnaire_count, question_count, option_count in STUDY_SIZES:
+        data = serializers.splice_proband_id(
+            serializers.encode_study(build_study(questionnaire_count, question_count, option_count)), 1)
+        data = data.encode('utf-8')
+        print("study, %d questionnaires x %d questions: %d bytes"
+              % (questionnaire_count, question_count, len(data)))
+        for name, compress in compression.get_encodings():
+            measure(name, data, compress, args.repeat)
+
+    for question_count in (5, 30):
+        data = json.dumps(build_submission(question_count)).encode('utf-8')
+        print("submission, %d questions: %d bytes" % (question_count, len(data)))
+        measure('gzip', data, compression._compress_gzip, args.repeat)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
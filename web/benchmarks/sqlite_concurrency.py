@@ -0,0 +1,123 @@
+"""
+Compare concurrent answer writes and study reads on SQLite with its default settings and with settings.SQLITE_PRAGMAS.
+
+Usage (from the web directory):
+    python -m benchmarks.sqlite_concurrency [--writers 4] [--readers 4] [--seconds 5] [--timeout 5]
+
+--timeout is the busy timeout of the default connections in seconds, like the 'timeout' database option;
+the tuned connections use the busy_timeout pragma instead.
+"""
+import argparse
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mind_rate_server.settings")
+
+import django  # noqa: E402
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from mind_rate_server.survey.signals import apply_sqlite_pragmas  # noqa: E402
+
+
+def create_database(path, pragmas):
+    connection = sqlite3.connect(path)
+    apply_sqlite_pragmas(connection, pragmas)
+    connection.execute("CREATE TABLE proband (id INTEGER PRIMARY KEY)")
+    connection.execute("CREATE TABLE answer (id INTEGER PRIMARY KEY, proband_id INTEGER, value TEXT)")
+    connection.executemany("INSERT INTO proband (id) VALUES (?)", [(i,) for i in range(100)])
+    connection.commit()
+    connection.close()
+
+
+def connect(path, pragmas, timeout):
+    connection = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+    apply_sqlite_pragmas(connection, pragmas)
+    return connection
+
+
+def write_answers(connection, stop_event, result):
+    # like store_answer: the proband is looked up before the transaction, since Python's sqlite3
+    # only begins a transaction at the first INSERT
+    while not stop_event.is_set():
+        try:
+            connection.execute("SELECT id FROM proband WHERE id = 7").fetchall()
+            connection.execute("BEGIN")
+            connection.executemany("INSERT INTO answer (proband_id, value) VALUES (7, ?)",
+                                   [("answer %d" % i,) for i in range(10)])
+            connection.execute("COMMIT")
+            result['writes'] += 1
+        except sqlite3.OperationalError:  # database is locked
+            if connection.in_transaction:
+                connection.execute("ROLLBACK")
+            result['errors'] += 1
+
+
+def read_answers(connection, stop_event, result):
+    while not stop_event.is_set():
+        try:
+            connection.execute("SELECT proband_id, value FROM answer ORDER BY id DESC LIMIT 200").fetchall()
+            result['reads'] += 1
+        except sqlite3.OperationalError:
+            result['errors'] += 1
+
+
+def run_thread(target, path, pragmas, timeout, stop_event, result):
+    connection = connect(path, pragmas, timeout)
+    try:
+        target(connection, stop_event, result)
+    finally:
+        connection.close()
+
+
+def run(pragmas, writer_count, reader_count, seconds, timeout):
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'benchmark.sqlite3')
+        create_database(path, pragmas)
+
+        stop_event = threading.Event()
+        thread_list = []
+        result_list = []  # one per thread, summed at the end
+        for target, count in ((write_answers, writer_count), (read_answers, reader_count)):
+            for i in range(count):
+                result = {'writes': 0, 'reads': 0, 'errors': 0}
+                result_list.append(result)
+                thread_list.append(threading.Thread(target=run_thread,
+                                                    args=(target, path, pragmas, timeout, stop_event, result)))
+
+        for thread in thread_list:
+            thread.start()
+        time.sleep(seconds)
+        stop_event.set()
+        for thread in thread_list:
+            thread.join()
+
+        return {key: sum(result[key] for result in result_list) for key in ('writes', 'reads', 'errors')}
+    finally:
+        shutil.rmtree(directory)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--timeout', type=float, default=5)
+    args = parser.parse_args(argv)
+
+    for name, pragmas in (('default', {}), ('tuned', settings.SQLITE_PRAGMAS)):
+        result = run(pragmas, args.writers, args.readers, args.seconds, args.timeout)
+        attempts = result['writes'] + result['reads'] + result['errors']
+        print("%-8s %8.0f writes/s %8.0f reads/s %6d lock errors (%.2f%%)"
+              % (name, result['writes'] / args.seconds, result['reads'] / args.seconds, result['errors'],
+                 100.0 * result['errors'] / max(attempts, 1)))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
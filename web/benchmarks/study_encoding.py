@@ -0,0 +1,97 @@
+"""
+Time encoding a downloaded study, without the database, against the string concatenation of the old download view.
+
+Usage (from the web directory):
+    python -m benchmarks.study_encoding [--questionnaires 20] [--questions 15] [--options 4] [--repeat 20]
+"""
+import argparse
+import datetime
+import os
+import sys
+import timeit
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mind_rate_server.settings")
+
+import django  # noqa: E402
+django.setup()
+
+from django.utils import timezone  # noqa: E402
+from benchmarks import legacy_study_encoding  # noqa: E402
+from mind_rate_server.survey import serializers  # noqa: E402
+from mind_rate_server.survey.models import Study, ProbandInfoQuestionnaire, Questionnaire, TriggerEvent, \
+    TextQuestion, DragScaleQuestion, SingleChoiceQuestion, MultiChoiceQuestion, ChoiceOption, \
+    get_sensor_thresholds  # noqa: E402
+
+
+def build_study(questionnaire_count, question_count, option_count):
+    # an unsaved study graph shaped like the result of load_study_graph
+    now = timezone.now()
+    study = Study(id=1, name="Benchmark \"study\"", start_date_time=now,
+                  end_date_time=now + datetime.timedelta(days=30))
+    study.probandinfoquestionnaire = ProbandInfoQuestionnaire(id=1, study=study)
+    study.proband_info_question_list = []
+
+    question_models = (TextQuestion, DragScaleQuestion, SingleChoiceQuestion, MultiChoiceQuestion)
+    question_id = 0
+    study.questionnaire_list = []
+    study.sensor_thresholds = get_sensor_thresholds()
+    for i in range(questionnaire_count):
+        questionnaire = Questionnaire(id=i + 1, study=study, name="Questionnaire %d" % i,
+                                      due_after=datetime.timedelta(hours=24))
+        questionnaire.triggerevent = TriggerEvent(questionnaire=questionnaire, time=datetime.time(9, 30),
+                                                  min_time_space=datetime.timedelta(minutes=10),
+                                                  light="M", proximity="VH")
+        questionnaire.question_list = []
+
+        for position in range(1, question_count + 1):
+            question_id += 1
+            model = question_models[position % len(question_models)]
+            question = model(id=question_id, questionnaire=questionnaire, position=position,
+                             question_text="How do you feel right now? (question %d)" % position)
+            question.option_list = []
+            if model in (SingleChoiceQuestion, MultiChoiceQuestion):
+                for j in range(option_count):
+                    question.option_list.append(ChoiceOption(choice_text="Option %d" % j,
+                                                             next_question_position=position + 1 if j == 0 else None))
+            questionnaire.question_list.append(question)
+
+        study.questionnaire_list.append(questionnaire)
+
+    return study
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--questionnaires', type=int, default=20)
+    parser.add_argument('--questions', type=int, default=15)
+    parser.add_argument('--options', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args(argv)
+
+    study = build_study(args.questionnaires, args.questions, args.options)
+
+    encoders = [('json', None)]
+    if serializers.orjson is not None:
+        encoders.append(('orjson', serializers.orjson))
+
+    if args.options > 0:  # the old view fails for choice questions without options
+        size = len(legacy_study_encoding.encode_study(study, 1).encode('utf-8'))
+        seconds = min(timeit.repeat(lambda: legacy_study_encoding.encode_study(study, 1), number=1,
+                                    repeat=args.repeat))
+        print("%-8s %4d questionnaires x %3d questions: %8.2f ms, %9d bytes"
+              % ('before', args.questionnaires, args.questions, seconds * 1000, size))
+
+    fast_encoder = serializers.orjson
+    try:
+        for name, encoder in encoders:
+            serializers.orjson = encoder
+            size = len(serializers.encode_study(study).encode('utf-8'))
+            seconds = min(timeit.repeat(lambda: serializers.encode_study(study), number=1, repeat=args.repeat))
+            print("%-8s %4d questionnaires x %3d questions: %8.2f ms, %9d bytes"
+                  % (name, args.questionnaires, args.questions, seconds * 1000, size))
+    finally:
+        serializers.orjson = fast_encoder
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,292 @@
+"""
+Time the app endpoints and admin actions on a generated study, with their query counts and peak memory.
+
+Usage (from the web directory):
+    python -m benchmarks.suite [--questionnaires 20] [--questions-per-type 4] [--options 4] [--chain-length 3]
+                               [--probands 100] [--answers 10000] [--repeat 5] [--scenario download ...]
+                               [--keepdb] [--output results.json] [--compare baseline.json] [--threshold 1.2]
+
+The study is generated in a separate test database, like the one of manage.py test. With --keepdb the database
+is kept (for SQLite in benchmark.sqlite3) and its study is reused by the next run, which then ignores the
+generation options.
+
+Each scenario runs --repeat times; the run after them is traced for queries and memory. --output writes the
+results with the current commit as JSON. --compare prints the change against an earlier results file and exits
+with status 1 if a scenario got slower by more than --threshold times or makes more queries.
+"""
+import argparse
+import collections
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mind_rate_server.settings")
+
+import django  # noqa: E402
+django.setup()
+
+from benchmarks.generators import StudySpec, create_study, create_probands, create_answers, get_questions, \
+    generate_submission  # noqa: E402
+from django.conf import settings  # noqa: E402
+from django.contrib.auth.models import User  # noqa: E402
+from django.core.cache import cache  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test import Client, override_settings  # noqa: E402
+from django.test.utils import CaptureQueriesContext, setup_test_environment  # noqa: E402
+from mind_rate_server.survey.export_jobs import process_export_jobs, request_export  # noqa: E402
+from mind_rate_server.survey.journal import get_request_journal  # noqa: E402
+from mind_rate_server.survey.models import Study, Proband, Questionnaire, QuestionnaireAnswer, QuestionAnswer, \
+    ExportJob  # noqa: E402
+
+BATCH_SIZE = 50  # submissions per /receive_answers/ request
+BULK_DOWNLOAD_COUNT = 100  # probands per bulk download
+
+
+class Context(object):
+    """
+    The client and the generated data the scenarios work on.
+    """
+    def __init__(self, study):
+        self.study = study
+        self.proband_id_list = list(Proband.objects.filter(study=study).values_list('id', flat=True))
+        self.question_dict = get_questions(study)
+        self.rng = random.Random(0)
+
+        self.client = Client()
+        user = User.objects.filter(is_superuser=True).first() or \
+            User.objects.create_superuser('benchmark', 'benchmark@example.org', 'benchmark')
+        self.client.force_login(user)
+
+        self.etag = None
+
+    def generate_submission(self):
+        questionnaire_id = self.rng.choice(sorted(self.question_dict))
+        return generate_submission(self.rng.choice(self.proband_id_list), questionnaire_id,
+                                   self.question_dict[questionnaire_id], self.rng)
+
+    def post_action(self, action):
+        return self.client.post('/admin/survey/study/', {'action': action, '_selected_action': [self.study.id]})
+
+
+def _prepare_download_cached(context):
+    # the study is cached by the first request
+    response = context.client.get('/download/%d/' % context.study.id)
+    context.etag = response['ETag']
+
+
+def _prepare_export_job(context):
+    # a new job, since an unchanged study reuses the last file
+    ExportJob.objects.filter(study=context.study).delete()
+    request_export(context.study.id, ExportJob.STUDY_ANSWER, settings.EXPORT_FILE_FORMAT)
+
+
+def _receive_answers(context):
+    submission_list = [context.generate_submission() for i in range(BATCH_SIZE)]
+    body = {"probandID": submission_list[0]["probandID"], "submissions": submission_list}
+    return context.client.post('/receive_answers/', json.dumps(body), content_type='application/json')
+
+
+# name: (prepare function or None, run function); the prepare function isn't timed
+SCENARIOS = collections.OrderedDict([
+    ('download', (lambda context: cache.clear(),
+                  lambda context: context.client.get('/download/%d/' % context.study.id))),
+    ('download_cached', (_prepare_download_cached,
+                         lambda context: context.client.get('/download/%d/' % context.study.id))),
+    ('download_not_modified', (_prepare_download_cached,
+                               lambda context: context.client.get('/download/%d/' % context.study.id,
+                                                                  HTTP_IF_NONE_MATCH=context.etag))),
+    ('bulk_download', (None, lambda context: context.client.get(
+        '/download/%d/bulk/?count=%d' % (context.study.id, BULK_DOWNLOAD_COUNT)))),
+    ('proband_info', (None, lambda context: context.client.get('/proband_info/%d/' % context.study.id))),
+    ('receive_answer', (None, lambda context: context.client.post(
+        '/receive_answer/', json.dumps(context.generate_submission()), content_type='application/json'))),
+    ('receive_answers', (None, _receive_answers)),
+    ('admin_study_changelist', (None, lambda context: context.client.get('/admin/survey/study/'))),
+    ('admin_study_change', (None, lambda context: context.client.get(
+        '/admin/survey/study/%d/change/' % context.study.id))),
+    ('admin_preview_questions', (None, lambda context: context.post_action('preview_questions'))),
+    ('admin_export_study_answer', (None, lambda context: context.post_action('export_study_answer'))),
+    ('admin_export_proband_info', (None, lambda context: context.post_action('export_proband_info'))),
+    ('admin_export_study_answer_in_background', (
+        lambda context: ExportJob.objects.filter(study=context.study).delete(),
+        lambda context: context.post_action('export_study_answer_in_background'))),
+    ('export_job', (_prepare_export_job, lambda context: process_export_jobs())),
+])
+
+
+def _consume(response):
+    # the number of bytes of a response, reading a streamed response to its end
+    if response is None or not hasattr(response, 'status_code'):  # not a request, e.g. an export job
+        return 0
+    if response.status_code >= 400:
+        raise AssertionError("status %d: %s" % (response.status_code, response.content[:200]))
+    if response.streaming:
+        return sum(len(chunk) for chunk in response.streaming_content)
+    return len(response.content)
+
+
+def run_scenario(context, prepare, run, repeat):
+    second_list = []
+    for i in range(repeat):
+        if prepare is not None:
+            prepare(context)
+        start_time = time.perf_counter()
+        response_bytes = _consume(run(context))
+        second_list.append(time.perf_counter() - start_time)
+
+    # traced separately, since tracing slows down the requests
+    if prepare is not None:
+        prepare(context)
+    tracemalloc.start()
+    try:
+        with CaptureQueriesContext(connection) as queries:
+            _consume(run(context))
+        peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'seconds_min': min(second_list),
+        'seconds_median': statistics.median(second_list),
+        'queries': len(queries),
+        'peak_memory_bytes': peak_memory,
+        'response_bytes': response_bytes,
+    }
+
+
+def _get_study(args):
+    study = Study.objects.order_by('id').first()
+    if study is not None:
+        print("reusing study %d" % study.id, file=sys.stderr)
+        return study
+
+    spec = StudySpec(args.questionnaires, args.questions_per_type, args.options, args.chain_length)
+    study = create_study(spec)
+    proband_id_list = create_probands(study, args.probands)
+
+    start_time = time.time()
+    create_answers(study, proband_id_list, args.answers,
+                   progress=lambda count: print("\r%d of %d answers generated" % (count, args.answers),
+                                                end='', file=sys.stderr))
+    print(" in %.0f s" % (time.time() - start_time), file=sys.stderr)
+    return study
+
+
+def _get_data_size(study):
+    return {
+        'questionnaires': Questionnaire.objects.filter(study=study).count(),
+        'questions': sum(len(question_list) for question_list in get_questions(study).values()),
+        'probands': Proband.objects.filter(study=study).count(),
+        'questionnaire_answers': QuestionnaireAnswer.objects.filter(questionnaire__study=study).count(),
+        'question_answers': QuestionAnswer.objects.filter(questionnaire_answer__questionnaire__study=study).count(),
+    }
+
+
+def _get_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(result_dict, baseline_dict, threshold):
+    """
+    Print the change of every scenario against the baseline results; returns the names of the regressions.
+    """
+    regression_list = []
+    for name, result in result_dict.items():
+        baseline = baseline_dict.get(name)
+        if baseline is None:
+            continue
+        ratio = result['seconds_median'] / baseline['seconds_median'] if baseline['seconds_median'] else 1.0
+        query_change = result['queries'] - baseline['queries']
+        regressed = ratio > threshold or query_change > 0
+        print("%-42s %6.2fx time %+5d queries %+10d bytes peak memory%s"
+              % (name, ratio, query_change, result['peak_memory_bytes'] - baseline['peak_memory_bytes'],
+                 "  REGRESSION" if regressed else ""))
+        if regressed:
+            regression_list.append(name)
+    return regression_list
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--questionnaires', type=int, default=20)
+    parser.add_argument('--questions-per-type', type=int, default=4)
+    parser.add_argument('--options', type=int, default=4)
+    parser.add_argument('--chain-length', type=int, default=3)
+    parser.add_argument('--probands', type=int, default=100)
+    parser.add_argument('--answers', type=int, default=10000, help="questionnaire answers")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--scenario', action='append', choices=list(SCENARIOS), help="default: all")
+    parser.add_argument('--keepdb', action='store_true')
+    parser.add_argument('--output')
+    parser.add_argument('--compare')
+    parser.add_argument('--threshold', type=float, default=1.2)
+    args = parser.parse_args(argv)
+
+    setup_test_environment()
+    directory = tempfile.mkdtemp()
+    if connection.vendor == 'sqlite':
+        # a file, so that the benchmarks see disk access like the server
+        connection.settings_dict.setdefault('TEST', {})['NAME'] = os.path.join(
+            settings.BASE_DIR if args.keepdb else directory, 'benchmark.sqlite3')
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False,
+                                                  keepdb=args.keepdb)
+
+    settings_override = override_settings(
+        DEBUG=False, ANSWER_INGEST_MODE='sync', EXPORT_ROOT=os.path.join(directory, 'exports'),
+        EXPORT_ACCEL_REDIRECT_URL=None, REQUEST_JOURNAL_PATH=os.path.join(directory, 'log.txt'))
+    settings_override.enable()
+    try:
+        study = _get_study(args)
+        context = Context(study)
+
+        result_dict = collections.OrderedDict()
+        for name in args.scenario or SCENARIOS:
+            prepare, run = SCENARIOS[name]
+            result_dict[name] = result = run_scenario(context, prepare, run, args.repeat)
+            print("%-42s %9.2f ms %5d queries %10d bytes peak memory %10d bytes response"
+                  % (name, result['seconds_median'] * 1000, result['queries'], result['peak_memory_bytes'],
+                     result['response_bytes']))
+
+        output = {
+            'commit': _get_commit(),
+            'time': datetime.datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'database': connection.vendor,
+            'repeat': args.repeat,
+            'data': _get_data_size(study),
+            'results': result_dict,
+        }
+    finally:
+        get_request_journal().flush()
+        settings_override.disable()
+        connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=args.keepdb)
+        shutil.rmtree(directory)
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(output, output_file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        print("\ncompared with %s (commit %s)" % (args.compare, baseline.get('commit')))
+        if compare(result_dict, baseline['results'], args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,26 @@
+"""
+Production profile of gunicorn for the web container:
+    gunicorn -c gunicorn_config.py mind_rate_server.wsgi:application
+
+Threaded workers keep a long download or export from occupying a whole process, so phone submissions are still
+served while exports run. All values can be overridden through the environment.
+"""
+import multiprocessing
+import os
+
+bind = ':8000'
+
+worker_class = 'gthread'
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 8))  # concurrent requests per worker
+
+# recycle workers after a number of requests, spread out so that they don't all restart at once
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = max_requests // 10
+
+timeout = 120  # seconds before a silent worker is restarted; streamed exports keep writing
+graceful_timeout = 30
+keepalive = 5
+
+# only for development; reloading doesn't work well with many workers
+reload = os.environ.get('GUNICORN_RELOAD') == 'true'
@@ -34,6 +34,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'mind_rate_server.survey.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -67,10 +68,47 @@ WSGI_APPLICATION = 'mind_rate_server.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/1.10/ref/settings/#databases
 
-DATABASES = {
+# SQLite by default; DATABASE_ENGINE=postgresql selects PostgreSQL, e.g. behind the pgbouncer service
+# of docker-compose.postgres.yml
+
+if os.environ.get('DATABASE_ENGINE') == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('POSTGRES_DB', 'mind_rate'),
+            'USER': os.environ.get('POSTGRES_USER', 'mind_rate'),
+            'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+            'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+            'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+            # seconds a connection is kept open for the following requests of a worker
+            'CONN_MAX_AGE': int(os.environ.get('DATABASE_CONN_MAX_AGE', '60')),
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        }
+    }
+
+
+# pragmas set on every new SQLite connection (see survey/signals.py); {} keeps the SQLite defaults
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',  # readers neither block nor wait for the writer
+    'synchronous': 'NORMAL',  # safe with WAL; only the last transactions can be lost on power failure
+    'busy_timeout': 5000,  # milliseconds a write waits for the lock before "database is locked"
+    'cache_size': -16000,  # page cache in KiB
+    'mmap_size': 64 * 1024 * 1024,  # bytes of the database file read through memory-mapped I/O
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/1.10/topics/cache/
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
     }
 }
 
@@ -130,3 +168,53 @@ EMAIL_PORT = 587
 EMAIL_USE_TLS = True
 
 GRAPPELLI_ADMIN_TITLE = 'Mind Rate'
+
+
+# Survey app
+
+# rendered studies are cached per study revision, so they never go stale
+STUDY_JSON_CACHE_TIMEOUT = 60 * 60 * 24
+
+# hours of triggers /schedule/<study_id>/ returns by default and at most; see survey/schedule.py
+SCHEDULE_DEFAULT_HOURS = 24
+SCHEDULE_MAX_HOURS = 24 * 7
+
+# most probands created by one request to /download/<study_id>/bulk/
+BULK_DOWNLOAD_MAX_PROBANDS = 1000
+
+# number of rows the answer counter of a study is spread over to avoid lock contention;
+# 1 updates Study.answer_updated_times directly
+ANSWER_COUNTER_SHARDS = 8
+# seconds between two flushes of the shards into the studies by the process_answer_queue command (worker service)
+ANSWER_COUNTER_FLUSH_INTERVAL = 60
+
+# 'sync' stores answers during the request; 'queue' only appends them to the spool file
+# and leaves storing them to the process_answer_queue management command
+ANSWER_INGEST_MODE = os.environ.get('ANSWER_INGEST_MODE', 'sync')
+ANSWER_SPOOL_PATH = os.environ.get('ANSWER_SPOOL_PATH', os.path.join(BASE_DIR, 'answer_spool.sqlite3'))
+ANSWER_SPOOL_MAX_ATTEMPTS = 5
+# most submissions in one request to /receive_answers/
+ANSWER_BATCH_MAX_SIZE = 500
+
+# raw requests received from the app, served at /log/; see survey/journal.py
+REQUEST_JOURNAL_PATH = os.path.join(BASE_DIR, 'log.txt')
+REQUEST_JOURNAL_OPTIONS = {
+    'max_bytes': 10 * 1024 * 1024,  # rotate when the file grows beyond 10 MB
+    'backup_count': 5,
+    'compress': True,  # gzip rotated files
+    'buffer_bytes': 64 * 1024,
+    'flush_interval': 1.0,  # seconds
+}
+REQUEST_JOURNAL_PAGE_BYTES = 64 * 1024
+
+# files of background exports, written by the process_export_jobs management command
+EXPORT_ROOT = os.path.join(BASE_DIR, 'exports')
+EXPORT_FILE_FORMAT = 'csv.gz'  # 'csv', 'csv.gz' or 'parquet' (needs pyarrow)
+# internal nginx location serving EXPORT_ROOT; without it Django serves the files itself
+EXPORT_ACCEL_REDIRECT_URL = os.environ.get('EXPORT_ACCEL_REDIRECT_URL')
+
+# request metrics in the Prometheus text format, served at /metrics; see survey/metrics.py
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'false') == 'true'
+# every worker process writes its metrics to a file in METRICS_DIR at most once per METRICS_FLUSH_INTERVAL
+METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join(BASE_DIR, 'metrics'))
+METRICS_FLUSH_INTERVAL = 1.0  # seconds
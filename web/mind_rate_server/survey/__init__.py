@@ -0,0 +1 @@
+default_app_config = 'mind_rate_server.survey.apps.SurveyConfig'
@@ -1,14 +1,18 @@
 from django.contrib import admin
 import nested_admin
 from .models import Questionnaire, Study, TextQuestion, SingleChoiceQuestion, MultiChoiceQuestion,\
-    DragScaleQuestion, TriggerEvent, ChoiceOption, ProbandInfoQuestionnaire, QuestionnaireAnswer,\
-    TextQuestionAnswer, SingleChoiceQuestionAnswer, MultiChoiceQuestionAnswer, DragScaleQuestionAnswer,\
-    SensorValueCell, Proband, ProbandInfoCell
-from .views import _get_question_list_from_questionnaire
+    DragScaleQuestion, TriggerEvent, ChoiceOption, ProbandInfoQuestionnaire, ExportJob, SensorThreshold
+from .counters import annotate_answer_count
+from .export_jobs import get_file_formats, request_export
+from .exports import study_answer_rows, proband_info_rows, csv_chunks
+from .study_graph import load_study_graph
+from django.conf import settings
+from django.contrib import messages
 from django.contrib.auth.models import User
-from django.http import HttpResponse
+from django.core.urlresolvers import reverse
+from django.http import StreamingHttpResponse
 from django.shortcuts import render
-import csv
+from django.utils.html import format_html
 
 
 class TextQuestionInline(nested_admin.NestedStackedInline):
@@ -96,114 +100,64 @@ class ProbandInfoQuestionnaireInline(nested_admin.NestedStackedInline):
     max_num = 1
 
 
-def export_proband_info(modeladmin, request, queryset):
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = 'attachment; filename="proband_info.csv"'
-
-    for study in queryset:
-        proband_list = Proband.objects.filter(study=study)
-
-        # get all proband info cell keys
-        proband_info_keys = set()
-        for proband in proband_list:
-            proband_info_cell_list = ProbandInfoCell.objects.filter(proband=proband)
-            for proband_info_cell in proband_info_cell_list:
-                proband_info_keys.add(proband_info_cell.key)
-        proband_info_keys = list(proband_info_keys)  # convert to list because set is unordered
-
-        # write title line
-        writer = csv.writer(response)
-        writer.writerow(['Study ID', 'Proband ID'] + proband_info_keys)
-
-        for proband in proband_list:
-            proband_info_cell_list = ProbandInfoCell.objects.filter(proband=proband)
-            # skip all probands without valid proband info
-            if not proband_info_cell_list:
-                continue
-
-            info_list = []
-            for key in proband_info_keys:
-                if not ProbandInfoCell.objects.filter(proband=proband, key=key):
-                    info_list.append(' ')
-                else:
-                    info_list.append(ProbandInfoCell.objects.filter(proband=proband, key=key).last().value)
-
-            # write info line for each proband
-            writer.writerow([study.id, proband.id] + info_list)
+class SensorThresholdInline(nested_admin.NestedTabularInline):
+    # sensor level ranges replacing the defaults of the app for this study
+    model = SensorThreshold
+    fields = ['sensor', 'level', 'min_value', 'max_value']
+    extra = 0
 
-        writer.writerow([''])  # an empty line for each study
 
+def export_proband_info(modeladmin, request, queryset):
+    response = StreamingHttpResponse(csv_chunks(proband_info_rows(queryset)), content_type='text/csv')
+    response['Content-Disposition'] = 'attachment; filename="proband_info.csv"'
     return response
 
 
 def export_study_answer(modeladmin, request, queryset):
-    response = HttpResponse(content_type='text/csv')
+    response = StreamingHttpResponse(csv_chunks(study_answer_rows(queryset)), content_type='text/csv')
     response['Content-Disposition'] = 'attachment; filename="study_answer.csv"'
+    return response
+
 
-    writer = csv.writer(response)
-    writer.writerow(['Study ID', 'Questionnaire ID', 'Question', 'Answer', 'Proband ID', 'Submit Time', 'Sensor value'])
+def _request_background_exports(modeladmin, request, queryset, kind):
+    file_format = settings.EXPORT_FILE_FORMAT
+    if file_format not in get_file_formats():
+        modeladmin.message_user(request, "Exports as %s are not available on this server." % file_format,
+                                level=messages.ERROR)
+        return
 
     for study in queryset:
-        questionnaire_list = Questionnaire.objects.filter(study=study)
-
-        for questionnaire in questionnaire_list:
-            questionnaire_answer_list = QuestionnaireAnswer.objects.filter(questionnaire=questionnaire)
-
-            for questionnaire_answer in questionnaire_answer_list:
-
-                # write all sensor values into a string
-                sensor_value = ""
-                sensor_value_cell_list = SensorValueCell.objects.filter(questionnaire_answer=questionnaire_answer)
-                for sensor_value_cell in sensor_value_cell_list:
-                    sensor_value += "%s: %s / " % (sensor_value_cell.key, sensor_value_cell.value)
-                    sensor_value = sensor_value[:-3]  # remove the trailing slash
-
-                # make a list of all question answers
-                question_answer_list = []
-                question_answer_list.extend(TextQuestionAnswer.objects.filter(
-                    questionnaire_answer=questionnaire_answer))
-                question_answer_list.extend(SingleChoiceQuestionAnswer.objects.filter(
-                    questionnaire_answer=questionnaire_answer))
-                question_answer_list.extend(MultiChoiceQuestionAnswer.objects.filter(
-                    questionnaire_answer=questionnaire_answer))
-                question_answer_list.extend(DragScaleQuestionAnswer.objects.filter(
-                    questionnaire_answer=questionnaire_answer))
-
-                # sort the question answer list based on submit time
-                question_answer_list.sort(key=lambda item: item.questionnaire_answer.submit_time)
-
-                # write all values into a csv row
-                for question_answer in question_answer_list:
-                    writer.writerow([
-                        study.id, questionnaire.id, question_answer.question.question_text,
-                        question_answer.value, question_answer.questionnaire_answer.submitter.id,
-                        question_answer.questionnaire_answer.submit_time, sensor_value
-                    ])
-
-        writer.writerow([''])  # an empty line for each study
+        request_export(study.id, kind, file_format)
+    modeladmin.message_user(request, format_html(
+        'The exports are written in the background. They can be downloaded from <a href="{}">Export jobs</a>.',
+        reverse('admin:survey_exportjob_changelist')))
+
+
+def export_study_answer_in_background(modeladmin, request, queryset):
+    _request_background_exports(modeladmin, request, queryset, ExportJob.STUDY_ANSWER)
 
-    return response
+
+def export_proband_info_in_background(modeladmin, request, queryset):
+    _request_background_exports(modeladmin, request, queryset, ExportJob.PROBAND_INFO)
 
 
 def preview_questions(modeladmin, request, queryset):
     study_list = []
-    for study in queryset:
+    for study in queryset.select_related('probandinfoquestionnaire'):
         study_dict = {"name": study.name, "questionnaires": []}
         study_list.append(study_dict)
 
-        questionnaire_list = Questionnaire.objects.filter(study=study)
-        for questionnaire in questionnaire_list:
+        load_study_graph(study)
+        for questionnaire in study.questionnaire_list:
             questionnaire_dict = {"id": questionnaire.id, "questions": []}
             study_list[-1]["questionnaires"].append(questionnaire_dict)
 
-            question_list = _get_question_list_from_questionnaire(questionnaire)
-            for question in question_list:
+            for question in questionnaire.question_list:
                 question_options = ""
 
                 if isinstance(question, SingleChoiceQuestion):
                     question_options += "<ol>"
-                    option_list = ChoiceOption.objects.filter(single_choice_question=question)
-                    for option in option_list:
+                    for option in question.option_list:
                         if option.next_question_position is None:
                             question_options += "<li>" + option.choice_text + "</li>"
                         else:
@@ -213,8 +167,7 @@ def preview_questions(modeladmin, request, queryset):
 
                 elif isinstance(question, MultiChoiceQuestion):
                     question_options += "<ol>"
-                    option_list = ChoiceOption.objects.filter(multi_choice_question=question)
-                    for option in option_list:
+                    for option in question.option_list:
                         question_options += "<li>" + option.choice_text + "</li>"
                     question_options += "</ol>"
 
@@ -239,9 +192,10 @@ def preview_questions(modeladmin, request, queryset):
 class StudyAdmin(nested_admin.NestedModelAdmin):
     model = Study
     fields = ['name', 'start_date_time', 'end_date_time']
-    list_display = ('name', 'id', 'start_date_time', 'end_date_time', 'answer_updated_times')
-    inlines = [ProbandInfoQuestionnaireInline, QuestionnaireInline]
-    actions = [preview_questions, export_proband_info, export_study_answer]
+    list_display = ('name', 'id', 'start_date_time', 'end_date_time', 'answer_count')
+    inlines = [ProbandInfoQuestionnaireInline, QuestionnaireInline, SensorThresholdInline]
+    actions = [preview_questions, export_proband_info, export_study_answer,
+               export_proband_info_in_background, export_study_answer_in_background]
 
     # override to attach request.user to the object prior to saving
     def save_model(self, request, obj, form, change):
@@ -251,10 +205,45 @@ class StudyAdmin(nested_admin.NestedModelAdmin):
 
     # override to show objects owned by the logged-in user
     def get_queryset(self, request):
-        qs = super(StudyAdmin, self).get_queryset(request)
+        qs = annotate_answer_count(super(StudyAdmin, self).get_queryset(request))
         if request.user.is_superuser:
             return qs
         return qs.filter(owner=request.user)
 
+    # the answer counter is sharded, see counters.py
+    def answer_count(self, obj):
+        return obj.answer_count
+    answer_count.short_description = 'Answer updated times'
+    answer_count.admin_order_field = 'answer_count'
+
 
 admin.site.register(Study, StudyAdmin)
+
+
+class ExportJobAdmin(admin.ModelAdmin):
+    model = ExportJob
+    list_display = ('study', 'kind', 'file_format', 'status', 'progress', 'created_time', 'finished_time',
+                    'download_link')
+    list_filter = ('status', 'kind')
+    readonly_fields = ('study', 'kind', 'file_format', 'status', 'answer_count', 'study_revision', 'progress',
+                       'file_name', 'error', 'created_time', 'finished_time')
+
+    # export jobs are created by the export actions of the study admin
+    def has_add_permission(self, request):
+        return False
+
+    # override to show exports of studies owned by the logged-in user
+    def get_queryset(self, request):
+        qs = super(ExportJobAdmin, self).get_queryset(request).select_related('study')
+        if request.user.is_superuser:
+            return qs
+        return qs.filter(study__owner=request.user)
+
+    def download_link(self, obj):
+        if obj.status != ExportJob.DONE:
+            return ""
+        return format_html('<a href="{}">Download</a>', reverse('download_export', args=[obj.id]))
+    download_link.short_description = 'File'
+
+
+admin.site.register(ExportJob, ExportJobAdmin)
@@ -4,4 +4,9 @@ from django.apps import AppConfig
 
 
 class SurveyConfig(AppConfig):
-    name = 'survey'
+    name = 'mind_rate_server.survey'
+    label = 'survey'
+
+    def ready(self):
+        from .signals import connect_signals
+        connect_signals()
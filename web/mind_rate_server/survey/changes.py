@@ -0,0 +1,71 @@
+"""
+The changes of a study definition since a revision, for devices that already downloaded the study.
+
+Every change of a study, its questionnaires, trigger events, questions and choice options is logged
+as a StudyChange row with the new study revision (see signals.py). The changes are sent per questionnaire:
+every questionnaire with a change since the revision of the device, whole, and the IDs of the deleted ones.
+A change of the study itself or of its proband info questionnaire sends the study header along,
+a change of its sensor thresholds all questionnaires, since their trigger events contain the thresholds.
+"""
+from .models import Questionnaire, StudyChange, SensorThreshold
+from .serializers import encode, serialize_questionnaire, serialize_study_header
+from .study_graph import load_study_graph
+from django.conf import settings
+from django.core.cache import cache
+
+
+def _get_changed_questionnaires(study, since):
+    """
+    Returns (whether the study header changed, IDs of the changed questionnaires) since the revision,
+    or None if not all of these changes are logged.
+    """
+    change_list = list(StudyChange.objects.filter(study=study, revision__gt=since)
+                       .values_list('revision', 'model', 'questionnaire_id'))
+    # revisions from before the change log, or a device ahead of the server after a restored backup
+    revision_set = {revision for revision, model, questionnaire_id in change_list}
+    if since > study.revision or len(revision_set) != study.revision - since:
+        return None
+
+    # sensor thresholds have no questionnaire either, but are part of every trigger event instead of the header
+    threshold_changed = any(model == SensorThreshold.__name__ for revision, model, questionnaire_id in change_list)
+    header_changed = any(questionnaire_id is None and model != SensorThreshold.__name__
+                         for revision, model, questionnaire_id in change_list)
+    questionnaire_id_set = {questionnaire_id for revision, model, questionnaire_id in change_list}
+    if threshold_changed:
+        questionnaire_id_set.update(Questionnaire.objects.filter(study=study).values_list('id', flat=True))
+    questionnaire_id_set.discard(None)
+    return header_changed, questionnaire_id_set
+
+
+def serialize_study_changes(study, since):
+    changed = _get_changed_questionnaires(study, since) if since != study.revision else (False, set())
+    study_data = {"studyId": str(study.id), "revision": study.revision, "full": changed is None}
+    if changed is None:  # the device has to replace its whole study
+        header_changed = True
+        questionnaire_id_set = set(Questionnaire.objects.filter(study=study).values_list('id', flat=True))
+    else:
+        header_changed, questionnaire_id_set = changed
+
+    if header_changed or questionnaire_id_set:
+        load_study_graph(study)
+    if header_changed:
+        study_data["study"] = serialize_study_header(study)
+
+    questionnaire_list = [questionnaire for questionnaire in getattr(study, 'questionnaire_list', [])
+                          if questionnaire.id in questionnaire_id_set]
+    study_data["questionnaires"] = [serialize_questionnaire(questionnaire, study.sensor_thresholds)
+                                    for questionnaire in questionnaire_list]
+    study_data["deletedQuestionnaireIDs"] = [
+        str(questionnaire_id) for questionnaire_id in
+        sorted(questionnaire_id_set - {questionnaire.id for questionnaire in questionnaire_list})]
+    return study_data
+
+
+def get_study_changes_json(study, since):
+    # shared by all devices at the same revision, like the downloaded study
+    cache_key = "study_changes:%d:%d:%d" % (study.id, since, study.revision)
+    changes_json = cache.get(cache_key)
+    if changes_json is None:
+        changes_json = encode(serialize_study_changes(study, since))
+        cache.set(cache_key, changes_json, settings.STUDY_JSON_CACHE_TIMEOUT)
+    return changes_json
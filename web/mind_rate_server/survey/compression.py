@@ -0,0 +1,154 @@
+"""
+Content-Encoding of the app-facing endpoints.
+
+Responses are compressed with the best encoding the client accepts: brotli or zstd if the brotli or
+zstandard package is installed, else gzip. Request bodies may be sent gzip compressed.
+"""
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from functools import wraps
+import gzip
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+MIN_SIZE = 200  # bytes; smaller bodies aren't worth compressing
+
+# levels that compress a study well at a small CPU cost, see benchmarks/response_compression.py
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+ZSTD_LEVEL = 3
+
+
+def _compress_brotli(data):
+    return brotli.compress(data, quality=BROTLI_QUALITY)
+
+
+def _compress_zstd(data):
+    return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+
+
+def _compress_gzip(data):
+    return gzip.compress(data, compresslevel=GZIP_LEVEL)
+
+
+def get_encodings():
+    # (name, compress function) of the available encodings, most preferred first
+    encoding_list = []
+    if brotli is not None:
+        encoding_list.append(('br', _compress_brotli))
+    if zstandard is not None:
+        encoding_list.append(('zstd', _compress_zstd))
+    encoding_list.append(('gzip', _compress_gzip))
+    return encoding_list
+
+
+def _parse_accept_encoding(accept_encoding):
+    # the q value of every accepted encoding
+    q_dict = {}
+    for item in accept_encoding.split(','):
+        name, _, parameters = item.partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for parameter in parameters.split(';'):
+            key, _, value = parameter.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        q_dict[name] = q
+    return q_dict
+
+
+def choose_encoding(accept_encoding):
+    """
+    Returns (name, compress function) of the encoding to use for an Accept-Encoding header, or None.
+    """
+    q_dict = _parse_accept_encoding(accept_encoding)
+    best_encoding = None
+    best_q = 0.0
+    for name, compress in get_encodings():
+        q = q_dict.get(name, q_dict.get('*', 0.0))
+        if q > best_q:
+            best_encoding = (name, compress)
+            best_q = q
+    return best_encoding
+
+
+def _weaken_etag(response):
+    # the encodings of a body must not share a strong ETag (RFC 7232), but are semantically the same
+    etag = response.get('ETag')
+    if etag and not etag.startswith('W/'):
+        response['ETag'] = 'W/' + etag
+
+
+def compress_response(view):
+    """
+    Decorator compressing the response of a view as negotiated with the Accept-Encoding header.
+
+    The ETag of the response is made weak; it has to wrap the condition decorator so that this holds
+    for its 304 responses, too. If-None-Match compares ETags weakly, so revalidation keeps working.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        response = view(request, *args, **kwargs)
+        if response.status_code == 304:
+            patch_vary_headers(response, ('Accept-Encoding',))
+            _weaken_etag(response)
+            return response
+        if response.streaming or response.status_code != 200 or response.has_header('Content-Encoding'):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        _weaken_etag(response)
+        if len(response.content) < MIN_SIZE:
+            return response
+
+        encoding = choose_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None:
+            return response
+
+        name, compress = encoding
+        response.content = compress(response.content)
+        response['Content-Encoding'] = name
+        response['Content-Length'] = str(len(response.content))
+        return response
+    return wrapper
+
+
+def get_request_body(request):
+    """
+    The body of a request, decompressed if it was sent with Content-Encoding: gzip.
+
+    Raises ValueError if the encoding isn't supported, the body can't be decompressed,
+    or it would be larger than settings.DATA_UPLOAD_MAX_MEMORY_SIZE.
+    """
+    encoding = request.META.get('HTTP_CONTENT_ENCODING', '').strip().lower()
+    if encoding in ('', 'identity'):
+        return request.body
+    if encoding != 'gzip':
+        raise ValueError("Content-Encoding %s is not supported" % encoding)
+
+    max_size = settings.DATA_UPLOAD_MAX_MEMORY_SIZE
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)  # gzip header and trailer
+    try:
+        body = decompressor.decompress(request.body, 0 if max_size is None else max_size + 1)
+    except zlib.error as e:
+        raise ValueError("invalid gzip body: %s" % e)
+    if max_size is not None and len(body) > max_size:
+        raise ValueError("decompressed body is larger than %d bytes" % max_size)
+    if not decompressor.eof:
+        raise ValueError("gzip body is incomplete")
+    return body
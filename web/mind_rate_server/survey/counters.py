@@ -0,0 +1,65 @@
+"""
+The answer counter of a study (Study.answer_updated_times).
+
+Submissions don't update the study row, which every writer would have to lock. Instead they add to
+one of settings.ANSWER_COUNTER_SHARDS AnswerCounterShard rows picked at random, and the
+worker service (the process_answer_queue management command) periodically folds the shards back
+into the study.
+The total is always answer_updated_times plus the sum of the shards.
+"""
+from .models import Study, AnswerCounterShard
+from django.conf import settings
+from django.db import transaction, IntegrityError
+from django.db.models import F, Sum, IntegerField, ExpressionWrapper
+from django.db.models.functions import Coalesce
+import random
+
+
+def increment_answer_counter(study_id, count=1):
+    shard_count = settings.ANSWER_COUNTER_SHARDS
+    if shard_count <= 1:
+        Study.objects.filter(id=study_id).update(answer_updated_times=F('answer_updated_times') + count)
+        return
+
+    shard = random.randrange(shard_count)
+    shard_queryset = AnswerCounterShard.objects.filter(study_id=study_id, shard=shard)
+    if shard_queryset.update(count=F('count') + count):
+        return
+
+    # first submission to this shard
+    try:
+        with transaction.atomic():
+            AnswerCounterShard.objects.create(study_id=study_id, shard=shard, count=count)
+    except IntegrityError:  # another worker created the shard in the meantime
+        shard_queryset.update(count=F('count') + count)
+
+
+def annotate_answer_count(study_queryset):
+    # adds the total answer counter as answer_count
+    return study_queryset.annotate(answer_count=ExpressionWrapper(
+        F('answer_updated_times') + Coalesce(Sum('answercountershard__count'), 0), output_field=IntegerField()))
+
+
+def get_answer_count(study_id):
+    return annotate_answer_count(Study.objects.filter(id=study_id)).values_list('answer_count', flat=True).get()
+
+
+def flush_answer_counters():
+    """
+    Fold all shards into Study.answer_updated_times; returns the number of flushed answers.
+    """
+    flushed_count = 0
+    with transaction.atomic():
+        shard_list = list(AnswerCounterShard.objects.select_for_update().exclude(count=0))
+
+        study_count_dict = {}
+        for shard in shard_list:
+            study_count_dict[shard.study_id] = study_count_dict.get(shard.study_id, 0) + shard.count
+            # subtract instead of resetting, in case the database doesn't lock the row
+            AnswerCounterShard.objects.filter(id=shard.id).update(count=F('count') - shard.count)
+
+        for study_id, count in study_count_dict.items():
+            Study.objects.filter(id=study_id).update(answer_updated_times=F('answer_updated_times') + count)
+            flushed_count += count
+
+    return flushed_count
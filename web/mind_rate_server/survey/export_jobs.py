@@ -0,0 +1,170 @@
+"""
+Study exports written to files in the background.
+
+The background export actions of the study admin create ExportJob rows, and the process_export_jobs
+management command writes them to files in settings.EXPORT_ROOT, from where nginx serves them.
+Exporting a study whose answer counter and definition haven't changed reuses the last file.
+"""
+from .counters import get_answer_count
+from .exports import study_answer_rows, proband_info_rows, csv_chunks
+from .models import Study, ExportJob
+from django.conf import settings
+from django.utils import timezone
+import gzip
+import os
+import uuid
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # Parquet exports are only available with pyarrow installed
+    pyarrow = None
+
+
+ROW_FUNCTIONS = {
+    ExportJob.STUDY_ANSWER: study_answer_rows,
+    ExportJob.PROBAND_INFO: proband_info_rows,
+}
+
+CONTENT_TYPES = {
+    ExportJob.CSV: 'text/csv',
+    ExportJob.CSV_GZIP: 'application/gzip',
+    ExportJob.PARQUET: 'application/octet-stream',
+}
+
+PROGRESS_INTERVAL = 10000  # rows written between two progress updates
+PARQUET_BATCH_SIZE = 10000  # rows per Parquet row group
+
+
+def get_file_formats():
+    if pyarrow is None:
+        return [ExportJob.CSV, ExportJob.CSV_GZIP]
+    return [ExportJob.CSV, ExportJob.CSV_GZIP, ExportJob.PARQUET]
+
+
+def get_export_path(job):
+    return os.path.join(settings.EXPORT_ROOT, job.file_name)
+
+
+def _get_study_state(study_id):
+    return get_answer_count(study_id), Study.objects.filter(id=study_id).values_list('revision', flat=True).get()
+
+
+def request_export(study_id, kind, file_format):
+    """
+    Returns the finished export of the unchanged study if there is one,
+    else an export job that is still waiting or a new one.
+    """
+    if file_format not in get_file_formats():
+        raise ValueError("File format %s is not available" % file_format)
+
+    job_queryset = ExportJob.objects.filter(study_id=study_id, kind=kind, file_format=file_format).order_by('-id')
+
+    answer_count, study_revision = _get_study_state(study_id)
+    job = job_queryset.filter(status=ExportJob.DONE, answer_count=answer_count, study_revision=study_revision).first()
+    if job is not None and os.path.exists(get_export_path(job)):
+        return job
+
+    # a waiting job will see the current state when it runs
+    job = job_queryset.filter(status=ExportJob.PENDING).first()
+    if job is not None:
+        return job
+
+    return ExportJob.objects.create(study_id=study_id, kind=kind, file_format=file_format)
+
+
+def _count_progress(job, rows):
+    for row in rows:
+        yield row
+        job.progress += 1
+        if job.progress % PROGRESS_INTERVAL == 0:
+            ExportJob.objects.filter(id=job.id).update(progress=job.progress)
+
+
+def _write_parquet(rows, path):
+    # all columns are stored as strings; the empty line after each study is left out
+    rows = iter(rows)
+    header = next(rows)
+    writer = pyarrow.parquet.ParquetWriter(path, pyarrow.schema([(name, pyarrow.string()) for name in header]))
+
+    def write_batch(batch):
+        columns = [[None if value is None else str(value) for value in column] for column in zip(*batch)]
+        writer.write_table(pyarrow.Table.from_arrays([pyarrow.array(column, type=pyarrow.string())
+                                                      for column in columns], names=header))
+
+    try:
+        batch = []
+        for row in rows:
+            if row == ['']:
+                continue
+            batch.append(row)
+            if len(batch) >= PARQUET_BATCH_SIZE:
+                write_batch(batch)
+                batch = []
+        if batch:
+            write_batch(batch)
+    finally:
+        writer.close()
+
+
+def _write_rows(rows, file_format, path):
+    if file_format == ExportJob.PARQUET:
+        _write_parquet(rows, path)
+        return
+
+    if file_format == ExportJob.CSV_GZIP:
+        export_file = gzip.open(path, 'wt', encoding='utf-8', newline='')
+    else:
+        export_file = open(path, 'w', encoding='utf-8', newline='')
+    with export_file:
+        for chunk in csv_chunks(rows):
+            export_file.write(chunk)
+
+
+def run_export_job(job):
+    job.answer_count, job.study_revision = _get_study_state(job.study_id)
+    job.file_name = "%s_%d_%s.%s" % (job.kind, job.study_id, uuid.uuid4().hex, job.file_format)
+    job.save(update_fields=['answer_count', 'study_revision', 'file_name'])
+
+    os.makedirs(settings.EXPORT_ROOT, exist_ok=True)
+    path = get_export_path(job)
+    temporary_path = path + '.part'  # nginx never serves a half written file
+
+    try:
+        rows = ROW_FUNCTIONS[job.kind](Study.objects.filter(id=job.study_id))
+        _write_rows(_count_progress(job, rows), job.file_format, temporary_path)
+        os.replace(temporary_path, path)
+    except Exception as e:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        job.status = ExportJob.FAILED
+        job.error = "%s: %s" % (type(e).__name__, e)
+    else:
+        job.status = ExportJob.DONE
+    job.finished_time = timezone.now()
+    job.save(update_fields=['status', 'error', 'progress', 'finished_time'])
+
+    # only the newest file of an export is kept
+    if job.status == ExportJob.DONE:
+        for old_job in ExportJob.objects.filter(study_id=job.study_id, kind=job.kind, file_format=job.file_format,
+                                                status=ExportJob.DONE, id__lt=job.id):
+            old_job.delete()
+
+
+def process_export_jobs():
+    """
+    Run all waiting export jobs; returns the number of jobs run.
+    """
+    job_count = 0
+    while True:
+        job = ExportJob.objects.filter(status=ExportJob.PENDING).order_by('id').first()
+        if job is None:
+            return job_count
+
+        # another worker may have taken the job in the meantime
+        if not ExportJob.objects.filter(id=job.id, status=ExportJob.PENDING).update(status=ExportJob.RUNNING):
+            continue
+        job.status = ExportJob.RUNNING
+
+        run_export_job(job)
+        job_count += 1
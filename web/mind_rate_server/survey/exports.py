@@ -0,0 +1,146 @@
+"""
+Rows of the CSV exports of the study admin.
+
+The rows are produced by generators that read the answers in keyset-paginated chunks,
+so an export of any size needs constant memory and can be streamed.
+"""
+from .models import ProbandInfoCell, Questionnaire, QuestionnaireAnswer, QuestionAnswer, format_answer_number, \
+    decode_sensor_values
+from django.db.models import Min, Q
+import csv
+
+
+STUDY_ANSWER_HEADER = ['Study ID', 'Questionnaire ID', 'Question', 'Answer', 'Proband ID', 'Submit Time',
+                       'Sensor value']
+
+QUESTION_TEXT_FIELDS = tuple(field + '__question_text' for field in QuestionAnswer.QUESTION_FIELDS.values())
+
+CHUNK_SIZE = 500  # questionnaire answers read at once; SQLite allows 999 query parameters
+PROBAND_INFO_CHUNK_SIZE = 2000  # proband info cells read at once
+
+
+def _get_questionnaire_answer_chunks(questionnaire):
+    # lists of (id, submitter id, submit time, sensor values), paginated by id
+    last_id = 0
+    while True:
+        chunk = list(QuestionnaireAnswer.objects.filter(questionnaire=questionnaire, id__gt=last_id)
+                     .order_by('id').values_list('id', 'submitter_id', 'submit_time', 'sensor_values')[:CHUNK_SIZE])
+        if not chunk:
+            return
+        yield chunk
+        last_id = chunk[-1][0]
+
+
+def _get_proband_info_cell_chunks(cell_queryset):
+    # lists of (proband id, id, key, value), paginated by (proband id, id) so that the cells of a proband follow
+    # each other; the iterator of a queryset would still read the whole result into memory with SQLite
+    last_proband_id = 0
+    last_id = 0
+    while True:
+        chunk = list(cell_queryset.filter(Q(proband_id__gt=last_proband_id) |
+                                          Q(proband_id=last_proband_id, id__gt=last_id))
+                     .order_by('proband_id', 'id')
+                     .values_list('proband_id', 'id', 'key', 'value')[:PROBAND_INFO_CHUNK_SIZE])
+        if chunk:
+            yield chunk
+        if len(chunk) < PROBAND_INFO_CHUNK_SIZE:
+            return
+        last_proband_id, last_id = chunk[-1][:2]
+
+
+def study_answer_rows(study_queryset):
+    """
+    Yield the rows of the study answer export: one row per question answer, with the sensor values of
+    the questionnaire answer, and an empty row after each study.
+    """
+    yield STUDY_ANSWER_HEADER
+
+    for study_id in study_queryset.values_list('id', flat=True):
+        for questionnaire_id in Questionnaire.objects.filter(study_id=study_id).values_list('id', flat=True):
+            for chunk in _get_questionnaire_answer_chunks(questionnaire_id):
+                id_list = [row[0] for row in chunk]
+
+                # question texts and values of all question answers; only one of the question texts is set
+                question_answer_dict = {}
+                for row in QuestionAnswer.objects.filter(questionnaire_answer_id__in=id_list).order_by('id') \
+                        .values_list('questionnaire_answer_id', 'text', 'number', *QUESTION_TEXT_FIELDS):
+                    questionnaire_answer_id, text, number = row[:3]
+                    question_text = next((text for text in row[3:] if text is not None), '')
+                    value = format_answer_number(number) if text is None and number is not None else text
+                    question_answer_dict.setdefault(questionnaire_answer_id, []).append((question_text, value))
+
+                for questionnaire_answer_id, submitter_id, submit_time, sensor_values in chunk:
+                    # write all sensor values of the questionnaire answer into a string
+                    sensor_value = " / ".join("%s: %s" % (key, value)
+                                              for key, value in decode_sensor_values(sensor_values).items())
+                    for question_text, value in question_answer_dict.get(questionnaire_answer_id, []):
+                        yield [study_id, questionnaire_id, question_text, value, submitter_id, submit_time,
+                               sensor_value]
+
+        yield ['']  # an empty line for each study
+
+
+def proband_info_rows(study_queryset):
+    """
+    Yield the rows of the proband info export: for each study a title line with all info keys,
+    one line per proband with info and an empty line.
+
+    If a proband has several values for a key, the last one wins.
+    """
+    for study_id in study_queryset.values_list('id', flat=True):
+        cell_queryset = ProbandInfoCell.objects.filter(proband__study_id=study_id)
+
+        # all info keys, in the order they first appeared
+        proband_info_keys = list(cell_queryset.values('key').annotate(first_id=Min('id'))
+                                 .order_by('first_id').values_list('key', flat=True))
+        yield ['Study ID', 'Proband ID'] + proband_info_keys
+
+        # the cells of each proband come in one run; later cells overwrite earlier ones
+        current_proband_id = None
+        info_dict = {}
+        for chunk in _get_proband_info_cell_chunks(cell_queryset):
+            for proband_id, cell_id, key, value in chunk:
+                if proband_id != current_proband_id:
+                    if current_proband_id is not None:
+                        yield [study_id, current_proband_id] + [info_dict.get(key, ' ') for key in proband_info_keys]
+                    current_proband_id = proband_id
+                    info_dict = {}
+                info_dict[key] = value
+
+        if current_proband_id is not None:
+            yield [study_id, current_proband_id] + [info_dict.get(key, ' ') for key in proband_info_keys]
+
+        yield ['']  # an empty line for each study
+
+
+class _Echo(object):
+    # a file-like object that returns what is written to it instead of storing it
+    def write(self, value):
+        return value
+
+
+def csv_chunks(rows, chunk_size=64 * 1024):
+    """
+    Encode rows as CSV and yield the text in chunks of about chunk_size characters.
+    """
+    writer = csv.writer(_Echo())
+    buffer = []
+    buffered_size = 0
+
+    # the first row goes out right away, so the download starts immediately
+    rows = iter(rows)
+    for row in rows:
+        yield writer.writerow(row)
+        break
+
+    for row in rows:
+        line = writer.writerow(row)
+        buffer.append(line)
+        buffered_size += len(line)
+        if buffered_size >= chunk_size:
+            yield ''.join(buffer)
+            buffer = []
+            buffered_size = 0
+
+    if buffer:
+        yield ''.join(buffer)
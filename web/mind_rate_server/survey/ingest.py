@@ -0,0 +1,356 @@
+from .models import ProcessedSubmission, Proband, ProbandInfoCell, Questionnaire, QuestionnaireAnswer, \
+    SensorValueCell, TextQuestion, SingleChoiceQuestion, MultiChoiceQuestion, DragScaleQuestion, QuestionAnswer, \
+    TextQuestionAnswer, SingleChoiceQuestionAnswer, MultiChoiceQuestionAnswer, DragScaleQuestionAnswer, \
+    encode_sensor_values
+from .counters import increment_answer_counter
+from django.db import transaction, IntegrityError
+from django.db.models import Case, When, Value, TextField
+import datetime
+import hashlib
+import json
+
+
+# question models by the question type names used by the app
+QUESTION_MODELS = {
+    'TextAnswer': TextQuestion,
+    'SingleChoice': SingleChoiceQuestion,
+    'MultipleChoice': MultiChoiceQuestion,
+    'DragScale': DragScaleQuestion,
+}
+
+# the former answer tables and the question type of their rows
+LEGACY_ANSWER_MODELS = (
+    (TextQuestionAnswer, QuestionAnswer.TEXT),
+    (SingleChoiceQuestionAnswer, QuestionAnswer.SINGLE_CHOICE),
+    (MultiChoiceQuestionAnswer, QuestionAnswer.MULTI_CHOICE),
+    (DragScaleQuestionAnswer, QuestionAnswer.DRAG_SCALE),
+)
+
+# the 3 standard proband info questions
+STANDARD_PROBAND_INFO_KEYS = ('birthday', 'gender', 'occupation')
+
+
+SUBMIT_TIME_KEYS = ('year', 'month', 'day', 'hour', 'minute', 'second')
+
+
+def _check_int(value, name):
+    try:
+        int(value)
+    except (TypeError, ValueError):
+        raise ValueError("%s is not an integer" % name)
+
+
+def validate_submission(json_data):
+    """
+    Check the structure of a submission without touching the database; raises ValueError if it is invalid.
+    """
+    if not isinstance(json_data, dict):
+        raise ValueError("submission is not an object")
+    _check_int(json_data.get('probandID'), 'probandID')
+
+    if 'questionnaireID' not in json_data:  # the 3 standard proband info questions
+        return json_data
+
+    if json_data['questionnaireID'] != 'probandInfoQuestionnaire':  # normal questionnaire
+        _check_int(json_data['questionnaireID'], 'questionnaireID')
+        submit_time_dict = json_data.get('submitTime')
+        if not isinstance(submit_time_dict, dict):
+            raise ValueError("submitTime is missing")
+        for key in SUBMIT_TIME_KEYS:
+            _check_int(submit_time_dict.get(key), 'submitTime.%s' % key)
+        try:
+            _parse_submit_time(submit_time_dict)
+        except (ValueError, OverflowError) as e:  # e.g. month 13
+            raise ValueError("invalid submitTime: %s" % e)
+        if not isinstance(json_data.get('sensorValues'), dict):
+            raise ValueError("sensorValues is missing")
+
+    question_item_list = json_data.get('questionAnswer')
+    if not isinstance(question_item_list, list):
+        raise ValueError("questionAnswer is missing")
+    for question_item in question_item_list:
+        if not isinstance(question_item, dict) or 'questionType' not in question_item or 'answer' not in question_item:
+            raise ValueError("invalid item in questionAnswer")
+        _check_int(question_item.get('questionID'), 'questionID')
+
+    return json_data
+
+
+def validate_submission_batch(json_data, max_size):
+    """
+    Check the structure of a batch of submissions of one proband, {"probandID": ..., "submissions": [...]};
+    raises ValueError if it is invalid. The submissions are checked one by one with validate_submission.
+    """
+    if not isinstance(json_data, dict):
+        raise ValueError("batch is not an object")
+    _check_int(json_data.get('probandID'), 'probandID')
+    if not isinstance(json_data.get('submissions'), list):
+        raise ValueError("submissions is missing")
+    if len(json_data['submissions']) > max_size:
+        raise ValueError("more than %d submissions" % max_size)
+    return json_data
+
+
+def get_idempotency_key(key=None, body=b''):
+    # the key sent by the app, or the submission itself, since a retry sends exactly the same body
+    if key:
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+    return hashlib.sha256(body).hexdigest()
+
+
+def _parse_submit_time(submit_time_dict):
+    return datetime.datetime(int(submit_time_dict['year']), int(submit_time_dict['month']),
+                             int(submit_time_dict['day']), int(submit_time_dict['hour']),
+                             int(submit_time_dict['minute']), int(submit_time_dict['second']))
+
+
+def _get_question_item_list(json_data, default_question_type=None):
+    """
+    Returns (question type, question ID, answer) of every answered question in a submission.
+
+    Items with an unknown question type get default_question_type, or are skipped if it is None.
+    """
+    question_item_list = []
+    for question_item in json_data['questionAnswer']:
+        question_type = question_item['questionType']
+        if question_type not in QUESTION_MODELS:
+            if default_question_type is None:
+                continue
+            question_type = default_question_type
+        question_item_list.append((question_type, int(question_item['questionID']), question_item['answer']))
+    return question_item_list
+
+
+def _get_submission_question_item_list(json_data):
+    if 'questionnaireID' not in json_data:  # the 3 standard proband info questions
+        return []
+    if json_data['questionnaireID'] == 'probandInfoQuestionnaire':
+        # unknown question types have always been treated as multiple choice questions here
+        return _get_question_item_list(json_data, default_question_type='MultipleChoice')
+    return _get_question_item_list(json_data)  # unknown question types are skipped
+
+
+def _fetch_questions(question_item_list, question_dict):
+    # add the questions of the question items that question_dict lacks, with one query per question type
+    question_id_dict = {}
+    for question_type, question_id, answer in question_item_list:
+        if (question_type, question_id) not in question_dict:
+            question_id_dict.setdefault(question_type, set()).add(question_id)
+
+    for question_type, question_id_set in question_id_dict.items():
+        for question in QUESTION_MODELS[question_type].objects.filter(id__in=question_id_set):
+            question_dict[(question_type, question.id)] = question
+
+
+def _get_question_dict(question_item_list, question_dict=None):
+    """
+    Fetch the questions of the question items with one query per question type;
+    questions already in question_dict aren't fetched again.
+
+    Returns a dict of questions by (question type, question ID);
+    raises DoesNotExist of the question model if a question doesn't exist.
+    """
+    if question_dict is None:
+        question_dict = {}
+    _fetch_questions(question_item_list, question_dict)
+
+    for question_type, question_id, answer in question_item_list:
+        if (question_type, question_id) not in question_dict:
+            model = QUESTION_MODELS[question_type]
+            raise model.DoesNotExist("%s matching query does not exist." % model._meta.object_name)
+
+    return question_dict
+
+
+def _store_submission(json_data, proband, question_dict):
+    # the rows of one submission; see store_answer
+    question_item_list = _get_submission_question_item_list(json_data)
+    question_dict = _get_question_dict(question_item_list, question_dict)
+
+    if 'questionnaireID' not in json_data:  # the 3 standard proband info questions
+        ProbandInfoCell.objects.bulk_create([
+            ProbandInfoCell(proband=proband, key=key, value=json_data[key])
+            for key in STANDARD_PROBAND_INFO_KEYS if key in json_data
+        ])
+
+    elif json_data['questionnaireID'] == 'probandInfoQuestionnaire':  # custom proband info questions
+        ProbandInfoCell.objects.bulk_create([
+            ProbandInfoCell(proband=proband, key=question_dict[(question_type, question_id)].question_text,
+                            value=answer)
+            for question_type, question_id, answer in question_item_list
+        ])
+
+    else:  # normal questionnaire
+        questionnaire = Questionnaire.objects.get(id=json_data['questionnaireID'])
+
+        # create questionnaire answer object, with its sensor values
+        questionnaire_answer = QuestionnaireAnswer(
+            questionnaire=questionnaire, submitter=proband, submit_time=_parse_submit_time(json_data['submitTime']))
+        questionnaire_answer.set_sensor_values(json_data['sensorValues'])
+        questionnaire_answer.save()
+
+        # store answers of each question
+        QuestionAnswer.objects.bulk_create([
+            QuestionAnswer(questionnaire_answer=questionnaire_answer,
+                           question=question_dict[(question_type, question_id)], value=answer)
+            for question_type, question_id, answer in question_item_list
+        ])
+
+
+def store_answer(json_data):
+    """
+    Store one submission of the app: either proband info or the answer of a questionnaire.
+
+    All rows are written with a handful of bulk inserts in a single transaction,
+    regardless of the number of answered questions.
+    """
+    with transaction.atomic():
+        proband = Proband.objects.get(id=json_data['probandID'])
+        _store_submission(json_data, proband, {})
+        increment_answer_counter(proband.study_id)  # update received answers counter
+
+
+def store_answer_once(idempotency_key, json_data):
+    """
+    store_answer, unless a submission with the same idempotency key has been stored before.
+
+    Returns whether the submission was stored.
+    """
+    with transaction.atomic():
+        try:
+            with transaction.atomic():
+                ProcessedSubmission.objects.create(idempotency_key=idempotency_key)
+        except IntegrityError:  # a retry of a stored submission
+            return False
+
+        store_answer(json_data)
+    return True
+
+
+def store_answers_once(proband_id, item_list):
+    """
+    Store a batch of submissions of one proband, given as (idempotency key, submission) pairs,
+    in one transaction; like store_answer_once, submissions stored before are skipped.
+
+    Every submission gets its own savepoint, so one that fails doesn't keep the others from being stored.
+    Returns a status dict for every submission: stored, duplicate or failed with its error.
+    Raises Proband.DoesNotExist if the proband doesn't exist.
+    """
+    result_list = []
+    stored_count = 0
+
+    with transaction.atomic():
+        proband = Proband.objects.get(id=proband_id)
+        processed_key_set = set(ProcessedSubmission.objects.filter(
+            idempotency_key__in=[idempotency_key for idempotency_key, json_data in item_list])
+            .values_list('idempotency_key', flat=True))
+
+        # the questions of all submissions at once
+        question_dict = {}
+        _fetch_questions([question_item for idempotency_key, json_data in item_list
+                          for question_item in _get_submission_question_item_list(json_data)], question_dict)
+
+        for idempotency_key, json_data in item_list:
+            if idempotency_key in processed_key_set:
+                result_list.append({'status': 'duplicate'})
+                continue
+            try:
+                with transaction.atomic():
+                    ProcessedSubmission.objects.create(idempotency_key=idempotency_key)
+                    _store_submission(json_data, proband, question_dict)
+            except IntegrityError:  # stored by another request in the meantime
+                result_list.append({'status': 'duplicate'})
+            except Exception as e:
+                result_list.append({'status': 'failed', 'error': "%s: %s" % (type(e).__name__, e)})
+            else:
+                result_list.append({'status': 'stored'})
+                stored_count += 1
+            processed_key_set.add(idempotency_key)
+
+        if stored_count:
+            increment_answer_counter(proband.study_id, stored_count)
+
+    return result_list
+
+
+def store_spooled_answers(spool, batch_size):
+    """
+    Move up to batch_size submissions from the spool into the database in one transaction.
+
+    A submission that fails stays in the spool with its error and is retried later,
+    until the spool gives up on it. Returns the number of stored and failed submissions.
+    """
+    stored_id_list = []
+    failed_count = 0
+
+    with transaction.atomic():
+        for submission in spool.read_batch(batch_size):
+            try:
+                store_answer_once(submission.idempotency_key, json.loads(submission.body))
+            except Exception as e:
+                spool.mark_failed(submission.id, "%s: %s" % (type(e).__name__, e))
+                failed_count += 1
+            else:
+                stored_id_list.append(submission.id)
+
+    # a crash before this point leaves the submissions in the spool,
+    # but their idempotency keys keep them from being stored twice
+    spool.remove(stored_id_list)
+    return len(stored_id_list), failed_count
+
+
+def move_legacy_answers(batch_size=500):
+    """
+    Move the rows of the former per type answer tables into QuestionAnswer, one transaction per batch.
+
+    Returns the number of moved answers.
+    """
+    moved_count = 0
+    for model, question_type in LEGACY_ANSWER_MODELS:
+        question_id_field = QuestionAnswer.QUESTION_FIELDS[question_type] + '_id'
+        while True:
+            with transaction.atomic():
+                legacy_list = list(model.objects.order_by('id')
+                                   .values_list('id', 'questionnaire_answer_id', 'question_id', 'value')[:batch_size])
+                if not legacy_list:
+                    break
+
+                QuestionAnswer.objects.bulk_create([
+                    QuestionAnswer(questionnaire_answer_id=questionnaire_answer_id, question_type=question_type,
+                                   value=value, **{question_id_field: question_id})
+                    for legacy_id, questionnaire_answer_id, question_id, value in legacy_list
+                ])
+                model.objects.filter(id__in=[legacy_id for legacy_id, _, _, _ in legacy_list]).delete()
+            moved_count += len(legacy_list)
+    return moved_count
+
+
+def move_legacy_sensor_values(batch_size=200):  # the update takes 3 query parameters per questionnaire answer
+    """
+    Move the SensorValueCell rows into the sensor values of their questionnaire answers,
+    one transaction per batch of questionnaire answers.
+
+    Returns the number of questionnaire answers whose sensor values were moved.
+    """
+    moved_count = 0
+    cell_queryset = SensorValueCell.objects.filter(questionnaire_answer__isnull=False)
+    while True:
+        with transaction.atomic():
+            id_list = list(cell_queryset.order_by('questionnaire_answer_id')
+                           .values_list('questionnaire_answer_id', flat=True).distinct()[:batch_size])
+            if not id_list:
+                break
+
+            sensor_value_dict = {questionnaire_answer_id: {} for questionnaire_answer_id in id_list}
+            for questionnaire_answer_id, key, value in cell_queryset.filter(questionnaire_answer_id__in=id_list) \
+                    .order_by('id').values_list('questionnaire_answer_id', 'key', 'value'):
+                sensor_value_dict[questionnaire_answer_id][key] = value
+
+            # answers stored after the update already have their own sensor values
+            QuestionnaireAnswer.objects.filter(id__in=id_list, sensor_values__isnull=True).update(
+                sensor_values=Case(*[When(id=questionnaire_answer_id, then=Value(encode_sensor_values(value_dict)))
+                                     for questionnaire_answer_id, value_dict in sensor_value_dict.items()],
+                                   output_field=TextField()))
+            cell_queryset.filter(questionnaire_answer_id__in=id_list).delete()
+        moved_count += len(id_list)
+    return moved_count
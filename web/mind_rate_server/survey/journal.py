@@ -0,0 +1,122 @@
+"""
+A journal of the raw requests received from the app, served at /log/.
+
+Entries are buffered in memory and appended to the journal file in larger writes. When the file
+grows beyond its maximal size it is rotated to <path>.1 (gzip compressed to <path>.1.gz if enabled),
+keeping a limited number of older segments. Rotation is guarded by a lock file, since all workers
+append to the same file.
+"""
+from django.conf import settings
+import atexit
+import fcntl
+import gzip
+import os
+import shutil
+import threading
+import time
+
+
+class RequestJournal(object):
+    def __init__(self, path, max_bytes=10 * 1024 * 1024, backup_count=5, compress=True,
+                 buffer_bytes=64 * 1024, flush_interval=1.0):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.compress = compress
+        self.buffer_bytes = buffer_bytes  # 0 writes every entry immediately
+        self.flush_interval = flush_interval
+
+        self._buffer = []
+        self._buffered_bytes = 0
+        self._last_flush_time = time.time()
+        self._lock = threading.Lock()
+
+    def write(self, text):
+        data = text.encode('utf-8')
+        with self._lock:
+            self._buffer.append(data)
+            self._buffered_bytes += len(data)
+            if self._buffered_bytes < self.buffer_bytes and time.time() - self._last_flush_time < self.flush_interval:
+                return
+            self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        self._last_flush_time = time.time()
+        if not self._buffer:
+            return
+        data = b''.join(self._buffer)
+        self._buffer = []
+        self._buffered_bytes = 0
+
+        with open(self.path + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            with open(self.path, 'ab') as journal_file:
+                journal_file.write(data)
+                size = journal_file.tell()
+            if size >= self.max_bytes:
+                self._rotate()
+
+    def _get_backup_path(self, number):
+        return "%s.%d%s" % (self.path, number, '.gz' if self.compress else '')
+
+    def _rotate(self):
+        if self.backup_count <= 0:
+            os.remove(self.path)
+            return
+
+        for number in range(self.backup_count - 1, 0, -1):
+            if os.path.exists(self._get_backup_path(number)):
+                os.replace(self._get_backup_path(number), self._get_backup_path(number + 1))
+
+        if self.compress:
+            rotated_path = self.path + '.rotating'
+            os.replace(self.path, rotated_path)
+            with open(rotated_path, 'rb') as source, gzip.open(self._get_backup_path(1), 'wb') as target:
+                shutil.copyfileobj(source, target)
+            os.remove(rotated_path)
+        else:
+            os.replace(self.path, self._get_backup_path(1))
+
+    def size(self):
+        try:
+            return os.path.getsize(self.path)
+        except FileNotFoundError:
+            return 0
+
+    def read(self, offset=0, length=None, chunk_size=64 * 1024):
+        """
+        Yield the bytes of the current journal file from offset on, in chunks.
+        """
+        try:
+            journal_file = open(self.path, 'rb')
+        except FileNotFoundError:
+            return
+
+        with journal_file:
+            journal_file.seek(offset)
+            while length is None or length > 0:
+                chunk = journal_file.read(chunk_size if length is None else min(chunk_size, length))
+                if not chunk:
+                    break
+                if length is not None:
+                    length -= len(chunk)
+                yield chunk
+
+
+_journal_dict = {}
+_journal_dict_lock = threading.Lock()
+
+
+def get_request_journal():
+    # one journal per process, shared by the threads of a threaded worker
+    path = settings.REQUEST_JOURNAL_PATH
+    with _journal_dict_lock:
+        if path not in _journal_dict:
+            journal = RequestJournal(path, **settings.REQUEST_JOURNAL_OPTIONS)
+            atexit.register(journal.flush)
+            _journal_dict[path] = journal
+        return _journal_dict[path]
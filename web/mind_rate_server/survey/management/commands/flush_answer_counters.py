@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from mind_rate_server.survey.counters import flush_answer_counters
+
+
+class Command(BaseCommand):
+    help = "Fold the sharded answer counters into Study.answer_updated_times; " \
+           "process_answer_queue does this periodically."
+
+    def handle(self, *args, **options):
+        flushed_count = flush_answer_counters()
+        self.stdout.write("Flushed %d answers." % flushed_count)
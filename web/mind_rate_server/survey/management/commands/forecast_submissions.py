@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from mind_rate_server.survey.schedule import forecast_submissions
+import datetime
+
+
+class Command(BaseCommand):
+    help = "List the submission bursts the time-based trigger events of all studies cause in the next hours."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=float, default=24.0)
+        parser.add_argument('--bucket', type=int, default=60, help="Seconds of each time bucket.")
+        parser.add_argument('--min-submissions', type=int, default=1,
+                            help="Leave out buckets with fewer expected submissions.")
+
+    def handle(self, *args, **options):
+        start = timezone.now()
+        end = start + datetime.timedelta(hours=options['hours'])
+        for bucket, submission_count in forecast_submissions(start, end, options['bucket']):
+            if submission_count < options['min_submissions']:
+                continue
+            bucket_time = timezone.localtime(datetime.datetime.fromtimestamp(bucket, timezone.utc))
+            self.stdout.write("%s  %d submissions" % (bucket_time.strftime('%Y-%m-%d %H:%M:%S'), submission_count))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from mind_rate_server.survey.ingest import move_legacy_answers
+
+
+class Command(BaseCommand):
+    help = "Move the answers of the former per question type answer tables into the unified answer table."
+
+    def handle(self, *args, **options):
+        moved_count = move_legacy_answers()
+        self.stdout.write("Moved %d answers." % moved_count)
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from mind_rate_server.survey.ingest import move_legacy_sensor_values
+
+
+class Command(BaseCommand):
+    help = "Move the sensor value cells into the sensor values of their questionnaire answers."
+
+    def handle(self, *args, **options):
+        moved_count = move_legacy_sensor_values()
+        self.stdout.write("Moved the sensor values of %d questionnaire answers." % moved_count)
@@ -0,0 +1,42 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from mind_rate_server.survey.counters import flush_answer_counters
+from mind_rate_server.survey.ingest import store_spooled_answers
+from mind_rate_server.survey.spool import get_answer_spool
+import time
+
+
+class Command(BaseCommand):
+    help = "Store the answers queued by receive_answer in ANSWER_INGEST_MODE = 'queue', " \
+           "and fold the sharded answer counters into the studies."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200,
+                            help="Maximal number of submissions stored in one transaction.")
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help="Seconds to wait when the queue is empty.")
+        parser.add_argument('--counter-interval', type=float, default=settings.ANSWER_COUNTER_FLUSH_INTERVAL,
+                            help="Seconds between two flushes of the answer counters; 0 never flushes them.")
+        parser.add_argument('--once', action='store_true',
+                            help="Exit as soon as the queue is empty.")
+
+    def handle(self, *args, **options):
+        spool = get_answer_spool()
+        flush_time = 0
+
+        while True:
+            stored_count, failed_count = store_spooled_answers(spool, options['batch_size'])
+            if stored_count or failed_count:
+                self.stdout.write("Stored %d answers, %d failed." % (stored_count, failed_count))
+
+            if options['counter_interval'] and time.time() >= flush_time:
+                flushed_count = flush_answer_counters()
+                if flushed_count:
+                    self.stdout.write("Flushed %d answers." % flushed_count)
+                flush_time = time.time() + options['counter_interval']
+
+            # keep going while full batches come in
+            if stored_count + failed_count < options['batch_size']:
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from mind_rate_server.survey.export_jobs import process_export_jobs
+import time
+
+
+class Command(BaseCommand):
+    help = "Write the exports requested by the background export actions of the study admin."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=5.0,
+                            help="Seconds to wait when no export is waiting.")
+        parser.add_argument('--once', action='store_true',
+                            help="Exit as soon as no export is waiting.")
+
+    def handle(self, *args, **options):
+        while True:
+            job_count = process_export_jobs()
+            if job_count:
+                self.stdout.write("Ran %d export jobs." % job_count)
+
+            if options['once']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,278 @@
+"""
+Request metrics in the Prometheus text format, served at /metrics.
+
+MetricsMiddleware records the latency, database queries and response size of every request, labelled by the
+URL name of the view (and the action of admin changelist posts). Every worker process keeps its own metrics
+and writes them to a file in settings.METRICS_DIR at most once per settings.METRICS_FLUSH_INTERVAL;
+/metrics adds up the files of all workers. The files of exited workers are folded into one archive file,
+so counters don't go back when gunicorn recycles a worker.
+
+With settings.METRICS_ENABLED off, the middleware removes itself at startup.
+"""
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+import atexit
+import fcntl
+import json
+import os
+import threading
+import time
+
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)  # seconds
+
+# name: (type, help)
+METRICS = {
+    'mind_rate_requests_total': ('counter', "Requests by view, method and status code."),
+    'mind_rate_request_duration_seconds': ('histogram', "Time from the request until the last byte of the response."),
+    'mind_rate_db_queries_total': ('counter', "Database queries made by requests."),
+    'mind_rate_db_query_seconds_total': ('counter', "Time spent in database queries by requests."),
+    'mind_rate_response_bytes_total': ('counter', "Bytes of response bodies."),
+    'mind_rate_requests_in_flight': ('gauge', "Requests being served."),
+}
+
+ARCHIVE_NAME = 'archive.json'
+
+
+class Metrics(object):
+    """
+    The metrics of one process: counters and gauges by (name, labels), and histograms of durations.
+    """
+    def __init__(self):
+        self.values = {}
+        self.histograms = {}  # (name, labels): [count per bucket..., sum, count]
+        self._lock = threading.Lock()
+
+    def add(self, name, labels, amount=1):
+        key = (name, labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def observe(self, name, labels, value):
+        key = (name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [0] * (len(DURATION_BUCKETS) + 2)
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if value <= bound:
+                    histogram[i] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'values': [[name, list(labels), value] for (name, labels), value in self.values.items()],
+                'histograms': [[name, list(labels), histogram]
+                               for (name, labels), histogram in self.histograms.items()],
+            }
+
+    def merge(self, data, include_gauges=True):
+        for name, labels, value in data['values']:
+            if include_gauges or METRICS[name][0] != 'gauge':
+                self.add(name, tuple(tuple(label) for label in labels), value)
+        for name, labels, histogram in data['histograms']:
+            key = (name, tuple(tuple(label) for label in labels))
+            with self._lock:
+                merged = self.histograms.setdefault(key, [0] * len(histogram))
+                for i, value in enumerate(histogram):
+                    merged[i] += value
+
+
+def _format_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                             for key, value in items)
+
+
+def format_metrics(metrics):
+    # the Prometheus text exposition format
+    line_list = []
+    for name, (metric_type, help_text) in sorted(METRICS.items()):
+        line_list.append("# HELP %s %s" % (name, help_text))
+        line_list.append("# TYPE %s %s" % (name, metric_type))
+        if metric_type == 'histogram':
+            for (key_name, labels), histogram in sorted(metrics.histograms.items()):
+                if key_name != name:
+                    continue
+                for bound, count in zip(DURATION_BUCKETS, histogram):
+                    line_list.append("%s_bucket%s %d" % (name, _format_labels(labels, [('le', repr(bound))]), count))
+                line_list.append("%s_bucket%s %d" % (name, _format_labels(labels, [('le', '+Inf')]), histogram[-1]))
+                line_list.append("%s_sum%s %r" % (name, _format_labels(labels), float(histogram[-2])))
+                line_list.append("%s_count%s %d" % (name, _format_labels(labels), histogram[-1]))
+        else:
+            for (key_name, labels), value in sorted(metrics.values.items()):
+                if key_name == name:
+                    line_list.append("%s%s %r" % (name, _format_labels(labels), value))
+    return '\n'.join(line_list) + '\n'
+
+
+class MetricsStore(object):
+    """
+    The metrics of this process, written to <directory>/<pid>.json, and the sum of all processes.
+    """
+    def __init__(self, directory, flush_interval=1.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.metrics = Metrics()
+        self._last_flush_time = 0
+        self._flush_lock = threading.Lock()
+
+    def _get_path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _write(self, name, data):
+        path = self._get_path(name)
+        with open(path + '.tmp', 'w') as metrics_file:
+            json.dump(data, metrics_file)
+        os.replace(path + '.tmp', path)
+
+    def maybe_flush(self):
+        if time.time() - self._last_flush_time >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        with self._flush_lock:
+            self._last_flush_time = time.time()
+            os.makedirs(self.directory, exist_ok=True)
+            self._write('%d.json' % os.getpid(), self.metrics.to_dict())
+
+    def collect(self):
+        """
+        Returns the sum of the metrics of all processes.
+        """
+        self.flush()
+        total = Metrics()
+        with open(self._get_path('.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+            archive = Metrics()
+            if os.path.exists(self._get_path(ARCHIVE_NAME)):
+                with open(self._get_path(ARCHIVE_NAME)) as archive_file:
+                    archive.merge(json.load(archive_file))
+            archive_changed = False
+
+            for name in os.listdir(self.directory):
+                pid = name[:-len('.json')]
+                if not name.endswith('.json') or not pid.isdigit():
+                    continue
+                try:
+                    with open(self._get_path(name)) as metrics_file:
+                        data = json.load(metrics_file)
+                except (OSError, ValueError):  # exited or being replaced
+                    continue
+                if _is_running(int(pid)):
+                    total.merge(data)
+                else:
+                    # the counters of an exited worker live on in the archive; its gauges are gone
+                    archive.merge(data, include_gauges=False)
+                    os.remove(self._get_path(name))
+                    archive_changed = True
+
+            if archive_changed:
+                self._write(ARCHIVE_NAME, archive.to_dict())
+        total.merge(archive.to_dict())
+        return total
+
+
+def _is_running(pid):
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+_store_dict = {}
+_store_dict_lock = threading.Lock()
+
+
+def get_metrics_store():
+    directory = settings.METRICS_DIR
+    with _store_dict_lock:
+        if directory not in _store_dict:
+            store = MetricsStore(directory, settings.METRICS_FLUSH_INTERVAL)
+            atexit.register(store.flush)
+            _store_dict[directory] = store
+        return _store_dict[directory]
+
+
+def _get_view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    name = match.url_name or match.view_name or 'unnamed'
+    # admin actions are posted to the changelist
+    if match.namespace == 'admin' and request.method == 'POST' and request.POST.get('action'):
+        return '%s:%s' % (name, request.POST['action'])
+    return name
+
+
+class MetricsMiddleware(object):
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        store = get_metrics_store()
+        start_time = time.time()
+        store.metrics.add('mind_rate_requests_in_flight', (), 1)
+
+        # queries are counted from the query log, which Django clears at the start of every request
+        force_debug_cursor_list = [(connection, connection.force_debug_cursor) for connection in connections.all()]
+        for connection, force_debug_cursor in force_debug_cursor_list:
+            connection.force_debug_cursor = True
+
+        try:
+            response = self.get_response(request)
+        except Exception:
+            self._record(store, request, None, start_time, 0, force_debug_cursor_list)
+            raise
+
+        if response.streaming:
+            # recorded when the last chunk has been sent
+            content = response.streaming_content
+            response.streaming_content = self._count_streamed_bytes(store, request, response, content, start_time,
+                                                                    force_debug_cursor_list)
+        else:
+            self._record(store, request, response, start_time, len(response.content), force_debug_cursor_list)
+        return response
+
+    def _count_streamed_bytes(self, store, request, response, content, start_time, force_debug_cursor_list):
+        byte_count = 0
+        try:
+            for chunk in content:
+                byte_count += len(chunk)
+                yield chunk
+        finally:
+            self._record(store, request, response, start_time, byte_count, force_debug_cursor_list)
+
+    def _record(self, store, request, response, start_time, byte_count, force_debug_cursor_list):
+        duration = time.time() - start_time
+        labels = (('view', _get_view_name(request)),)
+
+        query_count = 0
+        query_seconds = 0.0
+        for connection, force_debug_cursor in force_debug_cursor_list:
+            query_count += len(connection.queries_log)
+            query_seconds += sum(float(query['time']) for query in connection.queries_log)
+            connection.force_debug_cursor = force_debug_cursor
+
+        status = 500 if response is None else response.status_code
+        metrics = store.metrics
+        metrics.add('mind_rate_requests_total', labels + (('method', request.method), ('status', status)))
+        metrics.observe('mind_rate_request_duration_seconds', labels, duration)
+        metrics.add('mind_rate_db_queries_total', labels, query_count)
+        metrics.add('mind_rate_db_query_seconds_total', labels, query_seconds)
+        metrics.add('mind_rate_response_bytes_total', labels, byte_count)
+        metrics.add('mind_rate_requests_in_flight', (), -1)
+        store.maybe_flush()
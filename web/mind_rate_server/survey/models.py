@@ -1,5 +1,8 @@
+from django.core.exceptions import ValidationError
 from django.db import models
 from django.contrib.auth.models import User
+import json
+import math
 
 
 class Study(models.Model):
@@ -9,13 +12,52 @@ class Study(models.Model):
     end_date_time = models.DateTimeField("End time")
     answer_updated_times = models.PositiveIntegerField(default=0)
 
+    # increased by signals whenever the study definition changes; used to cache the downloaded study
+    revision = models.PositiveIntegerField(default=0, editable=False)
+
+    # fields only updated in the database with F() expressions;
+    # a normal save of a possibly outdated instance must not overwrite them
+    COUNTER_FIELDS = ('answer_updated_times', 'revision')
+
     def __str__(self):
         return "%s - ID: %d" % (self.name, self.id)
 
+    def save(self, *args, **kwargs):
+        if not self._state.adding and not kwargs.get('force_insert') and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name not in self.COUNTER_FIELDS]
+        super(Study, self).save(*args, **kwargs)
+
     class Meta:
         verbose_name_plural = "studies"
 
 
+# part of the answer counter of a study; see counters.py
+class AnswerCounterShard(models.Model):
+    study = models.ForeignKey(Study, on_delete=models.CASCADE)
+    shard = models.PositiveSmallIntegerField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('study', 'shard')
+
+
+# one change of the definition of a study, written by signals together with the new study revision;
+# devices fetch the changes since the revision they have, see changes.py
+class StudyChange(models.Model):
+    study = models.ForeignKey(Study, on_delete=models.CASCADE)
+    revision = models.PositiveIntegerField()
+    model = models.CharField(max_length=30)
+    object_id = models.PositiveIntegerField()
+    # the questionnaire the changed object belongs to, None for the study and its proband info questionnaire;
+    # not a foreign key, since the change of a deleted questionnaire has to be kept
+    questionnaire_id = models.PositiveIntegerField(null=True)
+    deleted = models.BooleanField(default=False)
+
+    class Meta:
+        index_together = [['study', 'revision']]
+
+
 class ProbandInfoQuestionnaire(models.Model):
     study = models.OneToOneField(Study, on_delete=models.CASCADE, null=True)
 
@@ -114,6 +156,68 @@ class TriggerEvent(models.Model):
         return ""
 
 
+# the range of sensor values a sensor level of a trigger event stands for, overriding the default of a study
+class SensorThreshold(models.Model):
+    LIGHT = 'light'
+    RELATIVE_HUMIDITY = 'relative_humidity'
+    TEMPERATURE = 'temperature'
+    AIR_PRESSURE = 'air_pressure'
+    PROXIMITY = 'proximity'
+    SENSOR_CHOICES = (
+        (LIGHT, "Light (lux)"),
+        (RELATIVE_HUMIDITY, "Relative humidity (%)"),
+        (TEMPERATURE, "Temperature (°C)"),
+        (AIR_PRESSURE, "Air pressure (hPa)"),
+        (PROXIMITY, "Proximity (cm)"),
+    )
+
+    # sensor: {level: (min value, max value)}; AlWAYS also stands for unknown levels
+    DEFAULT_RANGES = {
+        LIGHT: {TriggerEvent.VERY_LOW: (0, 4), TriggerEvent.LOW: (0, 50), TriggerEvent.MEDIUM: (50, 400),
+                TriggerEvent.HIGH: (400, 40000), TriggerEvent.VERY_HIGH: (1000, 40000),
+                TriggerEvent.AlWAYS: (0, 40000)},
+        RELATIVE_HUMIDITY: {TriggerEvent.VERY_LOW: (0, 20), TriggerEvent.LOW: (0, 40), TriggerEvent.MEDIUM: (30, 70),
+                            TriggerEvent.HIGH: (60, 100), TriggerEvent.VERY_HIGH: (80, 100),
+                            TriggerEvent.AlWAYS: (0, 100)},
+        TEMPERATURE: {TriggerEvent.VERY_LOW: (-50, -10), TriggerEvent.LOW: (-50, 10), TriggerEvent.MEDIUM: (10, 25),
+                      TriggerEvent.HIGH: (25, 50), TriggerEvent.VERY_HIGH: (35, 50),
+                      TriggerEvent.AlWAYS: (-50, 50)},
+        AIR_PRESSURE: {TriggerEvent.VERY_LOW: (300, 600), TriggerEvent.LOW: (300, 900),
+                       TriggerEvent.MEDIUM: (900, 1100), TriggerEvent.HIGH: (1100, 1300),
+                       TriggerEvent.VERY_HIGH: (1200, 1300), TriggerEvent.AlWAYS: (300, 1100)},
+        PROXIMITY: {TriggerEvent.VERY_LOW: (0, 1), TriggerEvent.LOW: (0, 3), TriggerEvent.MEDIUM: (3, 6),
+                    TriggerEvent.HIGH: (6, 10), TriggerEvent.VERY_HIGH: (8, 10), TriggerEvent.AlWAYS: (0, 10)},
+    }
+
+    study = models.ForeignKey(Study, on_delete=models.CASCADE)
+    sensor = models.CharField(max_length=20, choices=SENSOR_CHOICES)
+    level = models.CharField(max_length=2, choices=TriggerEvent.SENSOR_LEVEL_CHOICES)
+    min_value = models.FloatField()
+    max_value = models.FloatField()
+
+    def clean(self):
+        if self.min_value is not None and self.max_value is not None and self.min_value > self.max_value:
+            raise ValidationError("The minimal value must not be larger than the maximal value.")
+
+    def __str__(self):
+        return "%s %s" % (self.get_sensor_display(), self.get_level_display())
+
+    class Meta:
+        unique_together = ('study', 'sensor', 'level')
+
+
+def get_sensor_thresholds(threshold_list=()):
+    """
+    Returns the default ranges of the sensor levels, overridden by the given SensorThreshold objects.
+    """
+    thresholds = {sensor: dict(ranges) for sensor, ranges in SensorThreshold.DEFAULT_RANGES.items()}
+    for threshold in threshold_list:
+        # whole numbers are sent like the defaults, without a decimal point
+        thresholds[threshold.sensor][threshold.level] = tuple(
+            int(value) if value.is_integer() else value for value in (threshold.min_value, threshold.max_value))
+    return thresholds
+
+
 class AbstractQuestion(models.Model):
     # belongs to either a normal questionnaire or a proband info questionnaire
     questionnaire = models.ForeignKey(Questionnaire, on_delete=models.CASCADE, null=True)
@@ -183,29 +287,148 @@ class Proband(models.Model):
         return self.id
 
 
+def encode_sensor_values(sensor_value_dict):
+    return json.dumps(sensor_value_dict, ensure_ascii=False, separators=(',', ':'))
+
+
+def decode_sensor_values(sensor_values):
+    if sensor_values is None:
+        return {}
+    return json.loads(sensor_values)
+
+
 # simulation of a dictionary-like key-value pair for Proband
 class ProbandInfoCell(models.Model):
     proband = models.ForeignKey(Proband, on_delete=models.CASCADE, null=True)
     key = models.CharField(max_length=200)
     value = models.CharField(max_length=200)
 
+    class Meta:
+        # the values of a key of one proband, oldest first
+        index_together = [['proband', 'key', 'id']]
+
 
 class QuestionnaireAnswer(models.Model):
     questionnaire = models.ForeignKey(Questionnaire, on_delete=models.CASCADE, null=True)
     submitter = models.ForeignKey(Proband, on_delete=models.CASCADE, null=True)
     submit_time = models.DateTimeField(null=True)
+    # the sensor values sent with the answer, as a JSON object in the order the app sent them
+    sensor_values = models.TextField(null=True)
+
+    def get_sensor_values(self):
+        return decode_sensor_values(self.sensor_values)
+
+    def set_sensor_values(self, sensor_value_dict):
+        self.sensor_values = encode_sensor_values(sensor_value_dict)
 
     class Meta:
         order_with_respect_to = 'questionnaire'
+        # exports page through the answers of a questionnaire by id, time ranges filter by submit time
+        index_together = [['questionnaire', 'id'], ['questionnaire', 'submit_time']]
+
 
+# idempotency key of every stored submission, so that retries of the app don't store an answer twice
+class ProcessedSubmission(models.Model):
+    idempotency_key = models.CharField(max_length=64, unique=True)
+    processed_time = models.DateTimeField(auto_now_add=True)
 
-# simulation of a dictionary-like key-value pair for QuestionnaireAnswer
+
+# the former storage of the sensor values of a QuestionnaireAnswer;
+# move_sensor_values moves its rows into QuestionnaireAnswer.sensor_values
 class SensorValueCell(models.Model):
     questionnaire_answer = models.ForeignKey(QuestionnaireAnswer, on_delete=models.CASCADE, null=True)
     key = models.CharField(max_length=200)
     value = models.CharField(max_length=200)
 
 
+def format_answer_number(number):
+    # whole numbers without a fraction, like the app sends them
+    if number.is_integer():
+        return '%d' % number
+    return repr(number)
+
+
+# the answer to one question of a questionnaire answer; like ChoiceOption,
+# it has a foreign key for every question type, of which only one is set
+class QuestionAnswer(models.Model):
+    TEXT = 'T'
+    SINGLE_CHOICE = 'S'
+    MULTI_CHOICE = 'M'
+    DRAG_SCALE = 'D'
+    QUESTION_TYPE_CHOICES = (
+        (TEXT, 'Text'),
+        (SINGLE_CHOICE, 'Single choice'),
+        (MULTI_CHOICE, 'Multiple choice'),
+        (DRAG_SCALE, 'Drag scale'),
+    )
+    QUESTION_FIELDS = {
+        TEXT: 'text_question',
+        SINGLE_CHOICE: 'single_choice_question',
+        MULTI_CHOICE: 'multi_choice_question',
+        DRAG_SCALE: 'drag_scale_question',
+    }
+    QUESTION_TYPES = {
+        TextQuestion: TEXT,
+        SingleChoiceQuestion: SINGLE_CHOICE,
+        MultiChoiceQuestion: MULTI_CHOICE,
+        DragScaleQuestion: DRAG_SCALE,
+    }
+
+    questionnaire_answer = models.ForeignKey(QuestionnaireAnswer, on_delete=models.CASCADE, null=True)
+    question_type = models.CharField(max_length=1, choices=QUESTION_TYPE_CHOICES)
+    text_question = models.ForeignKey(TextQuestion, on_delete=models.CASCADE, null=True)
+    single_choice_question = models.ForeignKey(SingleChoiceQuestion, on_delete=models.CASCADE, null=True)
+    multi_choice_question = models.ForeignKey(MultiChoiceQuestion, on_delete=models.CASCADE, null=True)
+    drag_scale_question = models.ForeignKey(DragScaleQuestion, on_delete=models.CASCADE, null=True)
+
+    # drag scale values are stored as numbers, so that they can be aggregated in SQL;
+    # text only holds the answer if the number doesn't reproduce it exactly.
+    # Multiple choice selections are kept as text, since choice options can still be edited after answers came in.
+    text = models.TextField(null=True)
+    number = models.FloatField(null=True)
+
+    def _encode_number(self):
+        if self.question_type != self.DRAG_SCALE or self.text is None or self.number is not None:
+            return
+        try:
+            number = float(self.text)
+        except ValueError:
+            return
+        if not math.isfinite(number):
+            return
+        self.number = number
+        if format_answer_number(number) == self.text:
+            self.text = None
+
+    # question and value work like the fields of the former per type answer models
+
+    @property
+    def question(self):
+        return getattr(self, self.QUESTION_FIELDS[self.question_type])
+
+    @question.setter
+    def question(self, question):
+        self.question_type = self.QUESTION_TYPES[type(question)]
+        setattr(self, self.QUESTION_FIELDS[self.question_type], question)
+        self._encode_number()
+
+    @property
+    def value(self):
+        if self.text is None and self.number is not None:
+            return format_answer_number(self.number)
+        return self.text
+
+    @value.setter
+    def value(self, value):
+        self.text = value if value is None else str(value)
+        self.number = None
+        self._encode_number()
+
+    def __str__(self):
+        return "%s - Answer" % self.question.question_text
+
+
+# the former per type answer tables; move_question_answers moves their rows into QuestionAnswer
 class AbstractQuestionAnswer(models.Model):
     questionnaire_answer = models.ForeignKey(QuestionnaireAnswer, on_delete=models.CASCADE, null=True)
 
@@ -234,3 +457,51 @@ class MultiChoiceQuestionAnswer(AbstractQuestionAnswer):
 class DragScaleQuestionAnswer(AbstractQuestionAnswer):
     question = models.ForeignKey(DragScaleQuestion, on_delete=models.CASCADE, null=True)
     value = models.TextField(null=True)
+
+
+# a study export written to a file in the background; see export_jobs.py
+class ExportJob(models.Model):
+    STUDY_ANSWER = "study_answer"
+    PROBAND_INFO = "proband_info"
+    KIND_CHOICES = (
+        (STUDY_ANSWER, "Study answers"),
+        (PROBAND_INFO, "Proband info")
+    )
+
+    CSV = "csv"
+    CSV_GZIP = "csv.gz"
+    PARQUET = "parquet"
+    FILE_FORMAT_CHOICES = (
+        (CSV, "CSV"),
+        (CSV_GZIP, "gzip compressed CSV"),
+        (PARQUET, "Parquet")
+    )
+
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = (
+        (PENDING, "pending"),
+        (RUNNING, "running"),
+        (DONE, "done"),
+        (FAILED, "failed")
+    )
+
+    study = models.ForeignKey(Study, on_delete=models.CASCADE)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    file_format = models.CharField(max_length=10, choices=FILE_FORMAT_CHOICES)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+
+    # the state of the study the export was made from; an unchanged study reuses the file
+    answer_count = models.PositiveIntegerField(null=True)
+    study_revision = models.PositiveIntegerField(null=True)
+
+    progress = models.PositiveIntegerField("Rows written", default=0)
+    file_name = models.CharField(max_length=100, blank=True)
+    error = models.TextField(blank=True)
+    created_time = models.DateTimeField(auto_now_add=True)
+    finished_time = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return "%s - %s" % (self.study.name, self.get_kind_display())
@@ -0,0 +1,112 @@
+"""
+The times at which the time-based trigger events of a study fire.
+
+A trigger event fires once at its datetime and every day at its time, in the time zone of the server, between the
+start and the end of the study. A trigger that comes less than min_time_space after the previous one of the same
+questionnaire is dropped, as are the triggers of a day beyond Questionnaire.max_trigger_times_per_day.
+Triggers depending only on sensors or calendar events can't be predicted and aren't part of the schedule.
+
+The schedule of a study is a pair of lists: the trigger times as Unix timestamps in ascending order, and the
+questionnaire ID of each. It is computed once per study revision and cached.
+"""
+from .models import Questionnaire, Proband, Study
+from bisect import bisect_left
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+from django.utils import timezone
+import datetime
+
+
+def _to_timestamp(date_time):
+    return int(date_time.timestamp())
+
+
+def expand_trigger_times(questionnaire, trigger_event, start, end, tz=None):
+    """
+    Returns the aware datetimes in [start, end) at which the trigger event of the questionnaire fires.
+    """
+    tz = tz or timezone.get_default_timezone()
+    candidate_list = []
+    if trigger_event.datetime is not None and start <= trigger_event.datetime < end:
+        candidate_list.append(trigger_event.datetime)
+    if trigger_event.time is not None:
+        day = timezone.localtime(start, tz).date()
+        while True:
+            # a time skipped by a change to daylight saving time fires an hour later
+            date_time = timezone.make_aware(datetime.datetime.combine(day, trigger_event.time), tz, is_dst=False)
+            if date_time >= end:
+                break
+            if date_time >= start:
+                candidate_list.append(date_time)
+            day += datetime.timedelta(days=1)
+    candidate_list.sort()
+
+    min_time_space = trigger_event.min_time_space or datetime.timedelta(0)
+    time_list = []
+    day_count_dict = {}
+    for date_time in candidate_list:
+        if time_list and date_time - time_list[-1] < min_time_space:
+            continue
+        day = timezone.localtime(date_time, tz).date()
+        if day_count_dict.get(day, 0) >= questionnaire.max_trigger_times_per_day:
+            continue
+        day_count_dict[day] = day_count_dict.get(day, 0) + 1
+        time_list.append(date_time)
+    return time_list
+
+
+def build_schedule(study):
+    """
+    Returns (trigger time list, questionnaire ID list) of the study, sorted by time.
+    """
+    item_list = []
+    for questionnaire in Questionnaire.objects.filter(study=study).select_related('triggerevent'):
+        try:
+            trigger_event = questionnaire.triggerevent
+        except Questionnaire.triggerevent.RelatedObjectDoesNotExist:
+            continue
+        for date_time in expand_trigger_times(questionnaire, trigger_event, study.start_date_time,
+                                              study.end_date_time):
+            item_list.append((_to_timestamp(date_time), questionnaire.id))
+    item_list.sort()
+    return [time for time, questionnaire_id in item_list], [questionnaire_id for time, questionnaire_id in item_list]
+
+
+def get_schedule(study):
+    # computed once per study revision, like the downloaded study
+    cache_key = "study_schedule:%d:%d" % (study.id, study.revision)
+    schedule = cache.get(cache_key)
+    if schedule is None:
+        schedule = build_schedule(study)
+        cache.set(cache_key, schedule, settings.STUDY_JSON_CACHE_TIMEOUT)
+    return schedule
+
+
+def get_triggers(schedule, start, end):
+    """
+    Returns the (timestamp, questionnaire ID) pairs of the schedule from start to end (excluded).
+    """
+    time_list, questionnaire_id_list = schedule
+    first = bisect_left(time_list, _to_timestamp(start))
+    last = bisect_left(time_list, _to_timestamp(end))
+    return list(zip(time_list[first:last], questionnaire_id_list[first:last]))
+
+
+def forecast_submissions(start, end, bucket_seconds=60):
+    """
+    Returns (bucket start timestamp, expected submissions) of every time bucket from start to end in which
+    time-based triggers fire, assuming every proband of a study answers every trigger.
+    """
+    bucket_dict = {}
+    study_queryset = Study.objects.filter(start_date_time__lt=end, end_date_time__gt=start)
+    proband_count_dict = dict(Proband.objects.filter(study__in=study_queryset).values_list('study')
+                              .annotate(count=Count('id')))
+    for study in study_queryset:
+        proband_count = proband_count_dict.get(study.id, 0)
+        if not proband_count:
+            continue
+        for time, questionnaire_id in get_triggers(get_schedule(study), start, end):
+            bucket = time - time % bucket_seconds
+            bucket_dict[bucket] = bucket_dict.get(bucket, 0) + proband_count
+    return sorted(bucket_dict.items())
@@ -0,0 +1,185 @@
+from .models import TextQuestion, MultiChoiceQuestion, TriggerEvent, SensorThreshold, get_sensor_thresholds
+import json
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, the standard library encoder gives the same output
+    orjson = None
+
+
+# the proband ID is the only part of a downloaded study that differs between probands,
+# so it is spliced in front of the encoded study instead of encoding the study again for every proband
+STUDY_JSON_PREFIX = "{\"study\":{\"probandID\":\"%d\","
+# a study downloaded for a batch of probands, with the list of their IDs in front
+BULK_STUDY_JSON_PREFIX = "{\"probandIDs\":%s,\"study\":{"
+
+UNLIMITED_DURATION = 999999999  # default unlimited duration time of a questionnaire
+
+# the sensor level fields of a trigger event and their keys in the downloaded study, in the order they are sent
+SENSOR_KEYS = (
+    (SensorThreshold.LIGHT, "light"),
+    (SensorThreshold.RELATIVE_HUMIDITY, "relativeHumidity"),
+    (SensorThreshold.TEMPERATURE, "ambientTemperature"),
+    (SensorThreshold.AIR_PRESSURE, "pressure"),
+    (SensorThreshold.PROXIMITY, "proximity"),
+)
+
+# the sensor level ranges of studies without own thresholds
+DEFAULT_SENSOR_THRESHOLDS = get_sensor_thresholds()
+
+
+def encode(data):
+    # plain dicts, lists, strings, integers, booleans and None only
+    if orjson is not None:
+        return orjson.dumps(data).decode('utf-8')
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+
+
+def serialize_date_time(date_time):
+    if date_time is None:
+        return None
+
+    return {
+        "year": date_time.year,
+        "month": date_time.month,
+        "day": date_time.day,
+        "hour": date_time.hour,
+        "minute": date_time.minute,
+        "second": date_time.second,
+    }
+
+
+def serialize_time(time):
+    if time is None:
+        return None
+    return "%d-%d-%d" % (time.hour, time.minute, time.second)
+
+
+def serialize_questions(question_list):
+    # question.option_list must be attached by load_study_graph
+    question_data_list = []
+
+    # next question ids by position; the first question at a position wins
+    next_question_id_dict = {}
+    for question in reversed(question_list):
+        next_question_id_dict[question.position] = str(question.id)
+
+    for question in question_list:
+        option_list = question.option_list
+
+        if len(option_list) != 0:  # the question must be a choice question
+            if isinstance(question, MultiChoiceQuestion):
+                question_type = "MultipleChoice"
+            else:
+                question_type = "SingleChoice"
+        else:  # the question is not a choice question
+            if isinstance(question, TextQuestion):
+                question_type = "TextAnswer"
+            else:
+                question_type = "DragScale"
+
+        # question type specific data
+        question_type_data = {"typeName": question_type}
+
+        # options for choice question
+        if question_type == "MultipleChoice" or question_type == "SingleChoice":
+            question_type_data["options"] = []
+            for option in option_list:
+                question_type_data["options"].append({
+                    "optionContent": option.choice_text,
+                    "nextQuestionID": next_question_id_dict.get(option.next_question_position, ""),
+                })
+
+        # drag interval for drag scale question
+        elif question_type == "DragScale":
+            question_type_data["maxValue"] = int(question.max_value)
+
+        question_data_list.append({
+            "questionID": str(question.id),
+            "questionContent": question.question_text,
+            "showByDefault": question.show_by_default,
+            "questionType": question_type_data,
+        })
+
+    return question_data_list
+
+
+# sensor_thresholds is a table returned by get_sensor_thresholds
+def serialize_trigger_event(trigger_event, sensor_thresholds=DEFAULT_SENSOR_THRESHOLDS):
+    trigger_event_data = {
+        "minTimeSpace": int(trigger_event.min_time_space.total_seconds()),
+        "datetime": serialize_date_time(trigger_event.datetime),
+        "time": serialize_time(trigger_event.time),
+    }
+
+    for field, key in SENSOR_KEYS:
+        level = getattr(trigger_event, field)
+        if level is None:
+            trigger_event_data[key] = False
+            continue
+        level_ranges = sensor_thresholds[field]
+        min_value, max_value = level_ranges.get(level) or level_ranges[TriggerEvent.AlWAYS]
+        trigger_event_data[key] = True
+        trigger_event_data[key + "MinValue"] = min_value
+        trigger_event_data[key + "MaxValue"] = max_value
+
+    return trigger_event_data
+
+
+def serialize_questionnaire(questionnaire, sensor_thresholds=DEFAULT_SENSOR_THRESHOLDS):
+    if questionnaire.due_after is None:
+        duration = UNLIMITED_DURATION
+    else:
+        duration = int(questionnaire.due_after.total_seconds())
+
+    return {
+        "questionnaireID": str(questionnaire.id),
+        "questionnaireName": questionnaire.name,
+        "maxShowUpTimesPerDay": questionnaire.max_trigger_times_per_day,
+        "duration": {"second": duration},
+        "triggerEvent": serialize_trigger_event(questionnaire.triggerevent, sensor_thresholds),
+        "questions": serialize_questions(questionnaire.question_list),
+    }
+
+
+# the study without its questionnaires; study must be loaded by load_study_graph
+def serialize_study_header(study):
+    return {
+        "studyId": str(study.id),
+        "studyName": study.name,
+        "beginningDate": serialize_date_time(study.start_date_time),
+        "endDate": serialize_date_time(study.end_date_time),
+        "probandInfoQuestionnaire": {
+            "questions": serialize_questions(study.proband_info_question_list)
+        },
+    }
+
+
+# everything of a downloaded study except the proband ID; study must be loaded by load_study_graph
+def serialize_study(study):
+    study_data = serialize_study_header(study)
+    study_data["questionnaires"] = [serialize_questionnaire(questionnaire, study.sensor_thresholds)
+                                    for questionnaire in study.questionnaire_list]
+    return study_data
+
+
+# the encoded study following STUDY_JSON_PREFIX
+def encode_study(study):
+    return encode(serialize_study(study))[1:] + "}"
+
+
+def splice_proband_id(study_json, proband_id):
+    return STUDY_JSON_PREFIX % proband_id + study_json
+
+
+def splice_proband_ids(study_json, proband_id_list):
+    return BULK_STUDY_JSON_PREFIX % encode([str(proband_id) for proband_id in proband_id_list]) + study_json
+
+
+# the 3 standard proband info questions showed during proband registration
+def serialize_proband_info_questionnaire(proband_info_questionnaire):
+    return {
+        "birthday": proband_info_questionnaire.ask_for_birthday,
+        "gender": proband_info_questionnaire.ask_for_gender,
+        "occupation": proband_info_questionnaire.ask_for_occupation,
+    }
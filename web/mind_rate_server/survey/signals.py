@@ -0,0 +1,114 @@
+from .export_jobs import get_export_path
+from .models import ExportJob, Study, StudyChange, ProbandInfoQuestionnaire, Questionnaire, TriggerEvent, \
+    AbstractQuestion, TextQuestion, DragScaleQuestion, SingleChoiceQuestion, MultiChoiceQuestion, ChoiceOption, \
+    SensorThreshold
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+from django.db.backends.signals import connection_created
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete
+import os
+
+
+# all models whose content ends up in the downloaded study
+STUDY_DEFINITION_MODELS = (Study, ProbandInfoQuestionnaire, Questionnaire, TriggerEvent, TextQuestion,
+                           DragScaleQuestion, SingleChoiceQuestion, MultiChoiceQuestion, ChoiceOption, SensorThreshold)
+
+
+def _get_study_id(instance):
+    if instance is None:
+        return None
+
+    if isinstance(instance, Study):
+        return instance.id
+    if isinstance(instance, (ProbandInfoQuestionnaire, Questionnaire, SensorThreshold)):
+        return instance.study_id
+    if isinstance(instance, TriggerEvent):
+        return _get_study_id(instance.questionnaire)
+    if isinstance(instance, AbstractQuestion):
+        if instance.questionnaire_id is not None:
+            return _get_study_id(instance.questionnaire)
+        return _get_study_id(instance.proband_info_questionnaire)
+    if isinstance(instance, ChoiceOption):
+        for question in (instance.single_choice_question, instance.multi_choice_question,
+                         instance.text_question, instance.drag_scale_question):
+            if question is not None:
+                return _get_study_id(question)
+    return None
+
+
+def _get_questionnaire_id(instance):
+    # the questionnaire a part of a study belongs to;
+    # None for the study, its proband info questionnaire and its sensor thresholds
+    if isinstance(instance, Questionnaire):
+        return instance.id
+    if isinstance(instance, (TriggerEvent, AbstractQuestion)):
+        return instance.questionnaire_id
+    if isinstance(instance, ChoiceOption):
+        for question in (instance.single_choice_question, instance.multi_choice_question,
+                         instance.text_question, instance.drag_scale_question):
+            if question is not None:
+                return question.questionnaire_id
+    return None
+
+
+def bump_study_revision(study_id):
+    # returns the new revision, or None if the study is gone;
+    # the study row stays locked until the end of the transaction, so no other change gets the same revision
+    Study.objects.filter(id=study_id).update(revision=F('revision') + 1)
+    return Study.objects.filter(id=study_id).values_list('revision', flat=True).first()
+
+
+def _study_definition_changed(sender, instance, **kwargs):
+    deleted = kwargs['signal'] is post_delete
+    if sender is Study and deleted:
+        # the changes logged while the parts of the study were deleted before it
+        StudyChange.objects.filter(study_id=instance.id).delete()
+        return
+
+    if sender is Study:
+        # a new study has nothing cached yet; saving only the counters doesn't change the definition
+        if kwargs.get('created'):
+            return
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and update_fields <= set(Study.COUNTER_FIELDS):
+            return
+
+    try:
+        study_id = _get_study_id(instance)
+    except ObjectDoesNotExist:  # the parent is already gone, e.g. during a cascading delete
+        return
+
+    if study_id is None:
+        return
+    revision = bump_study_revision(study_id)
+    if revision is not None:
+        StudyChange.objects.create(study_id=study_id, revision=revision, model=sender.__name__, object_id=instance.id,
+                                   questionnaire_id=_get_questionnaire_id(instance), deleted=deleted)
+
+
+def _export_job_deleted(sender, instance, **kwargs):
+    if instance.file_name and os.path.exists(get_export_path(instance)):
+        os.remove(get_export_path(instance))
+
+
+def apply_sqlite_pragmas(cursor, pragmas):
+    for name, value in pragmas.items():
+        cursor.execute("PRAGMA %s = %s" % (name, value))
+
+
+def _connection_created(sender, connection, **kwargs):
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            apply_sqlite_pragmas(cursor, settings.SQLITE_PRAGMAS)
+
+
+def connect_signals():
+    for model in STUDY_DEFINITION_MODELS:
+        post_save.connect(_study_definition_changed, sender=model,
+                          dispatch_uid='study_definition_saved_%s' % model.__name__)
+        post_delete.connect(_study_definition_changed, sender=model,
+                            dispatch_uid='study_definition_deleted_%s' % model.__name__)
+
+    post_delete.connect(_export_job_deleted, sender=ExportJob, dispatch_uid='export_job_deleted')
+    connection_created.connect(_connection_created, dispatch_uid='sqlite_pragmas')
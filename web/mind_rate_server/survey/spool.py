@@ -0,0 +1,102 @@
+"""
+A durable local queue of received answer submissions.
+
+The spool is a separate SQLite file, so appending to it never waits for the write lock of the main
+database. The process_answer_queue management command drains it into the answer tables.
+"""
+from django.conf import settings
+from collections import namedtuple
+import sqlite3
+import threading
+import time
+
+
+SpooledSubmission = namedtuple('SpooledSubmission', ['id', 'idempotency_key', 'body', 'attempts'])
+
+CREATE_TABLE = "CREATE TABLE IF NOT EXISTS submission (" \
+               "id INTEGER PRIMARY KEY AUTOINCREMENT, " \
+               "idempotency_key TEXT NOT NULL UNIQUE, " \
+               "body TEXT NOT NULL, " \
+               "received_time REAL NOT NULL, " \
+               "attempts INTEGER NOT NULL DEFAULT 0, " \
+               "error TEXT)"
+
+
+class AnswerSpool(object):
+    def __init__(self, path, max_attempts=5, timeout=30):
+        self.path = path
+        self.max_attempts = max_attempts  # failed submissions are kept for inspection, but not retried forever
+        self.timeout = timeout
+        self._table_created = False
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=self.timeout)
+        if not self._table_created:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(CREATE_TABLE)
+            connection.commit()
+            self._table_created = True
+        return connection
+
+    def append(self, idempotency_key, body):
+        # returns False if a submission with the same key is already waiting
+        connection = self._connect()
+        try:
+            with connection:
+                cursor = connection.execute(
+                    "INSERT OR IGNORE INTO submission (idempotency_key, body, received_time) VALUES (?, ?, ?)",
+                    (idempotency_key, body, time.time()))
+            return cursor.rowcount == 1
+        finally:
+            connection.close()
+
+    def read_batch(self, size):
+        connection = self._connect()
+        try:
+            rows = connection.execute(
+                "SELECT id, idempotency_key, body, attempts FROM submission WHERE attempts < ? ORDER BY id LIMIT ?",
+                (self.max_attempts, size)).fetchall()
+            return [SpooledSubmission(*row) for row in rows]
+        finally:
+            connection.close()
+
+    def remove(self, id_list):
+        if not id_list:
+            return
+        connection = self._connect()
+        try:
+            with connection:
+                connection.executemany("DELETE FROM submission WHERE id = ?", [(i,) for i in id_list])
+        finally:
+            connection.close()
+
+    def mark_failed(self, submission_id, error):
+        connection = self._connect()
+        try:
+            with connection:
+                connection.execute("UPDATE submission SET attempts = attempts + 1, error = ? WHERE id = ?",
+                                   (error, submission_id))
+        finally:
+            connection.close()
+
+    def count(self):
+        # returns the number of waiting and of failed submissions
+        connection = self._connect()
+        try:
+            return connection.execute(
+                "SELECT COALESCE(SUM(attempts < ?), 0), COALESCE(SUM(attempts >= ?), 0) FROM submission",
+                (self.max_attempts, self.max_attempts)).fetchone()
+        finally:
+            connection.close()
+
+
+_spool_dict = {}
+_spool_dict_lock = threading.Lock()
+
+
+def get_answer_spool():
+    path = settings.ANSWER_SPOOL_PATH
+    with _spool_dict_lock:
+        if path not in _spool_dict:
+            _spool_dict[path] = AnswerSpool(path, max_attempts=settings.ANSWER_SPOOL_MAX_ATTEMPTS)
+        return _spool_dict[path]
@@ -0,0 +1,87 @@
+from .models import Study, ProbandInfoQuestionnaire, Questionnaire, TextQuestion, DragScaleQuestion, \
+    SingleChoiceQuestion, MultiChoiceQuestion, ChoiceOption, SensorThreshold, get_sensor_thresholds
+from django.db.models import Q
+from django.shortcuts import get_object_or_404
+
+
+# the order in which question lists used to be concatenated before sorting by position;
+# keep it so that questions sharing a position come out in the same order as before
+QUESTION_MODELS = (TextQuestion, DragScaleQuestion, SingleChoiceQuestion, MultiChoiceQuestion)
+
+# the ChoiceOption foreign key pointing to each question model
+OPTION_FIELDS = {
+    TextQuestion: 'text_question',
+    DragScaleQuestion: 'drag_scale_question',
+    SingleChoiceQuestion: 'single_choice_question',
+    MultiChoiceQuestion: 'multi_choice_question',
+}
+
+
+def study_queryset():
+    # the proband info questionnaire is a reverse one-to-one, so it can be joined in
+    return Study.objects.select_related('probandinfoquestionnaire')
+
+
+def get_study(study_id):
+    return get_object_or_404(study_queryset(), id=study_id)
+
+
+def load_study_graph(study):
+    """
+    Fetch all questionnaires, trigger events, questions and choice options of a study
+    with a fixed number of queries, no matter how large the study is.
+
+    The related objects are attached to the model instances:
+    study.questionnaire_list, questionnaire.question_list, question.option_list and
+    study.proband_info_question_list, which is empty for a study without a proband info questionnaire.
+    Trigger events are available as questionnaire.triggerevent without further queries,
+    the sensor level ranges of the study as study.sensor_thresholds.
+    """
+    try:
+        proband_info_questionnaire = study.probandinfoquestionnaire
+    except ProbandInfoQuestionnaire.DoesNotExist:
+        proband_info_questionnaire = None
+
+    questionnaire_list = list(Questionnaire.objects.filter(study=study).select_related('triggerevent'))
+    questionnaire_dict = {}
+    for questionnaire in questionnaire_list:
+        questionnaire.question_list = []
+        questionnaire_dict[questionnaire.id] = questionnaire
+    proband_info_question_list = []
+
+    # one query per question type, covering both normal and proband info questionnaires
+    question_dict = {}
+    option_filter = Q()
+    for model in QUESTION_MODELS:
+        question_filter = Q(questionnaire__study=study)
+        if proband_info_questionnaire is not None:
+            question_filter |= Q(proband_info_questionnaire=proband_info_questionnaire)
+        question_queryset = model.objects.filter(question_filter)
+
+        for question in question_queryset:
+            question.option_list = []
+            question_dict[(model, question.id)] = question
+
+            if question.questionnaire_id is not None:
+                questionnaire_dict[question.questionnaire_id].question_list.append(question)
+            else:
+                proband_info_question_list.append(question)
+
+        # reuse the question query as a sub query, so the options need only one more round trip
+        option_filter |= Q(**{OPTION_FIELDS[model] + '__in': question_queryset.values('id')})
+
+    # one query for the choice options of all questions
+    for option in ChoiceOption.objects.filter(option_filter).order_by('id'):
+        for model, field in OPTION_FIELDS.items():
+            question_id = getattr(option, field + '_id')
+            if question_id is not None and (model, question_id) in question_dict:
+                question_dict[(model, question_id)].option_list.append(option)
+
+    for questionnaire in questionnaire_list:
+        questionnaire.question_list.sort(key=lambda question: question.position)
+    proband_info_question_list.sort(key=lambda question: question.position)
+
+    study.questionnaire_list = questionnaire_list
+    study.proband_info_question_list = proband_info_question_list
+    study.sensor_thresholds = get_sensor_thresholds(SensorThreshold.objects.filter(study=study))
+    return study
@@ -1,3 +1,1173 @@
 from django.test import TestCase
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Sum
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from .models import Proband, Study, ProbandInfoQuestionnaire, Questionnaire, TriggerEvent, TextQuestion, \
+    SingleChoiceQuestion, MultiChoiceQuestion, DragScaleQuestion, ChoiceOption, ProbandInfoCell, QuestionnaireAnswer, \
+    SensorValueCell, QuestionAnswer, MultiChoiceQuestionAnswer, DragScaleQuestionAnswer, ExportJob, StudyChange, \
+    SensorThreshold
+from .compression import choose_encoding, get_encodings
+from .counters import increment_answer_counter, get_answer_count, flush_answer_counters
+from .ingest import store_answer, store_answer_once, validate_submission, get_idempotency_key, move_legacy_answers
+from .export_jobs import request_export, get_export_path
+from . import exports
+from .exports import csv_chunks, study_answer_rows, proband_info_rows
+from .journal import RequestJournal, get_request_journal
+from .schedule import expand_trigger_times, get_schedule, get_triggers, forecast_submissions
+from .signals import apply_sqlite_pragmas
+from .spool import AnswerSpool, get_answer_spool
+from benchmarks.generators import StudySpec, create_study, create_probands, create_answers, get_questions
+from django.core.management import call_command
+from django.test import override_settings
+from unittest import mock, skipUnless
+from django.utils.six import StringIO
+import csv
+import datetime
+import gzip
+import io
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
 
-# Create your tests here.
+
+def _create_study(questionnaire_count=1, name="Test study"):
+    now = timezone.now()
+    study = Study.objects.create(name=name, start_date_time=now, end_date_time=now + datetime.timedelta(days=7))
+    proband_info_questionnaire = ProbandInfoQuestionnaire.objects.create(study=study, ask_for_gender=True)
+    TextQuestion.objects.create(proband_info_questionnaire=proband_info_questionnaire,
+                                question_text="Info", position=1)
+
+    for i in range(questionnaire_count):
+        questionnaire = Questionnaire.objects.create(study=study, name="Questionnaire %d" % i,
+                                                     due_after=datetime.timedelta(hours=24))
+        TriggerEvent.objects.create(questionnaire=questionnaire, min_time_space=datetime.timedelta(minutes=10),
+                                    time=datetime.time(9, 30), light="M")
+
+        TextQuestion.objects.create(questionnaire=questionnaire, question_text="Text", position=1)
+        DragScaleQuestion.objects.create(questionnaire=questionnaire, question_text="Scale", position=2)
+        single_choice_question = SingleChoiceQuestion.objects.create(
+            questionnaire=questionnaire, question_text="Single", position=3)
+        multi_choice_question = MultiChoiceQuestion.objects.create(
+            questionnaire=questionnaire, question_text="Multi", position=4)
+
+        ChoiceOption.objects.create(single_choice_question=single_choice_question, choice_text="Yes",
+                                    next_question_position=1)
+        ChoiceOption.objects.create(single_choice_question=single_choice_question, choice_text="No")
+        ChoiceOption.objects.create(multi_choice_question=multi_choice_question, choice_text="A")
+        ChoiceOption.objects.create(multi_choice_question=multi_choice_question, choice_text="B")
+
+    return study
+
+
+class StudyDownloadTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def _count_download_queries(self, study):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/download/%d/' % study.id)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def test_download_query_count_is_flat(self):
+        small_study = _create_study(questionnaire_count=1)
+        large_study = _create_study(questionnaire_count=10)
+        self.assertEqual(self._count_download_queries(small_study), self._count_download_queries(large_study))
+
+    def test_download_content(self):
+        study = _create_study(questionnaire_count=2)
+        data = json.loads(self.client.get('/download/%d/' % study.id).content.decode())['study']
+
+        self.assertEqual(data['studyId'], str(study.id))
+        self.assertEqual(len(data['probandInfoQuestionnaire']['questions']), 1)
+        self.assertEqual(len(data['questionnaires']), 2)
+
+        questions = data['questionnaires'][0]['questions']
+        self.assertEqual([question['questionType']['typeName'] for question in questions],
+                         ['TextAnswer', 'DragScale', 'SingleChoice', 'MultipleChoice'])
+        self.assertEqual([option['optionContent'] for option in questions[2]['questionType']['options']],
+                         ['Yes', 'No'])
+        self.assertEqual(questions[2]['questionType']['options'][0]['nextQuestionID'], questions[0]['questionID'])
+
+    def test_download_escapes_text(self):
+        study = _create_study(name="A \"quoted\" \\ name")
+        TextQuestion.objects.filter(question_text="Text").update(question_text="Line\nbreak \"here\"")
+        data = json.loads(self.client.get('/download/%d/' % study.id).content.decode())['study']
+
+        self.assertEqual(data['studyName'], "A \"quoted\" \\ name")
+        self.assertEqual(data['questionnaires'][0]['questions'][0]['questionContent'], "Line\nbreak \"here\"")
+
+    def test_study_without_proband_info_questionnaire(self):
+        study = _create_study()
+        ProbandInfoQuestionnaire.objects.filter(study=study).delete()
+        study = Study.objects.get(id=study.id)
+
+        data = json.loads(self.client.get('/download/%d/' % study.id).content.decode())['study']
+        self.assertEqual(data['probandInfoQuestionnaire']['questions'], [])
+        self.assertEqual(len(data['questionnaires'][0]['questions']), 4)
+        response = self.client.get('/download/%d/changes/?since=0' % study.id)
+        self.assertEqual(response.status_code, 200)
+
+        User.objects.create_superuser('admin', 'admin@example.org', 'password')
+        self.client.login(username='admin', password='password')
+        response = self.client.post('/admin/survey/study/', {'action': 'preview_questions',
+                                                             '_selected_action': [study.id]})
+        self.assertEqual(response.status_code, 200)
+
+    def test_proband_info_questionnaire_query_count(self):
+        study = _create_study()
+        with self.assertNumQueries(1):
+            response = self.client.get('/proband_info/%d/' % study.id)
+        self.assertEqual(json.loads(response.content.decode()),
+                         {"birthday": False, "gender": True, "occupation": False})
+
+
+class StudyDownloadCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_proband_id_is_spliced_into_cached_study(self):
+        study = _create_study()
+        first = json.loads(self.client.get('/download/%d/' % study.id).content.decode())['study']
+        with CaptureQueriesContext(connection) as context:
+            second = json.loads(self.client.get('/download/%d/' % study.id).content.decode())['study']
+
+        self.assertNotEqual(first.pop('probandID'), second.pop('probandID'))
+        self.assertEqual(first, second)
+        # revision lookup, study lookup and the proband insert
+        self.assertEqual(len(context.captured_queries), 3)
+
+    def test_not_modified(self):
+        study = _create_study()
+        etag = self.client.get('/download/%d/' % study.id)['ETag']
+        proband_count = Proband.objects.count()
+
+        response = self.client.get('/download/%d/' % study.id, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(Proband.objects.count(), proband_count)
+
+    def test_change_invalidates_cache(self):
+        study = _create_study()
+        etag = self.client.get('/download/%d/' % study.id)['ETag']
+
+        option = ChoiceOption.objects.get(choice_text="Yes")
+        option.choice_text = "Sure"
+        option.save()
+
+        response = self.client.get('/download/%d/' % study.id, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertIn("Sure", response.content.decode())
+
+    def test_answer_counter_keeps_cache(self):
+        study = _create_study()
+        revision = Study.objects.get(id=study.id).revision
+        study.answer_updated_times += 1
+        study.save(update_fields=['answer_updated_times'])
+        self.assertEqual(Study.objects.get(id=study.id).revision, revision)
+
+
+class StudyChangesTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.study = _create_study(questionnaire_count=2)
+        self.revision = int(self.client.get('/download/%d/' % self.study.id)['X-Study-Revision'])
+        self.first, self.second = Questionnaire.objects.filter(study=self.study).order_by('id')
+
+    def _get_changes(self, since):
+        response = self.client.get('/download/%d/changes/?since=%s' % (self.study.id, since))
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content.decode())
+
+    def test_no_changes(self):
+        self.assertEqual(self._get_changes(self.revision), {
+            "studyId": str(self.study.id), "revision": self.revision, "full": False,
+            "questionnaires": [], "deletedQuestionnaireIDs": []})
+
+    def test_changed_question(self):
+        question = TextQuestion.objects.get(questionnaire=self.second)
+        question.question_text = "Fixed typo"
+        question.save()
+
+        changes = self._get_changes(self.revision)
+        self.assertEqual(changes["revision"], self.revision + 1)
+        self.assertNotIn("study", changes)
+        self.assertEqual([questionnaire["questionnaireID"] for questionnaire in changes["questionnaires"]],
+                         [str(self.second.id)])
+        self.assertIn("Fixed typo", json.dumps(changes))
+        # the same as the questionnaire of a new download
+        study_data = json.loads(self.client.get('/download/%d/' % self.study.id).content.decode())['study']
+        self.assertEqual(changes["questionnaires"][0], study_data["questionnaires"][1])
+
+    def test_deleted_questionnaire_and_changed_study(self):
+        second_id = self.second.id
+        self.second.delete()
+        self.study.name = "Renamed"
+        self.study.save()
+
+        changes = self._get_changes(self.revision)
+        self.assertEqual(changes["study"]["studyName"], "Renamed")
+        self.assertNotIn("questionnaires", changes["study"])
+        self.assertEqual(changes["questionnaires"], [])
+        self.assertEqual(changes["deletedQuestionnaireIDs"], [str(second_id)])
+        self.assertEqual(changes["revision"], Study.objects.get(id=self.study.id).revision)
+
+    def test_unlogged_revisions_send_the_whole_study(self):
+        StudyChange.objects.filter(study=self.study, revision__lte=3).delete()
+        changes = self._get_changes(2)
+        self.assertTrue(changes["full"])
+        self.assertIn("study", changes)
+        self.assertEqual(len(changes["questionnaires"]), 2)
+
+        self.assertTrue(self._get_changes(self.revision + 5)["full"])
+        self.assertEqual(self.client.get('/download/%d/changes/?since=x' % self.study.id).status_code, 400)
+
+    def test_deleted_study_leaves_no_changes(self):
+        self.study.delete()
+        self.assertFalse(StudyChange.objects.exists())
+
+
+class SensorThresholdTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.study = _create_study()
+        self.other_study = _create_study(name="Other study")
+
+    def _get_trigger_event(self, study):
+        study_data = json.loads(self.client.get('/download/%d/' % study.id).content.decode())['study']
+        return study_data["questionnaires"][0]["triggerEvent"]
+
+    def test_default_ranges(self):
+        trigger_event = self._get_trigger_event(self.study)
+        self.assertEqual((trigger_event["light"], trigger_event["lightMinValue"], trigger_event["lightMaxValue"]),
+                         (True, 50, 400))
+        self.assertFalse(trigger_event["proximity"])
+        self.assertNotIn("proximityMinValue", trigger_event)
+
+    def test_study_overrides_range(self):
+        revision = self.client.get('/download/%d/' % self.study.id)['X-Study-Revision']
+        SensorThreshold.objects.create(study=self.study, sensor=SensorThreshold.LIGHT, level=TriggerEvent.MEDIUM,
+                                       min_value=80, max_value=500.5)
+
+        self.assertNotEqual(self.client.get('/download/%d/' % self.study.id)['X-Study-Revision'], revision)
+        trigger_event = self._get_trigger_event(self.study)
+        self.assertEqual((trigger_event["lightMinValue"], trigger_event["lightMaxValue"]), (80, 500.5))
+        self.assertEqual(self._get_trigger_event(self.other_study)["lightMinValue"], 50)
+
+        # the trigger events of all questionnaires contain the ranges
+        changes = json.loads(self.client.get('/download/%d/changes/?since=%s' % (self.study.id, revision))
+                             .content.decode())
+        self.assertEqual(changes["questionnaires"][0]["triggerEvent"], trigger_event)
+
+    def test_threshold_and_study_change(self):
+        revision = self.client.get('/download/%d/' % self.study.id)['X-Study-Revision']
+        self.study.name = "Renamed"
+        self.study.save()
+        SensorThreshold.objects.create(study=self.study, sensor=SensorThreshold.LIGHT, level=TriggerEvent.MEDIUM,
+                                       min_value=80, max_value=500)
+
+        changes = json.loads(self.client.get('/download/%d/changes/?since=%s' % (self.study.id, revision))
+                             .content.decode())
+        self.assertEqual(changes["study"]["studyName"], "Renamed")
+        self.assertEqual(changes["questionnaires"][0]["triggerEvent"]["lightMinValue"], 80)
+
+
+class BulkDownloadTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_bulk_download(self):
+        study = _create_study()
+        single = json.loads(self.client.get('/download/%d/' % study.id).content.decode())['study']
+        single.pop('probandID')
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/download/%d/bulk/' % study.id, {'count': 50})
+        data = json.loads(response.content.decode())
+        self.assertEqual(data['study'], single)
+        self.assertEqual(sorted(int(proband_id) for proband_id in data['probandIDs']),
+                         sorted(Proband.objects.filter(study=study).values_list('id', flat=True))[1:])
+        # study lookup and the proband insert, besides savepoints, and reading back the IDs if the insert can't
+        query_count = 2 if connection.features.can_return_ids_from_bulk_insert else 3
+        self.assertEqual(len([query for query in context.captured_queries
+                              if not query['sql'].startswith(('SAVEPOINT', 'RELEASE'))]), query_count)
+
+    def test_invalid_count(self):
+        study = _create_study()
+        for count in ('', 'many', '0', '1001'):
+            response = self.client.get('/download/%d/bulk/' % study.id, {'count': count})
+            self.assertEqual(response.status_code, 400)
+        self.assertFalse(Proband.objects.exists())
+
+
+def _create_submission(questionnaire, proband):
+    question_answer_list = []
+    for question in TextQuestion.objects.filter(questionnaire=questionnaire):
+        question_answer_list.append({"questionType": "TextAnswer", "questionID": str(question.id), "answer": "Fine"})
+    for question in DragScaleQuestion.objects.filter(questionnaire=questionnaire):
+        question_answer_list.append({"questionType": "DragScale", "questionID": str(question.id), "answer": "7"})
+    for question in SingleChoiceQuestion.objects.filter(questionnaire=questionnaire):
+        question_answer_list.append({"questionType": "SingleChoice", "questionID": str(question.id), "answer": "Yes"})
+    for question in MultiChoiceQuestion.objects.filter(questionnaire=questionnaire):
+        question_answer_list.append({"questionType": "MultipleChoice", "questionID": str(question.id),
+                                     "answer": "A, B"})
+
+    return {
+        "probandID": str(proband.id),
+        "questionnaireID": str(questionnaire.id),
+        "submitTime": {"year": 2017, "month": 6, "day": 1, "hour": 12, "minute": 30, "second": 0},
+        "sensorValues": {"light": "120.5", "temperature": "21.0"},
+        "questionAnswer": question_answer_list,
+    }
+
+
+class AnswerIngestTest(TestCase):
+    def _count_store_answer_queries(self, questionnaire, proband):
+        submission = _create_submission(questionnaire, proband)
+        with CaptureQueriesContext(connection) as context:
+            store_answer(submission)
+        return len(context.captured_queries)
+
+    def test_store_answer(self):
+        study = _create_study()
+        questionnaire = Questionnaire.objects.get(study=study)
+        proband = Proband.objects.create(study=study)
+        store_answer(_create_submission(questionnaire, proband))
+
+        questionnaire_answer = QuestionnaireAnswer.objects.get(questionnaire=questionnaire)
+        self.assertEqual(questionnaire_answer.submitter, proband)
+        self.assertEqual(questionnaire_answer.get_sensor_values(), {"light": "120.5", "temperature": "21.0"})
+        answer_queryset = QuestionAnswer.objects.filter(questionnaire_answer=questionnaire_answer)
+        drag_scale_answer = answer_queryset.get(question_type=QuestionAnswer.DRAG_SCALE)
+        self.assertEqual((drag_scale_answer.text, drag_scale_answer.number, drag_scale_answer.value), (None, 7, "7"))
+        self.assertEqual(answer_queryset.get(question_type=QuestionAnswer.MULTI_CHOICE).value, "A, B")
+        self.assertEqual(get_answer_count(study.id), 1)
+
+    def test_drag_scale_values(self):
+        study = _create_study()
+        questionnaire = Questionnaire.objects.get(study=study)
+        question = DragScaleQuestion.objects.get(questionnaire=questionnaire)
+        questionnaire_answer = QuestionnaireAnswer.objects.create(questionnaire=questionnaire)
+
+        # numbers the stored float doesn't reproduce keep their text
+        for value, text, number in (("7", None, 7), ("2.5", None, 2.5), ("7.50", "7.50", 7.5), ("high", "high", None)):
+            answer = QuestionAnswer.objects.create(questionnaire_answer=questionnaire_answer, question=question,
+                                                   value=value)
+            answer = QuestionAnswer.objects.get(id=answer.id)
+            self.assertEqual((answer.text, answer.number, answer.value), (text, number, value))
+
+        self.assertEqual(QuestionAnswer.objects.filter(drag_scale_question=question).aggregate(Sum('number')),
+                         {'number__sum': 17})
+
+    def test_move_legacy_answers(self):
+        study = _create_study()
+        questionnaire = Questionnaire.objects.get(study=study)
+        questionnaire_answer = QuestionnaireAnswer.objects.create(questionnaire=questionnaire)
+        DragScaleQuestionAnswer.objects.create(questionnaire_answer=questionnaire_answer, value="3",
+                                               question=DragScaleQuestion.objects.get(questionnaire=questionnaire))
+        MultiChoiceQuestionAnswer.objects.create(questionnaire_answer=questionnaire_answer, value="A",
+                                                 question=MultiChoiceQuestion.objects.get(questionnaire=questionnaire))
+
+        call_command('move_question_answers', stdout=StringIO())
+        self.assertFalse(DragScaleQuestionAnswer.objects.exists())
+        self.assertEqual(sorted((answer.question.question_text, answer.value)
+                                for answer in QuestionAnswer.objects.filter(questionnaire_answer=questionnaire_answer)),
+                         [("Multi", "A"), ("Scale", "3")])
+        self.assertEqual(move_legacy_answers(), 0)
+
+    def test_move_legacy_sensor_values(self):
+        study = _create_study()
+        questionnaire = Questionnaire.objects.get(study=study)
+        questionnaire_answer_list = [QuestionnaireAnswer.objects.create(questionnaire=questionnaire) for i in range(3)]
+        for questionnaire_answer in questionnaire_answer_list[:2]:
+            SensorValueCell.objects.create(questionnaire_answer=questionnaire_answer, key="light", value="80")
+            SensorValueCell.objects.create(questionnaire_answer=questionnaire_answer, key="proximity", value="5")
+
+        call_command('move_sensor_values', stdout=StringIO())
+        self.assertFalse(SensorValueCell.objects.exists())
+        self.assertEqual([questionnaire_answer.get_sensor_values() for questionnaire_answer in
+                          QuestionnaireAnswer.objects.filter(questionnaire=questionnaire).order_by('id')],
+                         [{"light": "80", "proximity": "5"}, {"light": "80", "proximity": "5"}, {}])
+
+    @override_settings(ANSWER_COUNTER_SHARDS=1)  # the first use of a random shard costs an insert
+    def test_store_answer_query_count_is_flat(self):
+        study = _create_study()
+        questionnaire = Questionnaire.objects.get(study=study)
+        proband = Proband.objects.create(study=study)
+        small_count = self._count_store_answer_queries(questionnaire, proband)
+
+        for position in range(5, 25):
+            TextQuestion.objects.create(questionnaire=questionnaire, question_text="Text", position=position)
+        self.assertEqual(self._count_store_answer_queries(questionnaire, proband), small_count)
+
+    def test_unknown_question_stores_nothing(self):
+        study = _create_study()
+        questionnaire = Questionnaire.objects.get(study=study)
+        proband = Proband.objects.create(study=study)
+        submission = _create_submission(questionnaire, proband)
+        submission["questionAnswer"].append({"questionType": "TextAnswer", "questionID": "999999", "answer": "?"})
+
+        with self.assertRaises(TextQuestion.DoesNotExist):
+            store_answer(submission)
+        self.assertFalse(QuestionnaireAnswer.objects.exists())
+
+    def test_store_proband_info(self):
+        study = _create_study()
+        proband = Proband.objects.create(study=study)
+        question = TextQuestion.objects.get(proband_info_questionnaire__study=study)
+
+        store_answer({"probandID": str(proband.id), "gender": "female"})
+        store_answer({"probandID": str(proband.id), "questionnaireID": "probandInfoQuestionnaire",
+                      "questionAnswer": [{"questionType": "TextAnswer", "questionID": str(question.id),
+                                          "answer": "Student"}]})
+
+        self.assertEqual(dict(ProbandInfoCell.objects.filter(proband=proband).values_list('key', 'value')),
+                         {"gender": "female", "Info": "Student"})
+
+
+class AnswerCounterTest(TestCase):
+    def test_sharded_counter(self):
+        study = _create_study()
+        for i in range(20):
+            increment_answer_counter(study.id)
+        self.assertEqual(Study.objects.get(id=study.id).answer_updated_times, 0)
+        self.assertEqual(get_answer_count(study.id), 20)
+
+        call_command('flush_answer_counters', stdout=StringIO())
+        self.assertEqual(Study.objects.get(id=study.id).answer_updated_times, 20)
+        self.assertEqual(get_answer_count(study.id), 20)
+        self.assertEqual(flush_answer_counters(), 0)
+
+    def test_answer_queue_flushes_counter(self):
+        study = _create_study()
+        increment_answer_counter(study.id, count=5)
+        spool_dir = tempfile.mkdtemp()
+        try:
+            with self.settings(ANSWER_SPOOL_PATH=os.path.join(spool_dir, 'spool.sqlite3')):
+                call_command('process_answer_queue', once=True, stdout=StringIO())
+        finally:
+            shutil.rmtree(spool_dir)
+        self.assertEqual(Study.objects.get(id=study.id).answer_updated_times, 5)
+
+    @override_settings(ANSWER_COUNTER_SHARDS=1)
+    def test_unsharded_counter(self):
+        study = _create_study()
+        increment_answer_counter(study.id, count=3)
+        self.assertEqual(Study.objects.get(id=study.id).answer_updated_times, 3)
+
+    def test_save_keeps_counter(self):
+        study = _create_study()
+        increment_answer_counter(study.id)
+        flush_answer_counters()
+
+        study.name = "Renamed"  # the instance still holds the old counter
+        study.save()
+        self.assertEqual(Study.objects.get(id=study.id).answer_updated_times, 1)
+
+
+class AnswerBatchTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.settings_override = self.settings(REQUEST_JOURNAL_PATH=os.path.join(self.directory, 'log.txt'),
+                                               ANSWER_SPOOL_PATH=os.path.join(self.directory, 'spool.sqlite3'))
+        self.settings_override.enable()
+
+        self.study = _create_study()
+        self.questionnaire = Questionnaire.objects.get(study=self.study)
+        self.proband = Proband.objects.create(study=self.study)
+
+    def tearDown(self):
+        get_request_journal().flush()
+        self.settings_override.disable()
+        shutil.rmtree(self.directory)
+
+    def test_unknown_ids_are_rejected(self):
+        for key, value in (("probandID", "999999"), ("questionnaireID", "999999")):
+            submission = _create_submission(self.questionnaire, self.proband)
+            submission[key] = value
+            response = self.client.post('/receive_answer/', json.dumps(submission), content_type="application/json")
+            self.assertEqual(response.status_code, 400)
+
+        submission = _create_submission(self.questionnaire, self.proband)
+        submission["questionAnswer"][0]["questionID"] = "999999"
+        response = self.client.post('/receive_answer/', json.dumps(submission), content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(QuestionnaireAnswer.objects.exists())
+
+    def _post_batch(self, submission_list):
+        response = self.client.post('/receive_answers/', json.dumps({"probandID": str(self.proband.id),
+                                                                     "submissions": submission_list}),
+                                    content_type="application/json")
+        return [result['status'] for result in json.loads(response.content.decode())['results']]
+
+    def test_batch(self):
+        submission = _create_submission(self.questionnaire, self.proband)
+        del submission["probandID"]  # given by the batch
+        unknown_question = _create_submission(self.questionnaire, self.proband)
+        unknown_question["questionAnswer"][0]["questionID"] = "999999"
+        other_proband = _create_submission(self.questionnaire, Proband.objects.create(study=self.study))
+        submission_list = [
+            dict(submission, idempotencyKey="first"),
+            dict(submission, idempotencyKey="second"),
+            {"gender": "female"},
+            dict(submission, submitTime=None),
+            unknown_question,
+            other_proband,
+            dict(submission, idempotencyKey="first"),
+        ]
+
+        self.assertEqual(self._post_batch(submission_list),
+                         ['stored', 'stored', 'stored', 'invalid', 'failed', 'invalid', 'duplicate'])
+        self.assertEqual(QuestionnaireAnswer.objects.count(), 2)
+        self.assertEqual(ProbandInfoCell.objects.get(proband=self.proband).value, "female")
+        self.assertEqual(get_answer_count(self.study.id), 3)
+
+        # resending the backlog stores nothing twice
+        self.assertEqual(self._post_batch(submission_list)[:3], ['duplicate', 'duplicate', 'duplicate'])
+        self.assertEqual(QuestionnaireAnswer.objects.count(), 2)
+
+    def test_invalid_idempotency_key(self):
+        submission = _create_submission(self.questionnaire, self.proband)
+        submission_list = [dict(submission, idempotencyKey="first"), dict(submission, idempotencyKey=5),
+                           dict(submission, idempotencyKey="second")]
+        self.assertEqual(self._post_batch(submission_list), ['stored', 'invalid', 'stored'])
+        self.assertEqual(QuestionnaireAnswer.objects.count(), 2)
+
+    def test_invalid_submit_time(self):
+        submission = _create_submission(self.questionnaire, self.proband)
+        submission["submitTime"]["month"] = 13
+        for mode in ('sync', 'queue'):
+            with self.settings(ANSWER_INGEST_MODE=mode):
+                response = self.client.post('/receive_answer/', json.dumps(submission),
+                                            content_type="application/json")
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(self._post_batch([submission]), ['invalid'])
+        self.assertEqual(tuple(get_answer_spool().count()), (0, 0))
+        self.assertFalse(QuestionnaireAnswer.objects.exists())
+
+    def test_queued_batch(self):
+        submission_list = [_create_submission(self.questionnaire, self.proband) for i in range(3)]
+        with self.settings(ANSWER_INGEST_MODE='queue'):
+            self.assertEqual(self._post_batch(submission_list), ['queued', 'queued', 'queued'])
+        self.assertFalse(QuestionnaireAnswer.objects.exists())
+
+        call_command('process_answer_queue', once=True, stdout=StringIO())
+        # identical submissions without a key are one submission
+        self.assertEqual(QuestionnaireAnswer.objects.count(), 1)
+
+    def test_invalid_batch(self):
+        response = self.client.post('/receive_answers/', json.dumps({"submissions": []}),
+                                    content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+
+
+class CompressionTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.directory = tempfile.mkdtemp()
+        self.settings_override = self.settings(REQUEST_JOURNAL_PATH=os.path.join(self.directory, 'log.txt'))
+        self.settings_override.enable()
+
+        self.study = _create_study(questionnaire_count=3)
+
+    def tearDown(self):
+        get_request_journal().flush()
+        self.settings_override.disable()
+        shutil.rmtree(self.directory)
+
+    def test_choose_encoding(self):
+        self.assertEqual(choose_encoding("gzip, deflate")[0], "gzip")
+        self.assertEqual(choose_encoding("*")[0], get_encodings()[0][0])
+        self.assertIsNone(choose_encoding("gzip;q=0, identity"))
+        self.assertIsNone(choose_encoding(""))
+
+    def test_compressed_download(self):
+        plain = self.client.get('/download/%d/' % self.study.id)
+        self.assertFalse(plain.has_header('Content-Encoding'))
+        self.assertIn('Accept-Encoding', plain['Vary'])
+
+        response = self.client.get('/download/%d/' % self.study.id, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertLess(len(response.content), len(plain.content))
+        study = json.loads(gzip.decompress(response.content).decode())['study']
+        self.assertEqual(study['studyName'], "Test study")
+
+        response = self.client.get('/proband_info/%d/' % self.study.id, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))  # too small to be worth it
+
+    def test_compressed_download_not_modified(self):
+        response = self.client.get('/download/%d/' % self.study.id, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        etag = response['ETag']
+        self.assertTrue(etag.startswith('W/'))
+        proband_count = Proband.objects.count()
+
+        for accept_encoding in ('gzip', ''):
+            response = self.client.get('/download/%d/' % self.study.id, HTTP_IF_NONE_MATCH=etag,
+                                       HTTP_ACCEPT_ENCODING=accept_encoding)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response['ETag'], etag)
+        self.assertEqual(Proband.objects.count(), proband_count)
+
+    def test_compressed_submission(self):
+        proband = Proband.objects.create(study=self.study)
+        submission = _create_submission(Questionnaire.objects.filter(study=self.study).first(), proband)
+        body = gzip.compress(json.dumps(submission).encode())
+
+        response = self.client.post('/receive_answer/', body, content_type="application/json",
+                                    HTTP_CONTENT_ENCODING='gzip')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(QuestionnaireAnswer.objects.count(), 1)
+
+        # a retry without compression is the same submission
+        self.client.post('/receive_answer/', json.dumps(submission), content_type="application/json")
+        self.assertEqual(QuestionnaireAnswer.objects.count(), 1)
+
+        for encoding, body in (('gzip', body[:-10]), ('gzip', b'not gzip'), ('compress', body)):
+            response = self.client.post('/receive_answer/', body, content_type="application/json",
+                                        HTTP_CONTENT_ENCODING=encoding)
+            self.assertEqual(response.status_code, 400)
+
+    @override_settings(DATA_UPLOAD_MAX_MEMORY_SIZE=1000)
+    def test_decompressed_size_limit(self):
+        body = gzip.compress(b' ' * 2000)
+        response = self.client.post('/receive_answer/', body, content_type="application/json",
+                                    HTTP_CONTENT_ENCODING='gzip')
+        self.assertEqual(response.status_code, 400)
+
+
+class MetricsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.directory = tempfile.mkdtemp()
+        self.settings_override = self.settings(METRICS_ENABLED=True,
+                                               METRICS_DIR=os.path.join(self.directory, 'metrics'),
+                                               REQUEST_JOURNAL_PATH=os.path.join(self.directory, 'log.txt'))
+        self.settings_override.enable()
+
+        self.study = _create_study()
+
+    def tearDown(self):
+        get_request_journal().flush()
+        self.settings_override.disable()
+        shutil.rmtree(self.directory)
+
+    def _get_metrics(self):
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        return dict(line.rsplit(' ', 1) for line in response.content.decode().splitlines()
+                    if not line.startswith('#'))
+
+    def test_request_metrics(self):
+        self.assertEqual(self.client.get('/download/%d/' % self.study.id).status_code, 200)
+        self.assertEqual(self.client.get('/download/%d/' % (self.study.id + 1)).status_code, 404)
+
+        metrics = self._get_metrics()
+        self.assertEqual(metrics['mind_rate_requests_total{view="download",method="GET",status="200"}'], '1')
+        self.assertEqual(metrics['mind_rate_requests_total{view="download",method="GET",status="404"}'], '1')
+        self.assertEqual(metrics['mind_rate_request_duration_seconds_count{view="download"}'], '2')
+        self.assertEqual(metrics['mind_rate_request_duration_seconds_bucket{view="download",le="+Inf"}'], '2')
+        self.assertGreater(int(metrics['mind_rate_db_queries_total{view="download"}']), 0)
+        self.assertGreater(int(metrics['mind_rate_response_bytes_total{view="download"}']), 0)
+        self.assertEqual(metrics['mind_rate_requests_in_flight'], '1')  # the /metrics request
+
+    def test_streamed_response_bytes(self):
+        response = self.client.get('/log/')
+        content = b''.join(response.streaming_content)
+        metrics = self._get_metrics()
+        self.assertEqual(metrics['mind_rate_response_bytes_total{view="log"}'], str(len(content)))
+
+    def test_exited_workers_are_archived(self):
+        # the counters of an exited worker are kept, its gauges are dropped
+        os.makedirs(settings.METRICS_DIR)
+        with open(os.path.join(settings.METRICS_DIR, '99999999.json'), 'w') as metrics_file:
+            json.dump({'values': [['mind_rate_requests_total', [['view', 'download'], ['method', 'GET'],
+                                                                 ['status', 200]], 5],
+                                  ['mind_rate_requests_in_flight', [], 3]],
+                       'histograms': []}, metrics_file)
+
+        for i in range(2):
+            metrics = self._get_metrics()
+            self.assertEqual(metrics['mind_rate_requests_total{view="download",method="GET",status="200"}'], '5')
+            self.assertEqual(metrics['mind_rate_requests_in_flight'], '1')
+        self.assertFalse(os.path.exists(os.path.join(settings.METRICS_DIR, '99999999.json')))
+
+    def test_disabled(self):
+        with self.settings(METRICS_ENABLED=False):
+            self.assertEqual(self.client.get('/metrics').status_code, 404)
+        self.assertFalse(os.path.exists(settings.METRICS_DIR))
+
+
+class AnswerQueueTest(TestCase):
+    def setUp(self):
+        self.spool_dir = tempfile.mkdtemp()
+        self.spool_path = os.path.join(self.spool_dir, 'spool.sqlite3')
+
+        study = _create_study()
+        self.questionnaire = Questionnaire.objects.get(study=study)
+        self.proband = Proband.objects.create(study=study)
+
+    def tearDown(self):
+        shutil.rmtree(self.spool_dir)
+
+    def test_store_answer_once(self):
+        submission = _create_submission(self.questionnaire, self.proband)
+        self.assertTrue(store_answer_once("key", submission))
+        self.assertFalse(store_answer_once("key", submission))
+        self.assertEqual(QuestionnaireAnswer.objects.count(), 1)
+
+    def test_validate_submission(self):
+        submission = _create_submission(self.questionnaire, self.proband)
+        self.assertEqual(validate_submission(submission), submission)
+
+        del submission["submitTime"]["hour"]
+        with self.assertRaises(ValueError):
+            validate_submission(submission)
+        with self.assertRaises(ValueError):
+            validate_submission({"probandID": "x"})
+
+    def test_process_answer_queue(self):
+        spool = AnswerSpool(self.spool_path, max_attempts=1)
+        body = json.dumps(_create_submission(self.questionnaire, self.proband))
+        self.assertTrue(spool.append(get_idempotency_key(body=body.encode()), body))
+        self.assertFalse(spool.append(get_idempotency_key(body=body.encode()), body))  # retry while waiting
+        spool.append("broken", json.dumps({"probandID": "999999"}))
+
+        with self.settings(ANSWER_SPOOL_PATH=self.spool_path, ANSWER_SPOOL_MAX_ATTEMPTS=1):
+            call_command('process_answer_queue', once=True, stdout=StringIO())
+
+        self.assertEqual(QuestionnaireAnswer.objects.count(), 1)
+        self.assertEqual(tuple(spool.count()), (0, 1))
+
+        # a retry after the answer has been stored
+        spool.append(get_idempotency_key(body=body.encode()), body)
+        with self.settings(ANSWER_SPOOL_PATH=self.spool_path):
+            call_command('process_answer_queue', once=True, stdout=StringIO())
+        self.assertEqual(QuestionnaireAnswer.objects.count(), 1)
+
+
+class RequestJournalTest(TestCase):
+    def setUp(self):
+        self.journal_dir = tempfile.mkdtemp()
+        self.journal_path = os.path.join(self.journal_dir, 'log.txt')
+
+    def tearDown(self):
+        shutil.rmtree(self.journal_dir)
+
+    def test_buffer_and_rotation(self):
+        journal = RequestJournal(self.journal_path, max_bytes=100, backup_count=2, buffer_bytes=30,
+                                 flush_interval=60)
+        journal.write("a" * 20)
+        self.assertEqual(journal.size(), 0)
+        journal.write("b" * 20)
+        self.assertEqual(journal.size(), 40)
+
+        for i in range(10):
+            journal.write("c" * 60)
+        journal.flush()
+        self.assertTrue(os.path.exists(self.journal_path + '.1.gz'))
+        self.assertTrue(os.path.exists(self.journal_path + '.2.gz'))
+        self.assertFalse(os.path.exists(self.journal_path + '.3.gz'))
+        with gzip.open(self.journal_path + '.1.gz') as rotated_file:
+            self.assertEqual(rotated_file.read(), b"c" * 120)
+
+    def test_threaded_writes(self):
+        # the threads of a gthread worker share one journal
+        journal = RequestJournal(self.journal_path, buffer_bytes=100, flush_interval=60)
+
+        def write_entries(name):
+            for i in range(200):
+                journal.write("%s %d\n" % (name, i))
+
+        thread_list = [threading.Thread(target=write_entries, args=(name,)) for name in "abcd"]
+        for thread in thread_list:
+            thread.start()
+        for thread in thread_list:
+            thread.join()
+        journal.flush()
+
+        with open(self.journal_path) as journal_file:
+            line_list = journal_file.read().splitlines()
+        self.assertEqual(sorted(line_list), sorted("%s %d" % (name, i) for name in "abcd" for i in range(200)))
+
+    def test_receive_answer_and_view_log(self):
+        study = _create_study()
+        proband = Proband.objects.create(study=study)
+        submission = json.dumps({"probandID": str(proband.id), "gender": "male"})
+
+        with self.settings(REQUEST_JOURNAL_PATH=self.journal_path,
+                           REQUEST_JOURNAL_OPTIONS={'buffer_bytes': 0}):
+            response = self.client.post('/receive_answer/', submission, content_type="application/json")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(ProbandInfoCell.objects.get(proband=proband).value, "male")
+
+            response = self.client.get('/log/')
+            log = b''.join(response.streaming_content)
+            self.assertIn(submission.encode(), log)
+            self.assertEqual(int(response['X-Log-Size']), len(log))
+
+            response = self.client.get('/log/', {'tail': 10})
+            self.assertEqual(b''.join(response.streaming_content), log[-10:])
+            response = self.client.get('/log/', {'offset': 2, 'length': 5})
+            self.assertEqual(b''.join(response.streaming_content), log[2:7])
+
+
+class ExportTest(TestCase):
+    def setUp(self):
+        User.objects.create_superuser('admin', 'admin@example.org', 'password')
+        self.client.login(username='admin', password='password')
+
+    def _export(self, action, study):
+        response = self.client.post('/admin/survey/study/', {'action': action, '_selected_action': [study.id]})
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def test_export_study_answer(self):
+        study = _create_study(questionnaire_count=2)
+        proband = Proband.objects.create(study=study)
+        for questionnaire in Questionnaire.objects.filter(study=study):
+            store_answer(_create_submission(questionnaire, proband))
+
+        rows = list(csv.reader(self._export('export_study_answer', study).splitlines()))
+        self.assertEqual(rows[0][:2], ['Study ID', 'Questionnaire ID'])
+        self.assertEqual(len(rows), 1 + 2 * 4 + 1)
+        self.assertEqual(rows[1][2:5], ['Text', 'Fine', str(proband.id)])
+        self.assertIn(rows[1][6], ("light: 120.5 / temperature: 21.0", "temperature: 21.0 / light: 120.5"))
+        self.assertEqual(rows[-1], [''])
+
+    def test_export_study_answer_without_question_text(self):
+        study = _create_study(questionnaire_count=2)
+        proband = Proband.objects.create(study=study)
+        for questionnaire in Questionnaire.objects.filter(study=study):
+            store_answer(_create_submission(questionnaire, proband))
+        TextQuestion.objects.filter(questionnaire__study=study).update(question_text=None)
+
+        # the export goes on after answers without a question text
+        rows = list(csv.reader(self._export('export_study_answer', study).splitlines()))
+        self.assertEqual(len(rows), 1 + 2 * 4 + 1)
+        self.assertEqual(rows[1][2:4], ['', 'Fine'])
+
+    def test_export_study_answer_query_count_is_flat(self):
+        study = _create_study()
+        questionnaire = Questionnaire.objects.get(study=study)
+        proband = Proband.objects.create(study=study)
+
+        def count_queries():
+            with CaptureQueriesContext(connection) as context:
+                list(csv_chunks(study_answer_rows(Study.objects.filter(id=study.id))))
+            return len(context.captured_queries)
+
+        store_answer(_create_submission(questionnaire, proband))
+        small_count = count_queries()
+        for i in range(20):
+            store_answer(_create_submission(questionnaire, proband))
+        self.assertEqual(count_queries(), small_count)
+
+    def test_export_proband_info(self):
+        study = _create_study()
+        first_proband = Proband.objects.create(study=study)
+        second_proband = Proband.objects.create(study=study)
+        Proband.objects.create(study=study)  # without info
+        store_answer({"probandID": str(first_proband.id), "gender": "female", "birthday": "1990-01-01"})
+        store_answer({"probandID": str(first_proband.id), "gender": "diverse"})
+        store_answer({"probandID": str(second_proband.id), "occupation": "student"})
+
+        rows = list(csv.reader(self._export('export_proband_info', study).splitlines()))
+        self.assertEqual(rows, [
+            ['Study ID', 'Proband ID', 'birthday', 'gender', 'occupation'],
+            [str(study.id), str(first_proband.id), '1990-01-01', 'diverse', ' '],
+            [str(study.id), str(second_proband.id), ' ', ' ', 'student'],
+            [''],
+        ])
+
+    def test_export_proband_info_in_chunks(self):
+        study = _create_study()
+        proband_list = [Proband.objects.create(study=study) for i in range(3)]
+        for proband in proband_list:
+            store_answer({"probandID": str(proband.id), "gender": "female", "occupation": "student"})
+        store_answer({"probandID": str(proband_list[0].id), "gender": "diverse"})
+
+        rows = list(proband_info_rows(Study.objects.filter(id=study.id)))
+        # the cells of a proband are split over chunks
+        with mock.patch.object(exports, 'PROBAND_INFO_CHUNK_SIZE', 2):
+            self.assertEqual(list(proband_info_rows(Study.objects.filter(id=study.id))), rows)
+        self.assertEqual(rows[1][1:], [proband_list[0].id, 'diverse', 'student'])
+        self.assertEqual(len(rows), 1 + 3 + 1)
+
+    def test_export_proband_info_query_count_is_flat(self):
+        study = _create_study()
+
+        def count_queries():
+            with CaptureQueriesContext(connection) as context:
+                list(csv_chunks(proband_info_rows(Study.objects.filter(id=study.id))))
+            return len(context.captured_queries)
+
+        small_count = count_queries()
+        for i in range(20):
+            proband = Proband.objects.create(study=study)
+            store_answer({"probandID": str(proband.id), "gender": "female", "occupation": "student"})
+        self.assertEqual(count_queries(), small_count)
+
+
+class ExportJobTest(TestCase):
+    def setUp(self):
+        self.export_dir = tempfile.mkdtemp()
+        self.settings_override = self.settings(EXPORT_ROOT=self.export_dir, EXPORT_ACCEL_REDIRECT_URL=None)
+        self.settings_override.enable()
+
+        User.objects.create_superuser('admin', 'admin@example.org', 'password')
+        self.client.login(username='admin', password='password')
+
+        self.study = _create_study()
+        self.proband = Proband.objects.create(study=self.study)
+        store_answer(_create_submission(Questionnaire.objects.get(study=self.study), self.proband))
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.export_dir)
+
+    def test_background_export(self):
+        response = self.client.post('/admin/survey/study/', {'action': 'export_study_answer_in_background',
+                                                             '_selected_action': [self.study.id]})
+        self.assertEqual(response.status_code, 302)
+        job = ExportJob.objects.get(study=self.study)
+        self.assertEqual(job.status, ExportJob.PENDING)
+
+        call_command('process_export_jobs', once=True, stdout=StringIO())
+        job = ExportJob.objects.get(id=job.id)
+        self.assertEqual(job.status, ExportJob.DONE)
+        self.assertEqual(job.progress, 1 + 4 + 1)
+
+        response = self.client.get('/exports/%d/' % job.id)
+        with gzip.GzipFile(fileobj=io.BytesIO(b''.join(response.streaming_content))) as export_file:
+            rows = list(csv.reader(export_file.read().decode().splitlines()))
+        self.assertEqual(rows[1][2:4], ['Text', 'Fine'])
+
+    def test_unchanged_study_reuses_export(self):
+        job = request_export(self.study.id, ExportJob.PROBAND_INFO, ExportJob.CSV)
+        self.assertEqual(request_export(self.study.id, ExportJob.PROBAND_INFO, ExportJob.CSV), job)
+        call_command('process_export_jobs', once=True, stdout=StringIO())
+        job = ExportJob.objects.get(id=job.id)
+        self.assertEqual(request_export(self.study.id, ExportJob.PROBAND_INFO, ExportJob.CSV), job)
+
+        # a new answer makes the old export outdated
+        store_answer({"probandID": str(self.proband.id), "gender": "male"})
+        new_job = request_export(self.study.id, ExportJob.PROBAND_INFO, ExportJob.CSV)
+        self.assertNotEqual(new_job, job)
+
+        call_command('process_export_jobs', once=True, stdout=StringIO())
+        self.assertFalse(ExportJob.objects.filter(id=job.id).exists())
+        self.assertFalse(os.path.exists(get_export_path(job)))
+        with open(get_export_path(ExportJob.objects.get(id=new_job.id))) as export_file:
+            self.assertIn("male", export_file.read())
+
+
+class TriggerScheduleTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.tz = timezone.get_default_timezone()
+        # 3 days, starting in the afternoon
+        self.start = timezone.make_aware(datetime.datetime(2017, 6, 1, 12, 0), self.tz)
+        self.study = Study.objects.create(name="Schedule", start_date_time=self.start,
+                                          end_date_time=self.start + datetime.timedelta(days=3))
+        self.daily = Questionnaire.objects.create(study=self.study, name="Daily",
+                                                  due_after=datetime.timedelta(hours=24))
+        TriggerEvent.objects.create(questionnaire=self.daily, time=datetime.time(9, 30),
+                                    min_time_space=datetime.timedelta(minutes=10))
+        self.evening = Questionnaire.objects.create(study=self.study, name="Evening",
+                                                    due_after=datetime.timedelta(hours=24))
+        TriggerEvent.objects.create(questionnaire=self.evening, time=datetime.time(20, 0),
+                                    datetime=self.start + datetime.timedelta(hours=1),
+                                    min_time_space=datetime.timedelta(minutes=10))
+        sensor = Questionnaire.objects.create(study=self.study, name="Sensor", due_after=datetime.timedelta(hours=24))
+        TriggerEvent.objects.create(questionnaire=sensor, light="M", min_time_space=datetime.timedelta(minutes=10))
+        self.study.refresh_from_db()
+
+    def _local(self, day, hour, minute=0):
+        return timezone.make_aware(datetime.datetime(2017, 6, day, hour, minute), self.tz)
+
+    def test_schedule(self):
+        time_list, questionnaire_id_list = get_schedule(self.study)
+        self.assertEqual(list(zip(time_list, questionnaire_id_list)), [
+            (int(self._local(1, 13).timestamp()), self.evening.id),
+            (int(self._local(1, 20).timestamp()), self.evening.id),
+            (int(self._local(2, 9, 30).timestamp()), self.daily.id),
+            (int(self._local(2, 20).timestamp()), self.evening.id),
+            (int(self._local(3, 9, 30).timestamp()), self.daily.id),
+            (int(self._local(3, 20).timestamp()), self.evening.id),
+            (int(self._local(4, 9, 30).timestamp()), self.daily.id),
+        ])
+        self.assertEqual(get_triggers((time_list, questionnaire_id_list), self._local(2, 9, 30), self._local(3, 0)),
+                         [(time_list[2], self.daily.id), (time_list[3], self.evening.id)])
+
+    def test_min_time_space_and_max_triggers_per_day(self):
+        trigger_event = TriggerEvent(time=datetime.time(13, 30), datetime=self._local(1, 13, 0),
+                                     min_time_space=datetime.timedelta(hours=1))
+        end = self._local(3, 0)
+        self.assertEqual(expand_trigger_times(self.daily, trigger_event, self.start, end),
+                         [self._local(1, 13), self._local(2, 13, 30)])
+
+        self.daily.max_trigger_times_per_day = 1
+        trigger_event.min_time_space = datetime.timedelta(0)
+        self.assertEqual(expand_trigger_times(self.daily, trigger_event, self.start, end),
+                         [self._local(1, 13), self._local(2, 13, 30)])
+
+    def test_cached_per_revision(self):
+        get_schedule(self.study)
+        with self.assertNumQueries(0):
+            get_schedule(self.study)
+
+        TriggerEvent.objects.filter(questionnaire=self.daily).delete()
+        TriggerEvent.objects.create(questionnaire=self.daily, time=datetime.time(7, 0),
+                                    min_time_space=datetime.timedelta(minutes=10))
+        self.study.refresh_from_db()
+        self.assertEqual(len(get_schedule(self.study)[0]), 7)
+        self.assertIn(int(self._local(2, 7).timestamp()), get_schedule(self.study)[0])
+
+    def test_schedule_endpoint(self):
+        response = self.client.get('/schedule/%d/?from=%d&hours=24' % (self.study.id,
+                                                                       self._local(2, 0).timestamp()))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content.decode('utf-8')), {
+            "studyId": str(self.study.id),
+            "triggers": [{"time": int(self._local(2, 9, 30).timestamp()), "questionnaireIDs": [str(self.daily.id)]},
+                         {"time": int(self._local(2, 20).timestamp()), "questionnaireIDs": [str(self.evening.id)]}],
+        })
+        self.assertEqual(self.client.get('/schedule/%d/?hours=1000' % self.study.id).status_code, 400)
+        self.assertEqual(self.client.get('/schedule/%d/?from=x' % self.study.id).status_code, 400)
+
+    def test_forecast(self):
+        Proband.objects.bulk_create([Proband(study=self.study) for i in range(3)])
+        self.assertEqual(forecast_submissions(self._local(1, 0), self._local(2, 12), bucket_seconds=3600), [
+            (int(self._local(1, 13).timestamp()), 3),
+            (int(self._local(1, 20).timestamp()), 3),
+            (int(self._local(2, 9).timestamp()), 3),
+        ])
+
+        self.study.end_date_time = timezone.now() + datetime.timedelta(days=2)
+        self.study.save()
+        out = StringIO()
+        call_command('forecast_submissions', '--hours', '48', '--bucket', '3600', stdout=out)
+        self.assertIn("  3 submissions", out.getvalue())
+
+
+class BenchmarkGeneratorTest(TestCase):
+    def test_generated_study(self):
+        study = create_study(StudySpec(questionnaire_count=2, questions_per_type=3, option_count=2, chain_length=2))
+        proband_id_list = create_probands(study, 3)
+        create_answers(study, proband_id_list, 5)
+
+        question_dict = get_questions(study)
+        self.assertEqual([len(question_list) for question_list in question_dict.values()], [12, 12])
+        chain_option = ChoiceOption.objects.get(single_choice_question__position=1,
+                                                single_choice_question__questionnaire_id=min(question_dict),
+                                                next_question_position__isnull=False)
+        self.assertEqual(chain_option.next_question_position, 2)
+        self.assertFalse(SingleChoiceQuestion.objects.get(questionnaire_id=min(question_dict), position=2)
+                         .show_by_default)
+
+        self.assertEqual(get_answer_count(study.id), 5)
+        rows = list(study_answer_rows(Study.objects.filter(id=study.id)))
+        self.assertEqual(len(rows), 1 + 5 * 12 + 1)
+        self.assertTrue(all(row[6].startswith('light: ') for row in rows[1:-1]))
+        self.assertEqual(len(list(proband_info_rows(Study.objects.filter(id=study.id)))), 1 + 3 + 1)
+
+
+ANSWER_TABLES = ('survey_questionnaireanswer', 'survey_sensorvaluecell', 'survey_probandinfocell',
+                 'survey_questionanswer')
+
+
+@skipUnless(connection.vendor == 'sqlite', "query plans are read with SQLite's EXPLAIN QUERY PLAN")
+class QueryPlanTest(TestCase):
+    def setUp(self):
+        self.study = _create_study()
+        self.questionnaire = Questionnaire.objects.get(study=self.study)
+        for i in range(3):
+            proband = Proband.objects.create(study=self.study)
+            store_answer({"probandID": str(proband.id), "gender": "female", "age": "30"})
+            store_answer(_create_submission(self.questionnaire, proband))
+
+    def _explain(self, sql, params=()):
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def _get_full_scans(self, queries):
+        # the answer tables that a query reads without an index
+        full_scans = []
+        for query in queries:
+            if not query['sql'].startswith('SELECT'):
+                continue
+            for detail in self._explain(query['sql']):
+                if detail.startswith('SCAN') and 'INDEX' not in detail and \
+                        any(table in detail.split() for table in ANSWER_TABLES):
+                    full_scans.append((query['sql'], detail))
+        return full_scans
+
+    def test_exports_use_indexes(self):
+        study_queryset = Study.objects.filter(id=self.study.id)
+        with CaptureQueriesContext(connection) as context:
+            list(study_answer_rows(study_queryset))
+            list(proband_info_rows(study_queryset))
+            store_answer(_create_submission(self.questionnaire, Proband.objects.filter(study=self.study).first()))
+        self.assertEqual(self._get_full_scans(context.captured_queries), [])
+
+    def test_lookups_use_composite_indexes(self):
+        queryset = QuestionnaireAnswer.objects.filter(
+            questionnaire=self.questionnaire, submit_time__gte=timezone.now() - datetime.timedelta(days=1)) \
+            .order_by('submit_time')
+        self.assertIn('submit_time>?', ' '.join(self._explain(*queryset.query.sql_with_params())))
+
+        queryset = ProbandInfoCell.objects.filter(proband__study=self.study, key="gender").order_by('-id')
+        self.assertIn('key=?', ' '.join(self._explain(*queryset.query.sql_with_params())))
+
+
+@skipUnless(connection.vendor == 'sqlite', "SQLite pragmas")
+class SQLitePragmaTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _connect(self, name, pragmas):
+        connection = sqlite3.connect(os.path.join(self.directory, name), timeout=0, isolation_level=None)
+        apply_sqlite_pragmas(connection, pragmas)
+        return connection
+
+    def test_pragmas_of_new_connections(self):
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA busy_timeout")
+            self.assertEqual(cursor.fetchone()[0], settings.SQLITE_PRAGMAS['busy_timeout'])
+            cursor.execute("PRAGMA cache_size")
+            self.assertEqual(cursor.fetchone()[0], settings.SQLITE_PRAGMAS['cache_size'])
+
+    def _write_during_read(self, name, pragmas):
+        # returns whether a write can commit while another connection reads
+        writer = self._connect(name, pragmas)
+        writer.execute("CREATE TABLE answer (value TEXT)")
+        writer.execute("INSERT INTO answer VALUES ('first')")
+
+        reader = self._connect(name, pragmas)
+        reader.execute("BEGIN")
+        reader.execute("SELECT * FROM answer").fetchall()
+        try:
+            writer.execute("INSERT INTO answer VALUES ('second')")
+            return True
+        except sqlite3.OperationalError:  # database is locked
+            return False
+        finally:
+            reader.execute("COMMIT")
+            reader.close()
+            writer.close()
+
+    def test_wal_lets_writes_pass_readers(self):
+        self.assertFalse(self._write_during_read('default.sqlite3', {}))
+        self.assertTrue(self._write_during_read('tuned.sqlite3', dict(settings.SQLITE_PRAGMAS, busy_timeout=0)))
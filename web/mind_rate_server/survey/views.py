@@ -1,14 +1,33 @@
-from .models import Questionnaire, Study, Proband, TextQuestion, SingleChoiceQuestion, MultiChoiceQuestion,\
-    DragScaleQuestion, TriggerEvent, ChoiceOption, ProbandInfoQuestionnaire, ProbandInfoCell, QuestionnaireAnswer, \
-    SensorValueCell, TextQuestionAnswer, SingleChoiceQuestionAnswer, MultiChoiceQuestionAnswer, DragScaleQuestionAnswer
+from .models import Study, Proband, ExportJob
+from .changes import get_study_changes_json
+from .compression import compress_response, get_request_body
+from .export_jobs import CONTENT_TYPES, get_export_path
+from .ingest import validate_submission, validate_submission_batch, get_idempotency_key, store_answer_once, \
+    store_answers_once
+from .journal import get_request_journal
+from .schedule import get_schedule, get_triggers
+from .metrics import format_metrics, get_metrics_store
+from .spool import get_answer_spool
+from .serializers import encode, encode_study, serialize_proband_info_questionnaire, splice_proband_id, \
+    splice_proband_ids
+from .study_graph import get_study, load_study_graph
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
 from django.shortcuts import get_object_or_404, redirect
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User, Permission
 from django.contrib.contenttypes.models import ContentType
-from django.http import HttpResponse
+from django.http import HttpResponse, HttpResponseBadRequest, StreamingHttpResponse, FileResponse, Http404
+from django.utils import timezone
+from django.utils.http import quote_etag
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition
 import json
 import datetime
+import time
 
 
 # give user permissions and redirect user to the admin site
@@ -30,436 +49,241 @@ def home(request):
     return redirect('/admin/')
 
 
-def _get_question_list_from_questionnaire(questionnaire):
-    question_list = []
-
-    question_list.extend(TextQuestion.objects.filter(questionnaire=questionnaire))
-    question_list.extend(DragScaleQuestion.objects.filter(questionnaire=questionnaire))
-    question_list.extend(SingleChoiceQuestion.objects.filter(questionnaire=questionnaire))
-    question_list.extend(MultiChoiceQuestion.objects.filter(questionnaire=questionnaire))
-
-    question_list.sort(key=lambda question: question.position)
-    return question_list
-
-
-def _get_question_list_from_proband_info_questionnaire(proband_info_questionnaire):
-    question_list = []
-
-    question_list.extend(TextQuestion.objects.filter(proband_info_questionnaire=proband_info_questionnaire))
-    question_list.extend(DragScaleQuestion.objects.filter(proband_info_questionnaire=proband_info_questionnaire))
-    question_list.extend(SingleChoiceQuestion.objects.filter(proband_info_questionnaire=proband_info_questionnaire))
-    question_list.extend(MultiChoiceQuestion.objects.filter(proband_info_questionnaire=proband_info_questionnaire))
-
-    question_list.sort(key=lambda question: question.position)
-    return question_list
-
-
-def _get_question_list_json(question_list):
-    if len(question_list) == 0:
-        return "\"questions\": []"
-
-    json_data = "\"questions\": ["
-
-    for question in question_list:
-        option_list = []
-
-        if isinstance(question, SingleChoiceQuestion):
-            option_list.extend(ChoiceOption.objects.filter(single_choice_question=question))
-        if isinstance(question, MultiChoiceQuestion):
-            option_list.extend(ChoiceOption.objects.filter(multi_choice_question=question))
-        if isinstance(question, TextQuestion):
-            option_list.extend(ChoiceOption.objects.filter(text_question=question))
-        if isinstance(question, DragScaleQuestion):
-            option_list.extend(ChoiceOption.objects.filter(drag_scale_question=question))
-
-        if len(option_list) != 0:  # the question must be a choice question
-            if isinstance(question, MultiChoiceQuestion):
-                question_type = "MultipleChoice"
-            else:
-                question_type = "SingleChoice"
-        else:  # the question is not a choice question
-            if isinstance(question, TextQuestion):
-                question_type = "TextAnswer"
-            else:
-                question_type = "DragScale"
-
-        if question.show_by_default:
-            show_by_default = "true"
-        else:
-            show_by_default = "false"
-
-        json_data += "{" \
-                     "\"questionID\": \"%d\"," \
-                     "\"questionContent\": \"%s\"," \
-                     "\"showByDefault\": %s," \
-                     % (question.id, question.question_text, show_by_default)
-
-        # display question type specific data
-        json_data += "\"questionType\": {" \
-                     "\"typeName\": \"%s\"" % question_type
-
-        # display options for choice question
-        if question_type == "MultipleChoice" or question_type == "SingleChoice":
-            json_data += ", \"options\": ["
-            for option in option_list:
-
-                # get next question id from next question position
-                next_question_id = ""
-                for q in question_list:
-                    if q.position == option.next_question_position:
-                        next_question_id = q.id
-                        break
-
-                json_data += "{\"optionContent\": \"%s\", \"nextQuestionID\": \"%s\"}," \
-                             % (option.choice_text, next_question_id)
-
-            json_data = json_data[:-1]  # remove the trailing comma
-            json_data += "]"  # end of all options
-
-        # display drag interval for drag scale question
-        elif question_type == "DragScale":
-            json_data += ", \"maxValue\""": %d" % question.max_value
-
-        json_data += "}"  # end of question type
-        json_data += "},"  # end of a question
-
-    json_data = json_data[:-1]  # remove the trailing comma
-    json_data += "]"   # end of all questions
-    return json_data
-
-
 # the 3 standard proband info questions showed during proband registration
+@compress_response
 def download_proband_info_questionnaire(request, study_id):
-    study = get_object_or_404(Study, id=study_id)
-    proband_info_questionnaire = ProbandInfoQuestionnaire.objects.get(study=study)
+    study = get_study(study_id)
+    json_data = encode(serialize_proband_info_questionnaire(study.probandinfoquestionnaire))
+    return HttpResponse(json_data, content_type="application/json")
 
-    if proband_info_questionnaire.ask_for_birthday:
-        birthday = "true"
-    else:
-        birthday = "false"
 
-    if proband_info_questionnaire.ask_for_gender:
-        gender = "true"
-    else:
-        gender = "false"
+def _get_study_etag(study_id, revision):
+    return "study-%s-%d" % (study_id, revision)
 
-    if proband_info_questionnaire.ask_for_occupation:
-        occupation = "true"
-    else:
-        occupation = "false"
 
-    json_data = "{" \
-                "\"birthday\": %s," \
-                "\"gender\": %s," \
-                "\"occupation\": %s" \
-                "}" % (birthday, gender, occupation)
-    return HttpResponse(json_data, content_type="application/json")
+def _get_study_etag_for_request(request, study_id):
+    revision = Study.objects.filter(id=study_id).values_list('revision', flat=True).first()
+    if revision is None:
+        return None
+    return _get_study_etag(study_id, revision)
+
 
+def _get_study_json(study):
+    # the study json is rendered once per study revision and shared by all probands
+    cache_key = "study_json:%d:%d" % (study.id, study.revision)
+    study_json = cache.get(cache_key)
+    if study_json is None:
+        study_json = encode_study(load_study_graph(study))
+        cache.set(cache_key, study_json, settings.STUDY_JSON_CACHE_TIMEOUT)
+    return study_json
 
-# For app to download studies
+
+# For app to download studies;
+# the app can revalidate its copy with If-None-Match without a new proband being created
+@compress_response
+@condition(etag_func=_get_study_etag_for_request)
 def download(request, study_id):
-    study = get_object_or_404(Study, id=study_id)
+    study = get_study(study_id)
+    study_json = _get_study_json(study)
+
     proband = Proband.objects.create(study=study)
-    proband_info_questionnaire = ProbandInfoQuestionnaire.objects.get(study=study)
-    questionnaire_list = Questionnaire.objects.filter(study=study)
-
-    start_time = study.start_date_time
-    end_time = study.end_date_time
-
-    # study basic info
-    json_data = "{" \
-                "\"study\": {" \
-                "\"probandID\": \"%d\"," \
-                "\"studyId\": \"%d\"," \
-                "\"studyName\": \"%s\"," \
-                "\"beginningDate\": {" \
-                "\"year\": %d," \
-                "\"month\": %d," \
-                "\"day\": %d," \
-                "\"hour\": %d," \
-                "\"minute\": %d," \
-                "\"second\": %d" \
-                "}," \
-                "\"endDate\": {" \
-                "\"year\": %d," \
-                "\"month\": %d," \
-                "\"day\": %d," \
-                "\"hour\": %d," \
-                "\"minute\": %d," \
-                "\"second\": %d" \
-                "}," \
-                % (proband.id, study.id, study.name, start_time.year, start_time.month, start_time.day,
-                   start_time.hour, start_time.minute, start_time.second, study.end_date_time.year, end_time.month,
-                   end_time.day, end_time.hour, end_time.minute, end_time.second)
-
-    # proband info questionnaire
-    json_data += "\"probandInfoQuestionnaire\": {"
-    json_data += _get_question_list_json(
-        _get_question_list_from_proband_info_questionnaire(proband_info_questionnaire)
-    )
-    json_data += "},"
-
-    # normal questionnaires
-    json_data += "\"questionnaires\": ["
-    for questionnaire in questionnaire_list:
-        trigger_event = TriggerEvent.objects.get(questionnaire=questionnaire)
-        if questionnaire.due_after is None:
-            duration = 999999999  # default unlimited duration time
-        else:
-            duration = questionnaire.due_after.total_seconds()
-
-        # basic info of a questionnaire
-        json_data += "{" \
-                     "\"questionnaireID\": \"%d\"," \
-                     "\"questionnaireName\": \"%s\"," \
-                     "\"maxShowUpTimesPerDay\": %d," \
-                     "\"duration\": {" \
-                     "\"second\": %d" \
-                     "}," \
-                     % (questionnaire.id, questionnaire.name, questionnaire.max_trigger_times_per_day, duration)
-
-        if trigger_event.datetime is None:
-            date_time = "null"
-        else:
-            date_time = "{" \
-                       "\"year\": %d," \
-                       "\"month\": %d," \
-                       "\"day\": %d," \
-                       "\"hour\": %d," \
-                       "\"minute\": %d," \
-                       "\"second\": %d" \
-                       "}" \
-                       % (trigger_event.datetime.year, trigger_event.datetime.month, trigger_event.datetime.day,
-                          trigger_event.datetime.hour, trigger_event.datetime.minute, trigger_event.datetime.second)
-        if trigger_event.time is None:
-            time = "null"
-        else:
-            time = "\"%d-%d-%d\"" % (trigger_event.time.hour, trigger_event.time.minute, trigger_event.time.second)
-
-        # trigger event of questionnaire
-        json_data += "\"triggerEvent\": {" \
-                     "\"minTimeSpace\": %d," \
-                     "\"datetime\": %s," \
-                     "\"time\": %s," % (trigger_event.min_time_space.total_seconds(), date_time, time)
-
-        if trigger_event.light is not None:
-            if trigger_event.light == "VL":
-                min_light = 0
-                max_light = 4
-            elif trigger_event.light == "L":
-                min_light = 0
-                max_light = 50
-            elif trigger_event.light == "M":
-                min_light = 50
-                max_light = 400
-            elif trigger_event.light == "H":
-                min_light = 400
-                max_light = 40000
-            elif trigger_event.light == "VH":
-                min_light = 1000
-                max_light = 40000
-            else:
-                min_light = 0
-                max_light = 40000
-            json_data += "\"light\": true," \
-                         "\"lightMinValue\": %d," \
-                         "\"lightMaxValue\": %d," % (min_light, max_light)
-        else:
-            json_data += "\"light\": false,"
-
-        if trigger_event.relative_humidity is not None:
-            if trigger_event.relative_humidity == "VL":
-                min_humidity = 0
-                max_humidity = 20
-            elif trigger_event.relative_humidity == "L":
-                min_humidity = 0
-                max_humidity = 40
-            elif trigger_event.relative_humidity == "M":
-                min_humidity = 30
-                max_humidity = 70
-            elif trigger_event.relative_humidity == "H":
-                min_humidity = 60
-                max_humidity = 100
-            elif trigger_event.relative_humidity == "VH":
-                min_humidity = 80
-                max_humidity = 100
-            else:
-                min_humidity = 0
-                max_humidity = 100
-            json_data += "\"relativeHumidity\": true," \
-                         "\"relativeHumidityMinValue\": %d," \
-                         "\"relativeHumidityMaxValue\": %d," % (min_humidity, max_humidity)
+    response = HttpResponse(splice_proband_id(study_json, proband.id), content_type="application/json")
+    response['ETag'] = quote_etag(_get_study_etag(study.id, study.revision))
+    response['X-Study-Revision'] = study.revision  # for fetching the changes later, see download_changes
+    return response
+
+
+def _create_probands(study, count):
+    # returns the IDs of count new probands of the study, inserted at once
+    with transaction.atomic():
+        proband_list = Proband.objects.bulk_create([Proband(study=study) for i in range(count)])
+        if proband_list[0].id is not None:  # PostgreSQL returns the IDs of inserted rows
+            return [proband.id for proband in proband_list]
+        # SQLite doesn't; no other proband can be inserted before the transaction ends
+        return sorted(Proband.objects.filter(study=study).order_by('-id').values_list('id', flat=True)[:count])
+
+
+# For provisioning a batch of phones: the study once, with the IDs of count new probands;
+# each phone gets the study with one of the IDs as probandID
+@compress_response
+def bulk_download(request, study_id):
+    try:
+        count = int(request.GET.get('count', ''))
+    except ValueError:
+        return HttpResponseBadRequest("count is not an integer", content_type="text/plain")
+    if not 0 < count <= settings.BULK_DOWNLOAD_MAX_PROBANDS:
+        return HttpResponseBadRequest("count must be between 1 and %d" % settings.BULK_DOWNLOAD_MAX_PROBANDS,
+                                      content_type="text/plain")
+
+    study = get_study(study_id)
+    study_json = _get_study_json(study)
+    response = HttpResponse(splice_proband_ids(study_json, _create_probands(study, count)),
+                            content_type="application/json")
+    response['X-Study-Revision'] = study.revision
+    return response
+
+
+# For app to update its copy of a study without downloading it again, /download/<study_id>/changes/?since=<revision>
+# with the revision of its copy; the response has the changed and deleted questionnaires, see changes.py
+@compress_response
+def download_changes(request, study_id):
+    try:
+        since = int(request.GET.get('since', ''))
+    except ValueError:
+        return HttpResponseBadRequest("since is not an integer", content_type="text/plain")
+
+    study = get_study(study_id)
+    return HttpResponse(get_study_changes_json(study, since), content_type="application/json")
+
+
+# For app to fetch the time-based triggers of the next hours, /schedule/<study_id>/?from=<timestamp>&hours=<hours>;
+# from defaults to now
+@compress_response
+def schedule(request, study_id):
+    try:
+        start = datetime.datetime.fromtimestamp(float(request.GET.get('from', time.time())), timezone.utc)
+        hours = float(request.GET.get('hours', settings.SCHEDULE_DEFAULT_HOURS))
+    except (ValueError, OverflowError, OSError):  # not a number or not a representable time
+        return HttpResponseBadRequest("from and hours must be numbers", content_type="text/plain")
+    if not 0 < hours <= settings.SCHEDULE_MAX_HOURS:
+        return HttpResponseBadRequest("hours must be between 0 and %d" % settings.SCHEDULE_MAX_HOURS,
+                                      content_type="text/plain")
+
+    study = get_study(study_id)
+    trigger_list = []
+    for trigger_time, questionnaire_id in get_triggers(get_schedule(study), start,
+                                                       start + datetime.timedelta(hours=hours)):
+        if trigger_list and trigger_list[-1]["time"] == trigger_time:
+            trigger_list[-1]["questionnaireIDs"].append(str(questionnaire_id))
         else:
-            json_data += "\"relativeHumidity\": false,"
-
-        if trigger_event.temperature is not None:
-            if trigger_event.temperature == "VL":
-                min_temperature = -50
-                max_temperature = -10
-            elif trigger_event.temperature == "L":
-                min_temperature = -50
-                max_temperature = 10
-            elif trigger_event.temperature == "M":
-                min_temperature = 10
-                max_temperature = 25
-            elif trigger_event.temperature == "H":
-                min_temperature = 25
-                max_temperature = 50
-            elif trigger_event.temperature == "VH":
-                min_temperature = 35
-                max_temperature = 50
-            else:
-                min_temperature = -50
-                max_temperature = 50
-            json_data += "\"ambientTemperature\": true," \
-                         "\"ambientTemperatureMinValue\": %d," \
-                         "\"ambientTemperatureMaxValue\": %d," % (min_temperature, max_temperature)
-        else:
-            json_data += "\"ambientTemperature\": false,"
-
-        if trigger_event.air_pressure is not None:
-            if trigger_event.air_pressure == "VL":
-                min_air_pressure = 300
-                max_air_pressure = 600
-            elif trigger_event.air_pressure == "L":
-                min_air_pressure = 300
-                max_air_pressure = 900
-            elif trigger_event.air_pressure == "M":
-                min_air_pressure = 900
-                max_air_pressure = 1100
-            elif trigger_event.air_pressure == "H":
-                min_air_pressure = 1100
-                max_air_pressure = 1300
-            elif trigger_event.air_pressure == "VH":
-                min_air_pressure = 1200
-                max_air_pressure = 1300
-            else:
-                min_air_pressure = 300
-                max_air_pressure = 1100
-            json_data += "\"pressure\": true," \
-                         "\"pressureMinValue\": %d," \
-                         "\"pressureMaxValue\": %d," % (min_air_pressure, max_air_pressure)
-        else:
-            json_data += "\"pressure\": false,"
-
-        if trigger_event.proximity is not None:
-            if trigger_event.proximity == "VL":
-                min_proximity = 0
-                max_proximity = 1
-            elif trigger_event.proximity == "L":
-                min_proximity = 0
-                max_proximity = 3
-            elif trigger_event.proximity == "M":
-                min_proximity = 3
-                max_proximity = 6
-            elif trigger_event.proximity == "H":
-                min_proximity = 6
-                max_proximity = 10
-            elif trigger_event.proximity == "VH":
-                min_proximity = 8
-                max_proximity = 10
-            else:
-                min_proximity = 0
-                max_proximity = 10
-            json_data += "\"proximity\": true," \
-                         "\"proximityMinValue\": %d," \
-                         "\"proximityMaxValue\": %d" % (min_proximity, max_proximity)
-        else:
-            json_data += "\"proximity\": false"
-        json_data += "},"
+            trigger_list.append({"time": trigger_time, "questionnaireIDs": [str(questionnaire_id)]})
+    return HttpResponse(encode({"studyId": str(study.id), "triggers": trigger_list}), content_type="application/json")
 
-        # questions of the questionnaire
-        json_data += _get_question_list_json(
-            _get_question_list_from_questionnaire(questionnaire)
-        )
 
-        json_data += "},"  # end of a questionnaire
-
-    json_data = json_data[:-1]  # remove the trailing comma
-    json_data += "]"  # end of all questionnaires
-    json_data += "}"  # end of study
-    json_data += "}"  # end of json
-
-    return HttpResponse(json_data, content_type="application/json")
+def _read_body(request):
+    # the request body, decompressed and written to the log; raises ValueError if it can't be decompressed
+    now = datetime.datetime.now().strftime('%m %d %H:%M:%S')
+    try:
+        body = get_request_body(request)
+    except ValueError:
+        get_request_journal().write('\n\n%s\n%s' % (now, request.body))
+        raise
+    get_request_journal().write('\n\n%s\n%s' % (now, body))
+    return body.replace(b'\\n', b'')
 
 
 @csrf_exempt
 def receive_answer(request):
-    # write received request to log
-    now = datetime.datetime.now().strftime('%m %d %H:%M:%S')
-    log = open('/usr/src/app/log.txt', 'a')
-    log.write('\n\n%s\n%s' % (now, request.body))
-
-    json_data = json.loads(request.body.replace(b'\\n', b''))
-    proband = Proband.objects.get(id=json_data['probandID'])
-    study = proband.study
-
-    if 'questionnaireID' not in json_data:  # the 3 standard proband info questions
-        # store proband info
-        if 'birthday' in json_data:
-            ProbandInfoCell.objects.create(proband=proband, key='birthday', value=json_data['birthday'])
-        if 'gender' in json_data:
-            ProbandInfoCell.objects.create(proband=proband, key='gender', value=json_data['gender'])
-        if 'occupation' in json_data:
-            ProbandInfoCell.objects.create(proband=proband, key='occupation', value=json_data['occupation'])
-
-    elif json_data['questionnaireID'] == 'probandInfoQuestionnaire':  # custom proband info questions
-        for question_item in json_data['questionAnswer']:
-
-            # get the question object
-            question_type = question_item['questionType']
-            if question_type == 'SingleChoice':
-                question = SingleChoiceQuestion.objects.get(id=question_item['questionID'])
-            elif question_type == 'TextAnswer':
-                question = TextQuestion.objects.get(id=question_item['questionID'])
-            elif question_type == 'DragScale':
-                question = DragScaleQuestion.objects.get(id=question_item['questionID'])
-            else:
-                question = MultiChoiceQuestion.objects.get(id=question_item['questionID'])
-
-            # store proband info
-            ProbandInfoCell.objects.create(proband=proband, key=question.question_text, value=question_item['answer'])
-
-    else:  # normal questionnaire
-        questionnaire = Questionnaire.objects.get(id=json_data['questionnaireID'])
-        submit_time_dict = json_data['submitTime']
-        submit_time = datetime.datetime(int(submit_time_dict['year']), int(submit_time_dict['month']),
-                                        int(submit_time_dict['day']), int(submit_time_dict['hour']),
-                                        int(submit_time_dict['minute']), int(submit_time_dict['second']))
-
-        # create questionnaire answer object
-        questionnaire_answer = QuestionnaireAnswer.objects.create(questionnaire=questionnaire, submitter=proband,
-                                                                  submit_time=submit_time)
-
-        # store sensor values of the questionnaire answer
-        for key, value in json_data['sensorValues'].items():
-            SensorValueCell.objects.create(questionnaire_answer=questionnaire_answer, key=key, value=value)
-
-        # store answers of each question
-        for question_item in json_data['questionAnswer']:
-            question_type = question_item['questionType']
-            if question_type == 'SingleChoice':
-                question = SingleChoiceQuestion.objects.get(id=question_item['questionID'])
-                SingleChoiceQuestionAnswer.objects.create(question=question, value=question_item['answer'],
-                                                          questionnaire_answer=questionnaire_answer)
-            elif question_type == 'TextAnswer':
-                question = TextQuestion.objects.get(id=question_item['questionID'])
-                TextQuestionAnswer.objects.create(question=question, value=question_item['answer'],
-                                                  questionnaire_answer=questionnaire_answer)
-            elif question_type == 'DragScale':
-                question = DragScaleQuestion.objects.get(id=question_item['questionID'])
-                DragScaleQuestionAnswer.objects.create(question=question, value=question_item['answer'],
-                                                       questionnaire_answer=questionnaire_answer)
-            elif question_type == 'MultipleChoice':
-                question = MultiChoiceQuestion.objects.get(id=question_item['questionID'])
-                MultiChoiceQuestionAnswer.objects.create(question=question, value=question_item['answer'],
-                                                         questionnaire_answer=questionnaire_answer)
-
-    study.answer_updated_times += 1  # update received answers counter
-    study.save()
+    try:
+        body = _read_body(request)
+        json_data = validate_submission(json.loads(body.decode('utf-8')))
+    except ValueError as e:
+        return HttpResponseBadRequest("Invalid submission: %s" % e, content_type="text/plain")
+    idempotency_key = get_idempotency_key(request.META.get('HTTP_IDEMPOTENCY_KEY'), body)
+
+    if settings.ANSWER_INGEST_MODE == 'queue':
+        # stored later by the process_answer_queue management command
+        get_answer_spool().append(idempotency_key, body.decode('utf-8'))
+    else:
+        try:
+            store_answer_once(idempotency_key, json_data)
+        except ObjectDoesNotExist as e:  # unknown proband, questionnaire or question
+            return HttpResponseBadRequest("Invalid submission: %s" % e, content_type="text/plain")
     return HttpResponse("OK", content_type="text/plain")
 
 
+# For app to upload the answers collected while offline:
+# {"probandID": ..., "submissions": [<submission as for receive_answer, with an optional "idempotencyKey">, ...]}
+# The response has a status for every submission, in the same order.
+@csrf_exempt
+def receive_answers(request):
+    try:
+        body = _read_body(request)
+        json_data = validate_submission_batch(json.loads(body.decode('utf-8')), settings.ANSWER_BATCH_MAX_SIZE)
+    except ValueError as e:
+        return HttpResponseBadRequest("Invalid batch: %s" % e, content_type="text/plain")
+    proband_id = str(json_data['probandID'])
+
+    result_list = []
+    item_list = []  # (position, idempotency key, submission) of the valid submissions
+    for position, submission in enumerate(json_data['submissions']):
+        try:
+            if not isinstance(submission, dict):
+                raise ValueError("submission is not an object")
+            key = submission.pop('idempotencyKey', None)
+            if key is not None and not isinstance(key, str):
+                raise ValueError("idempotencyKey is not a string")
+            if str(submission.setdefault('probandID', proband_id)) != proband_id:
+                raise ValueError("probandID differs from the batch")
+            validate_submission(submission)
+        except ValueError as e:
+            result_list.append({'status': 'invalid', 'error': str(e)})
+            continue
+        result_list.append(None)
+        # without a key, a resent submission is recognized by its content
+        idempotency_key = get_idempotency_key(key, json.dumps(submission, sort_keys=True).encode('utf-8'))
+        item_list.append((position, idempotency_key, submission))
+
+    if settings.ANSWER_INGEST_MODE == 'queue':
+        spool = get_answer_spool()
+        for position, idempotency_key, submission in item_list:
+            spool.append(idempotency_key, json.dumps(submission))
+            result_list[position] = {'status': 'queued'}
+    elif item_list:
+        try:
+            status_list = store_answers_once(proband_id, [(idempotency_key, submission)
+                                                          for position, idempotency_key, submission in item_list])
+        except Proband.DoesNotExist:
+            return HttpResponseBadRequest("Invalid batch: unknown probandID", content_type="text/plain")
+        for (position, idempotency_key, submission), status in zip(item_list, status_list):
+            result_list[position] = status
+
+    return HttpResponse(encode({'results': result_list}), content_type="application/json")
+
+
+# the last bytes of the log, ?tail=<bytes> or a range of it, ?offset=<byte>&length=<bytes>
 def view_log(request):
-    log = open('/usr/src/app/log.txt', 'r')
-    return HttpResponse(log.read(), content_type="text/plain")
+    journal = get_request_journal()
+    journal.flush()  # entries buffered by other workers show up after their next flush
+    size = journal.size()
+
+    try:
+        if 'offset' in request.GET:
+            offset = max(int(request.GET['offset']), 0)
+            length = max(int(request.GET.get('length', settings.REQUEST_JOURNAL_PAGE_BYTES)), 0)
+        else:
+            length = max(int(request.GET.get('tail', settings.REQUEST_JOURNAL_PAGE_BYTES)), 0)
+            offset = max(size - length, 0)
+    except ValueError:
+        return HttpResponseBadRequest("Invalid range", content_type="text/plain")
+
+    response = StreamingHttpResponse(journal.read(offset, length), content_type="text/plain")
+    response['X-Log-Size'] = size  # lets the reader request the next range
+    return response
+
+
+# finished background exports; served by nginx if EXPORT_ACCEL_REDIRECT_URL is set
+@staff_member_required
+def download_export(request, job_id):
+    job = get_object_or_404(ExportJob.objects.select_related('study'), id=job_id, status=ExportJob.DONE)
+    if not request.user.is_superuser and job.study.owner_id != request.user.id:
+        raise Http404
+
+    content_type = CONTENT_TYPES[job.file_format]
+    if settings.EXPORT_ACCEL_REDIRECT_URL:
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = settings.EXPORT_ACCEL_REDIRECT_URL + job.file_name
+    else:
+        try:
+            response = FileResponse(open(get_export_path(job), 'rb'), content_type=content_type)
+        except FileNotFoundError:
+            raise Http404
+    response['Content-Disposition'] = 'attachment; filename="%s_%d.%s"' % (job.kind, job.study_id, job.file_format)
+    return response
+
+
+# request metrics of all workers for Prometheus; nginx doesn't forward /metrics, it is scraped from web:8000
+def metrics(request):
+    if not settings.METRICS_ENABLED:
+        raise Http404
+    return HttpResponse(format_metrics(get_metrics_store().collect()), content_type="text/plain; version=0.0.4")
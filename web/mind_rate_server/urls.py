@@ -26,13 +26,31 @@ urlpatterns = [
     # download study to app
     url(r'^download/(?P<study_id>[0-9]+)/$', views.download, name='download'),
 
+    # download study once for a batch of new probands, /download/<study_id>/bulk/?count=<number of probands>
+    url(r'^download/(?P<study_id>[0-9]+)/bulk/$', views.bulk_download, name='bulk_download'),
+
+    # changes of a study since the revision the app has, /download/<study_id>/changes/?since=<revision>
+    url(r'^download/(?P<study_id>[0-9]+)/changes/?$', views.download_changes, name='download_changes'),
+
+    # time-based triggers of a study, /schedule/<study_id>/?from=<timestamp>&hours=<hours>
+    url(r'^schedule/(?P<study_id>[0-9]+)/$', views.schedule, name='schedule'),
+
     url(r'^proband_info/(?P<study_id>[0-9]+)/$', views.download_proband_info_questionnaire),
 
     # receive answer from app
     url(r'^receive_answer/', views.receive_answer, name='receive_answer'),
 
+    # receive a batch of answers of one proband from app
+    url(r'^receive_answers/', views.receive_answers, name='receive_answers'),
+
     url(r'^log/', views.view_log, name='log'),
 
+    # files of background exports
+    url(r'^exports/(?P<job_id>[0-9]+)/$', views.download_export, name='download_export'),
+
+    # request metrics for Prometheus, if settings.METRICS_ENABLED
+    url(r'^metrics$', views.metrics, name='metrics'),
+
     url(r'^_nested_admin/', include('nested_admin.urls')),
 
     url(r'', include('password_reset.urls')),